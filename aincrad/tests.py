@@ -1,17 +1,28 @@
+import json
+from datetime import timedelta
 from hashlib import sha256
 
+import factory
 import pytest
-from django.test.utils import override_settings
+from django.contrib.admin.sites import AdminSite
+from django.db import connection
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
 
 from arch.factories import HintFactory, ProblemFactory
 from arch.models import Hint, Problem
 from core.factories import SemesterFactory, UnitFactory, UserFactory, UserProfileFactory
+from dashboard.admin import PSetAdmin
 from dashboard.factories import PSetFactory
-from dashboard.models import Announcement
+from dashboard.models import Announcement, PSet
 from hanabi.factories import HanabiContestFactory, HanabiPlayerFactory
 from hanabi.models import HanabiParticipation, HanabiReplay
 from opal.factories import OpalPuzzleFactory
-from payments.factories import PaymentLogFactory
+from payments.admin import JobAdmin
+from payments.factories import JobFactory, PaymentLogFactory
+from payments.models import Job
 from roster.factories import (
     InvoiceFactory,
     RegistrationContainerFactory,
@@ -20,6 +31,7 @@ from roster.factories import (
     UnitInquiryFactory,
 )
 from roster.models import ApplyUUID, Invoice, Student, UnitInquiry
+from suggestions.factories import ProblemSuggestionFactory
 
 EXAMPLE_PASSWORD = "take just the first 24"
 TARGET_HASH = sha256(EXAMPLE_PASSWORD.encode("ascii")).hexdigest()
@@ -144,7 +156,7 @@ def test_init(otis, aincrad_setup):
             "token": EXAMPLE_PASSWORD,
         },
     )
-    out = resp.json()
+    out = json.loads(resp.getvalue())
     assert out["_name"] == "Root"
     assert len(out["_children"][0]["_children"]) == 10
     assert "timestamp" in out
@@ -184,6 +196,81 @@ def test_init(otis, aincrad_setup):
     assert inquiries[0]["unlock_inquiry_count"] == 8
 
 
+@pytest.mark.django_db
+@override_settings(API_TARGET_HASH=TARGET_HASH)
+def test_init_incremental(otis, aincrad_setup):
+    start = timezone.now()
+    with freeze_time(start + timedelta(hours=1)):
+        full = otis.post_20x("api", json={"action": "init", "token": EXAMPLE_PASSWORD})
+    full_content = full.getvalue()
+
+    bob_pset, bob_other_pset = PSet.objects.filter(student__user__username="bob")
+    # an old graded pset of bob's, never in the queue since the last sync
+    PSetFactory.create(
+        student__user=bob_pset.student.user,
+        student__semester__active=False,
+        status="A",
+    )
+    with freeze_time(start + timedelta(hours=2)):
+        otis.post_20x(
+            "api",
+            json={
+                "pk": bob_pset.pk,
+                "action": "grade_problem_set",
+                "token": EXAMPLE_PASSWORD,
+                "status": "A",
+            },
+        )
+        suggestion = ProblemSuggestionFactory.create(status="SUGG_NEW")
+        resp = otis.post_20x(
+            "api",
+            json={
+                "action": "init",
+                "token": EXAMPLE_PASSWORD,
+                "since": json.loads(full_content)["timestamp"],
+            },
+        )
+    content = resp.getvalue()
+    psets, inquiries, suggestions, jobs = json.loads(content)["_children"]
+    # bob's other pset is resent since its accepted count went up
+    assert [row["pk"] for row in psets["_children"]] == [bob_other_pset.pk]
+    assert psets["_children"][0]["num_accepted_current"] == 1
+    assert psets["removed"] == [bob_pset.pk]
+    assert inquiries["inquiries"] == inquiries["removed"] == []
+    assert [row["pk"] for row in suggestions["_children"]] == [suggestion.pk]
+    assert jobs["_children"] == jobs["removed"] == []
+    assert len(content) < len(full_content) / 4
+
+    otis.post_40x(
+        "api", json={"action": "init", "token": EXAMPLE_PASSWORD, "since": "yesterday"}
+    )
+
+
+@pytest.mark.django_db
+@override_settings(API_TARGET_HASH=TARGET_HASH)
+def test_init_incremental_admin_actions(otis, aincrad_setup):
+    start = timezone.now()
+    with freeze_time(start + timedelta(hours=1)):
+        full = otis.post_20x("api", json={"action": "init", "token": EXAMPLE_PASSWORD})
+    since = json.loads(full.getvalue())["timestamp"]
+
+    pset = PSet.objects.filter(status="P").first()
+    assert pset is not None
+    job = JobFactory.create(progress="JOB_SUB")
+    request = RequestFactory().post("/")
+    with freeze_time(start + timedelta(hours=2)):
+        PSetAdmin(PSet, AdminSite()).reject_pset(
+            request, PSet.objects.filter(pk=pset.pk)
+        )
+        JobAdmin(Job, AdminSite()).unassign_job(request, Job.objects.filter(pk=job.pk))
+        resp = otis.post_20x(
+            "api", json={"action": "init", "token": EXAMPLE_PASSWORD, "since": since}
+        )
+    psets, _, _, jobs = json.loads(resp.getvalue())["_children"]
+    assert pset.pk in psets["removed"]
+    assert job.pk in jobs["removed"]
+
+
 @pytest.mark.django_db
 @override_settings(API_TARGET_HASH=TARGET_HASH)
 def test_invoice(otis, aincrad_setup):
@@ -310,7 +397,7 @@ def test_email(otis, aincrad_setup):
             "token": EXAMPLE_PASSWORD,
         },
     )
-    students = resp.json()["students"]
+    students = json.loads(resp.getvalue())["students"]
     assert len(students) == 4
     for s in students:
         if s["user__username"] == "eve":
@@ -686,6 +773,74 @@ def test_grade_problem_set(otis):
     assert pset3.staff_comments == "Good job"
 
 
+@pytest.mark.django_db
+@override_settings(API_TARGET_HASH=TARGET_HASH)
+def test_grade_problem_sets(otis, django_capture_on_commit_callbacks):
+    units = UnitFactory.create_batch(4)
+    alice = StudentFactory.create()
+    alice.unlocked_units.add(units[0], units[1])
+    old = PSetFactory.create(
+        student__user=alice.user,
+        student__semester__active=False,
+        unit=units[0],
+        status="A",
+    )
+    first = PSetFactory.create(
+        student=alice, unit=units[0], next_unit_to_unlock=units[2], status="P"
+    )
+    second = PSetFactory.create(
+        student=alice, unit=units[1], next_unit_to_unlock=units[3], status="PA"
+    )
+    others = PSetFactory.create_batch(
+        20, unit=factory.Iterator(units), next_unit_to_unlock=None, status="P"
+    )
+
+    gradings = [
+        {"pk": first.pk, "status": "A", "clubs": 12, "staff_comments": "Nice"},
+        {"pk": second.pk, "status": "A", "hours": 4},
+        {"pk": first.pk, "status": "R"},
+        {"pk": 0, "status": "A"},
+        {"pk": others[0].pk, "status": "?"},
+    ] + [{"pk": pset.pk, "status": "R"} for pset in others[1:]]
+    with (
+        CaptureQueriesContext(connection) as ctx,
+        django_capture_on_commit_callbacks(execute=True) as callbacks,
+    ):
+        resp = otis.post_20x(
+            "api",
+            json={
+                "action": "grade_problem_sets",
+                "token": EXAMPLE_PASSWORD,
+                "gradings": gradings,
+            },
+        )
+    assert len(ctx.captured_queries) < 20
+    assert callbacks  # the caches are only invalidated after the commit
+    results = [r["result"] for r in resp.json()["results"]]
+    assert (
+        results
+        == ["success", "success", "duplicate", "nonexistent", "invalid"]
+        + ["success"] * 19
+    )
+
+    first.refresh_from_db()
+    second.refresh_from_db()
+    old.refresh_from_db()
+    assert (first.status, first.clubs, first.staff_comments) == ("A", 12, "Nice")
+    assert (second.status, second.hours) == ("A", 4)
+    assert first.eligible and not old.eligible
+    # only the pset that was pending (new) moves the student along
+    assert set(alice.unlocked_units.all()) == {units[1], units[2]}
+    assert PSet.objects.get(pk=others[0].pk).status == "P"
+    assert not PSet.objects.filter(pk__in=[p.pk for p in others[1:]]).exclude(
+        status="R"
+    )
+
+    otis.post_40x(
+        "api", json={"action": "grade_problem_sets", "token": EXAMPLE_PASSWORD}
+    )
+
+
 @pytest.mark.django_db
 @override_settings(API_TARGET_HASH=TARGET_HASH)
 def test_announcement(otis):
@@ -758,8 +913,9 @@ def test_opal_handler(otis):
             "token": EXAMPLE_PASSWORD,
         },
     )
-    assert len(resp.json()["puzzles"]) == 1
-    puzzle_json = resp.json()["puzzles"][0]
+    puzzles = json.loads(resp.getvalue())["puzzles"]
+    assert len(puzzles) == 1
+    puzzle_json = puzzles[0]
     assert puzzle_json["hunt__slug"] == "teammate"
     assert puzzle_json["slug"] == "tetrogram"
     assert puzzle_json["is_metapuzzle"] is True
@@ -1,7 +1,8 @@
 import json
 import logging
 import string
-from datetime import timedelta
+from collections import defaultdict
+from datetime import datetime, timedelta
 from decimal import Decimal
 from hashlib import sha256
 from json.decoder import JSONDecodeError
@@ -10,18 +11,22 @@ from typing import Any, Literal, TypedDict
 from allauth.socialaccount.models import SocialAccount
 from django.conf import settings
 from django.core.exceptions import PermissionDenied, SuspiciousOperation
+from django.db import transaction
 from django.db.models.aggregates import Sum
 from django.db.models.query import QuerySet, prefetch_related_objects
 from django.db.models.query_utils import Q
+from django.http import Http404
 from django.http.request import HttpRequest
-from django.http.response import JsonResponse
+from django.http.response import HttpResponseBase, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from sql_util.aggregates import SubqueryCount
-from unidecode import unidecode
 
 from arch.models import Hint, Problem
+from core.json_stream import StreamingJsonResponse
+from core.unit_access import invalidate_unit_access
 from dashboard.models import Announcement, PSet
 from hanabi.models import HanabiContest, HanabiParticipation, HanabiPlayer, HanabiReplay
 from opal.models import OpalPuzzle
@@ -33,6 +38,9 @@ from roster.models import (
     StudentRegistration,
     UnitInquiry,
 )
+from roster.user_search import normalize
+from roster.utils import accept_inquiries, update_student_units
+from rpg.levelsys import refresh_meters
 from suggestions.models import ProblemSuggestion
 
 logger = logging.getLogger(__name__)
@@ -52,6 +60,14 @@ class ReplayData(TypedDict):
     players: list[str]
 
 
+class GradingData(TypedDict):
+    pk: int
+    status: str
+    clubs: int | None
+    hours: float | None
+    staff_comments: str
+
+
 class JSONData(TypedDict):
     action: str
     token: str
@@ -98,6 +114,12 @@ class JSONData(TypedDict):
     uuid: str
     percent_aid: int
 
+    # incremental init; the timestamp of the previous one
+    since: str | None
+
+    # grade_problem_sets
+    gradings: list[GradingData]
+
 
 PSET_VENUEQ_INIT_QUERYSET = PSet.objects.filter(
     status__in=("PA", "PR", "P"),
@@ -154,6 +176,7 @@ INQUIRY_VENUEQ_INIT_QUERYSET = UnitInquiry.objects.filter(
     ),
 )
 INQUIRY_VENUEQ_INIT_KEYS = (
+    "pk",
     "action_type",
     "unit__group__name",
     "unit__code",
@@ -165,10 +188,8 @@ INQUIRY_VENUEQ_INIT_KEYS = (
     "unlock_inquiry_count",
     "student__user__profile__email_on_inquiry_complete",
 )
-INQUIRY_VENUEQ_AUTO_QUERYSET = UnitInquiry.objects.filter(
-    was_auto_processed=True,
-    created_at__gte=timezone.now() + timedelta(days=-2),
-)
+INQUIRY_VENUEQ_AUTO_QUERYSET = UnitInquiry.objects.filter(was_auto_processed=True)
+INQUIRY_VENUEQ_AUTO_DAYS = 2
 INQUIRY_VENUEQ_AUTO_KEYS = (
     "action_type",
     "unit__group__name",
@@ -228,92 +249,284 @@ JOB_VENUEQ_INIT_KEYS = (
 )
 
 
-def venueq_handler(action: str, data: JSONData) -> JsonResponse:
-    if action == "init":
-        output_data: dict[str, Any] = {
-            "timestamp": str(timezone.now()),
-            "_name": "Root",
-            "result": "success",
-        }
+# Rows changed this long before the client's cursor are sent again, in case
+# they were written by a transaction that committed after that sync was served
+VENUEQ_SYNC_OVERLAP = timedelta(minutes=2)
+
+
+def get_queue_changes(
+    queue: QuerySet[Any],
+    keys: tuple[str, ...],
+    since: datetime,
+    related: Q | None = None,
+) -> tuple[list[dict[str, Any]], list[int]]:
+    """Return the rows of `queue` updated after `since` or matching `related`,
+    and the pks of the rows updated after `since` that aren't in the queue
+    (any more).
+
+    Only a write to the row itself takes it out of a queue, so `related` only
+    picks more rows to send again and never adds to the removed pks."""
+    touched = Q(updated_at__gt=since)
+    touched_pks = set(queue.model.objects.filter(touched).values_list("pk", flat=True))
+    changed = touched if related is None else touched | related
+    rows = list(queue.filter(changed).values(*keys))
+    removed = sorted(touched_pks - {row["pk"] for row in rows})
+    return rows, removed
+
+
+def venueq_sync(since: datetime | None) -> dict[str, Any]:
+    """The VenueQ queues, in full if `since` is None.
+
+    Otherwise only rows changed since then are sent (each queue also lists
+    the pks of rows that have left it under "removed"), and the client
+    merges them into what it has by pk; it should pass the "timestamp" of
+    its previous sync as `since`. Only the queued rows' own updated_at is
+    consulted, so edits elsewhere (a student disabled or renamed, a semester
+    ending) only show up in a full sync, which the client should still ask
+    for every so often. Expiring "reading" entries is left to the client.
+
+    The queues of a full sync are left as querysets, to be read in chunks by
+    StreamingJsonResponse.
+    """
+    output_data: dict[str, Any] = {
+        "timestamp": str(timezone.now()),
+        "_name": "Root",
+        "result": "success",
+    }
+    reading = INQUIRY_VENUEQ_AUTO_QUERYSET.filter(
+        created_at__gte=timezone.now() - timedelta(days=INQUIRY_VENUEQ_AUTO_DAYS)
+    )
+    if since is None:
         output_data["_children"] = [
             {
                 "_name": "Problem sets",
-                "_children": list(
-                    PSET_VENUEQ_INIT_QUERYSET.values(*PSET_VENUEQ_INIT_KEYS)
-                ),
+                "_children": PSET_VENUEQ_INIT_QUERYSET.values(*PSET_VENUEQ_INIT_KEYS),
             },
             {
                 "_name": "Inquiries",
-                "inquiries": list(
-                    INQUIRY_VENUEQ_INIT_QUERYSET.values(*INQUIRY_VENUEQ_INIT_KEYS)
-                ),
-                "reading": list(
-                    INQUIRY_VENUEQ_AUTO_QUERYSET.values(*INQUIRY_VENUEQ_AUTO_KEYS)
+                "inquiries": INQUIRY_VENUEQ_INIT_QUERYSET.values(
+                    *INQUIRY_VENUEQ_INIT_KEYS
                 ),
+                "reading": reading.values(*INQUIRY_VENUEQ_AUTO_KEYS),
             },
             {
                 "_name": "Suggestions",
-                "_children": list(
-                    SUGGESTION_VENUEQ_INIT_QUERYSET.values(*SUGGESTION_VENUEQ_INIT_KEYS)
+                "_children": SUGGESTION_VENUEQ_INIT_QUERYSET.values(
+                    *SUGGESTION_VENUEQ_INIT_KEYS
                 ),
             },
             {
                 "_name": "Jobs",
-                "_children": list(
-                    JOB_VENUEQ_INIT_QUERYSET.values(*JOB_VENUEQ_INIT_KEYS)
-                ),
+                "_children": JOB_VENUEQ_INIT_QUERYSET.values(*JOB_VENUEQ_INIT_KEYS),
             },
         ]
-        return JsonResponse(output_data, status=200)
-    elif action == "accept_inquiries":
-        n = 0
-        for inquiry in UnitInquiry.objects.filter(
-            status="INQ_NEW",
-            student__semester__active=True,
-            student__legit=True,
-        ):
-            inquiry.run_accept()
-            n += 1
-        if n > 0:
-            return JsonResponse({"result": "success", "count": n}, status=200)
-        else:
-            return JsonResponse({"result": "failed", "count": 0}, status=400)
-    elif action == "grade_problem_set":
-        # mark problem set as done
-        pset = get_object_or_404(PSet, pk=data["pk"])
-        original_status = pset.status
-        pset.status = data["status"]
-        pset.clubs = data.get("clubs", None)
-        pset.hours = data.get("hours", None)
-        if "staff_comments" in data:
-            if pset.staff_comments:
-                pset.staff_comments += "\n\n" + "-" * 40 + "\n\n"
-            pset.staff_comments += data["staff_comments"]
-        pset.save()
-        # mark other problem sets for this (student, unit) no longer eligible
-        if pset.status == "A" and pset.unit is not None:
+        return output_data
+
+    since -= VENUEQ_SYNC_OVERLAP
+    # A pending pset's accepted counts change when any of the user's psets
+    # are graded, and an inquiry's unlock count when the student's others do
+    psets, removed_psets = get_queue_changes(
+        PSET_VENUEQ_INIT_QUERYSET,
+        PSET_VENUEQ_INIT_KEYS,
+        since,
+        Q(
+            student__user__in=PSet.objects.filter(updated_at__gt=since).values(
+                "student__user"
+            )
+        ),
+    )
+    inquiries, removed_inquiries = get_queue_changes(
+        INQUIRY_VENUEQ_INIT_QUERYSET,
+        INQUIRY_VENUEQ_INIT_KEYS,
+        since,
+        Q(
+            student__in=UnitInquiry.objects.filter(updated_at__gt=since).values(
+                "student"
+            )
+        ),
+    )
+    suggestions, removed_suggestions = get_queue_changes(
+        SUGGESTION_VENUEQ_INIT_QUERYSET,
+        SUGGESTION_VENUEQ_INIT_KEYS,
+        since,
+    )
+    jobs, removed_jobs = get_queue_changes(
+        JOB_VENUEQ_INIT_QUERYSET, JOB_VENUEQ_INIT_KEYS, since
+    )
+    output_data["_children"] = [
+        {"_name": "Problem sets", "_children": psets, "removed": removed_psets},
+        {
+            "_name": "Inquiries",
+            "inquiries": inquiries,
+            "reading": reading.filter(created_at__gt=since).values(
+                *INQUIRY_VENUEQ_AUTO_KEYS
+            ),
+            "removed": removed_inquiries,
+        },
+        {
+            "_name": "Suggestions",
+            "_children": suggestions,
+            "removed": removed_suggestions,
+        },
+        {"_name": "Jobs", "_children": jobs, "removed": removed_jobs},
+    ]
+    return output_data
+
+
+def grade_problem_sets(gradings: list[GradingData]) -> list[dict[str, Any]]:
+    """Apply each of `gradings` as grade_problem_set would, in one transaction.
+
+    The database work is a fixed number of bulk queries however many problem
+    sets are graded. The result for each grading, in order, is "success",
+    "nonexistent", "invalid" (an unknown status) or "duplicate" (the same
+    problem set already appeared earlier in the list, and was graded there).
+    """
+    statuses = {code for code, _ in PSet._meta.get_field("status").choices}
+    results: list[dict[str, Any]] = []
+    now = timezone.now()
+    with transaction.atomic():
+        psets = PSet.objects.select_related("student").in_bulk(
+            [grading["pk"] for grading in gradings]
+        )
+        original_statuses: dict[int, str] = {}
+        for grading in gradings:
+            pset = psets.get(grading["pk"])
+            if pset is None:
+                result = "nonexistent"
+            elif pset.pk in original_statuses:
+                result = "duplicate"
+            elif grading.get("status") not in statuses:
+                result = "invalid"
+            else:
+                original_statuses[pset.pk] = pset.status
+                pset.status = grading["status"]
+                pset.clubs = grading.get("clubs", None)
+                pset.hours = grading.get("hours", None)
+                if "staff_comments" in grading:
+                    if pset.staff_comments:
+                        pset.staff_comments += "\n\n" + "-" * 40 + "\n\n"
+                    pset.staff_comments += grading["staff_comments"]
+                pset.updated_at = now
+                result = "success"
+            results.append({"pk": grading["pk"], "result": result})
+        graded = [psets[pk] for pk in original_statuses]
+        if not graded:
+            return results
+        PSet.objects.bulk_update(
+            graded,
+            ["status", "clubs", "hours", "staff_comments", "updated_at"],
+            batch_size=500,
+        )
+
+        # mark other problem sets for each (student, unit) no longer eligible;
+        # if one batch accepts several, the last one graded stays eligible
+        accepted = {
+            (pset.student.user_id, pset.unit_id): pset.pk
+            for pset in graded
+            if pset.status == "A" and pset.unit_id is not None
+        }
+        if accepted:
+            rows = PSet.objects.filter(
+                student__user__in={user for user, _ in accepted},
+                unit__in={unit for _, unit in accepted},
+            ).values_list("pk", "student__user", "unit")
             PSet.objects.filter(
-                student__user=pset.student.user, unit=pset.unit
-            ).exclude(pk=pset.pk).update(eligible=False)
-        # Unlock
-        if (
-            pset.status == "A"
-            and original_status in ("P", "PR")
-            and pset.unit is not None
-        ):
+                pk__in=[
+                    pk
+                    for pk, user, unit in rows
+                    if (user, unit) in accepted and accepted[user, unit] != pk
+                ]
+            ).update(eligible=False)
+
+        # Unlock: replay the unit changes on each student's unlocked units
+        unlocking = [
+            pset
+            for pset in graded
+            if pset.status == "A"
+            and original_statuses[pset.pk] in ("P", "PR")
+            and pset.unit_id is not None
+        ]
+        unlocked: dict[int, set[int]] = defaultdict(set)
+        for student, unit in Student.unlocked_units.through.objects.filter(
+            student__in={pset.student_id for pset in unlocking}
+        ).values_list("student", "unit"):
+            unlocked[student].add(unit)
+        before = {student: set(units) for student, units in unlocked.items()}
+        for pset in unlocking:
+            units = unlocked[pset.student_id]
             # remove the old unit since it's done now
-            pset.student.unlocked_units.remove(pset.unit)
+            units.discard(pset.unit_id)
             # unlock the unit the student asked for
-            if pset.next_unit_to_unlock is not None:
-                if pset.student.unlocked_units.count() < 9:
-                    pset.student.unlocked_units.add(pset.next_unit_to_unlock)
+            if pset.next_unit_to_unlock_id is not None:  # type: ignore[attr-defined]
+                if len(units) < 9:
+                    units.add(pset.next_unit_to_unlock_id)  # type: ignore[attr-defined]
                 else:
                     logger.error(
                         f"{pset.student} somehow already has 9 units "
                         f"after submitting {pset.unit} "
                         f"and trying to unlock {pset.next_unit_to_unlock}."
                     )
+        update_student_units(
+            "unlocked_units",
+            added=[
+                (student, unit)
+                for student, units in unlocked.items()
+                for unit in units - before.get(student, set())
+            ],
+            removed=[
+                (student, unit)
+                for student, units in before.items()
+                for unit in units - unlocked[student]
+            ],
+        )
+
+        # bulk_update skips the post_save receivers, so do their work here,
+        # once the grades are committed and other requests can see them
+        users = {pset.student.user_id for pset in graded}
+
+        def after_commit() -> None:
+            invalidate_unit_access(users)
+            refresh_meters(users, "psets")
+
+        transaction.on_commit(after_commit)
+    return results
+
+
+def venueq_handler(action: str, data: JSONData) -> HttpResponseBase:
+    if action == "init":
+        since = None
+        if data.get("since") is not None:
+            since = parse_datetime(data["since"])
+            if since is None:
+                raise SuspiciousOperation("Malformed sync timestamp")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        return StreamingJsonResponse(venueq_sync(since), status=200)
+    elif action == "accept_inquiries":
+        n = accept_inquiries(
+            UnitInquiry.objects.filter(
+                status="INQ_NEW",
+                student__semester__active=True,
+                student__legit=True,
+            )
+        )
+        if n > 0:
+            return JsonResponse({"result": "success", "count": n}, status=200)
+        else:
+            return JsonResponse({"result": "failed", "count": 0}, status=400)
+    elif action == "grade_problem_set":
+        # mark problem set as done
+        (result,) = grade_problem_sets([data])
+        if result["result"] == "nonexistent":
+            raise Http404("No such problem set")
+        elif result["result"] == "invalid":
+            raise SuspiciousOperation(f"Invalid status {data['status']}")
         return JsonResponse({"result": "success"}, status=200)
+    elif action == "grade_problem_sets":
+        if not isinstance(data.get("gradings"), list):
+            raise SuspiciousOperation("Need a list of gradings")
+        results = grade_problem_sets(data["gradings"])
+        return JsonResponse({"result": "success", "results": results}, status=200)
     elif action == "mark_suggestion":
         suggestion = get_object_or_404(ProblemSuggestion, pk=data["pk"])
         suggestion.status = data["status"]
@@ -468,7 +681,7 @@ def invoice_handler(action: str, data: JSONData) -> JsonResponse:
     def sanitize(s: str, last: bool = False) -> str:
         return "".join(
             c
-            for c in unidecode(s).lower().split(" ")[-1 if last else 0]
+            for c in normalize(s).split(" ")[-1 if last else 0]
             if c in string.ascii_lowercase
         )
 
@@ -631,47 +844,43 @@ def hanabi_handler(action: str, data: JSONData) -> JsonResponse:
     )
 
 
-def email_handler(action: str, data: JSONData) -> JsonResponse:
+def email_handler(action: str, data: JSONData) -> StreamingJsonResponse:
     del action
     del data
-    return JsonResponse(
+    return StreamingJsonResponse(
         {
-            "students": list(
-                Student.objects.filter(
-                    semester__active=True,
-                    user__profile__email_on_announcement=True,
-                    enabled=True,
-                ).values(
-                    "user__first_name",
-                    "user__last_name",
-                    "user__username",
-                    "user__email",
-                )
+            "students": Student.objects.filter(
+                semester__active=True,
+                user__profile__email_on_announcement=True,
+                enabled=True,
+            ).values(
+                "user__first_name",
+                "user__last_name",
+                "user__username",
+                "user__email",
             )
         }
     )
 
 
-def opal_handler(action: str, data: JSONData) -> JsonResponse:
+def opal_handler(action: str, data: JSONData) -> StreamingJsonResponse:
     del action
     del data
-    return JsonResponse(
+    return StreamingJsonResponse(
         {
-            "puzzles": list(
-                OpalPuzzle.objects.all().values(
-                    "pk",
-                    "hunt__slug",
-                    "title",
-                    "slug",
-                    "order",
-                    "num_to_unlock",
-                    "content",
-                    "is_metapuzzle",
-                    "answer",
-                    "partial_answers",
-                    "credits",
-                    "hint_text",
-                )
+            "puzzles": OpalPuzzle.objects.all().values(
+                "pk",
+                "hunt__slug",
+                "title",
+                "slug",
+                "order",
+                "num_to_unlock",
+                "content",
+                "is_metapuzzle",
+                "answer",
+                "partial_answers",
+                "credits",
+                "hint_text",
             )
         }
     )
@@ -699,7 +908,7 @@ def apply_handler(action: str, data: JSONData) -> JsonResponse:
 
 
 @csrf_exempt
-def api(request: HttpRequest) -> JsonResponse:
+def api(request: HttpRequest) -> HttpResponseBase:
     if not request.method == "POST":
         raise PermissionDenied("Must use POST")
     try:
@@ -720,6 +929,7 @@ def api(request: HttpRequest) -> JsonResponse:
 
     if action in (
         "grade_problem_set",
+        "grade_problem_sets",
         "accept_inquiries",
         "mark_suggestion",
         "triage_job",
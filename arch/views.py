@@ -17,7 +17,7 @@ from reversion.views import RevisionMixin
 
 from arch.forms import ProblemSelectForm
 from arch.utils import get_disk_statement_from_puid, validate_puid
-from core.models import UserProfile
+from core.middleware import get_request_profile
 from core.utils import get_protected_file
 from otisweb.decorators import verified_required
 from otisweb.mixins import VerifiedRequiredMixin
@@ -30,6 +30,11 @@ ContextType = dict[str, Any]
 logger = logging.getLogger(__name__)
 
 
+def hints_disabled(request: HttpRequest) -> bool:
+    profile = get_request_profile(request)
+    return profile is not None and profile.disable_hints
+
+
 class HintObjectView:
     kwargs: ClassVar[dict[str, Any]] = {}
 
@@ -57,9 +62,7 @@ class HintList(VerifiedRequiredMixin, ListView[Hint]):
     problem: Problem
 
     def get_queryset(self):
-        if UserProfile.objects.filter(
-            user=self.request.user, disable_hints=True
-        ).exists():
+        if hints_disabled(self.request):
             return Hint.objects.none()
         return Hint.objects.filter(problem__puid=self.kwargs["puid"]).order_by("number")
 
@@ -85,9 +88,7 @@ class HintList(VerifiedRequiredMixin, ListView[Hint]):
         context["problem"] = self.problem
         context["html_statement"] = self.problem.get_html_statement()
         context["tex_statement"] = self.problem.get_tex_statement()
-        context["hints_disabled"] = UserProfile.objects.filter(
-            user=self.request.user, disable_hints=True
-        ).exists()
+        context["hints_disabled"] = hints_disabled(self.request)
 
         return context
 
@@ -97,9 +98,7 @@ class HintDetail(HintObjectView, VerifiedRequiredMixin, DetailView[Hint]):
     model = Hint
 
     def get_queryset(self):
-        if UserProfile.objects.filter(
-            user=self.request.user, disable_hints=True
-        ).exists():
+        if hints_disabled(self.request):
             return Hint.objects.none()
         return Hint.objects.all()
 
@@ -109,9 +108,7 @@ class HintDetailByPK(VerifiedRequiredMixin, DetailView[Hint]):
     model = Hint
 
     def get_queryset(self):
-        if UserProfile.objects.filter(
-            user=self.request.user, disable_hints=True
-        ).exists():
+        if hints_disabled(self.request):
             return Hint.objects.none()
         return Hint.objects.all()
 
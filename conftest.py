@@ -3,6 +3,7 @@ import os
 import django
 import pytest
 from django.conf import settings
+from django.core.cache import caches
 from pytest_django import Settings
 
 # Set Django settings module before any Django imports
@@ -29,3 +30,9 @@ def in_memory_default_storage(settings: Settings) -> None:
         **settings.STORAGES,
         "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
     }
+
+
+@pytest.fixture(autouse=True)
+def clear_cache() -> None:
+    for cache in caches.all():
+        cache.clear()
@@ -0,0 +1,132 @@
+"""Cache backends that count their hits and misses.
+
+Each backend here is the Django one of the same name, except that reads are
+tallied in the worker and every STATS_FLUSH_EVERY reads the tallies are added
+to counters kept in the cache itself. All workers sharing a cache therefore
+share its counters, and `get_cache_stats` reads them back for every alias.
+The counters are approximate: the file and database backends don't increment
+atomically, and tallies that haven't been flushed yet are only counted in
+the worker that holds them.
+"""
+
+import contextlib
+import threading
+from collections.abc import Iterator
+from typing import Any
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends import db, filebased, locmem, memcached, redis
+from django.core.cache.backends.base import BaseCache
+
+STATS = ("hits", "misses")
+STATS_KEY_PREFIX = "core.cache_stats"
+STATS_FLUSH_EVERY = 100
+
+_MISSING = object()
+
+
+class StatsMixin(BaseCache):
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._tallies = dict.fromkeys(STATS, 0)
+        # not _lock, which LocMemCache uses for the store it shares with
+        # every other instance of the alias
+        self._stats_lock = threading.Lock()
+        self._stats_local = threading.local()
+
+    @contextlib.contextmanager
+    def _uncounted(self) -> Iterator[None]:
+        # BaseCache implements get_many, incr and friends by calling self.get,
+        # which mustn't count those reads a second time
+        previous = getattr(self._stats_local, "uncounted", False)
+        self._stats_local.uncounted = True
+        try:
+            yield
+        finally:
+            self._stats_local.uncounted = previous
+
+    def _tally(self, hits: int, misses: int) -> None:
+        if getattr(self._stats_local, "uncounted", False):
+            return
+        with self._stats_lock:
+            self._tallies["hits"] += hits
+            self._tallies["misses"] += misses
+            if sum(self._tallies.values()) < STATS_FLUSH_EVERY:
+                return
+            tallies = self._tallies
+            self._tallies = dict.fromkeys(STATS, 0)
+        with self._uncounted():
+            for stat, count in tallies.items():
+                key = f"{STATS_KEY_PREFIX}.{stat}"
+                if count and not self.add(key, count, timeout=None):
+                    try:
+                        self.incr(key, count)
+                    except ValueError:  # evicted since the add; drop it
+                        pass
+
+    def get(self, key: str, default: Any = None, version: int | None = None) -> Any:
+        with self._uncounted():
+            value = super().get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._tally(0, 1)
+            return default
+        self._tally(1, 0)
+        return value
+
+    def get_many(self, keys: Any, version: int | None = None) -> dict[str, Any]:
+        keys = list(keys)
+        with self._uncounted():
+            found = super().get_many(keys, version=version)
+        self._tally(len(found), len(keys) - len(found))
+        return found
+
+    def clear(self) -> None:
+        with self._stats_lock:
+            self._tallies = dict.fromkeys(STATS, 0)
+        super().clear()
+
+    def get_stats(self) -> dict[str, int]:
+        """Return this cache's counters, including this worker's tallies."""
+        keys = [f"{STATS_KEY_PREFIX}.{stat}" for stat in STATS]
+        with self._uncounted():
+            stored = super().get_many(keys)
+        with self._stats_lock:
+            return {
+                stat: stored.get(f"{STATS_KEY_PREFIX}.{stat}", 0) + self._tallies[stat]
+                for stat in STATS
+            }
+
+
+class LocMemCache(StatsMixin, locmem.LocMemCache):
+    pass
+
+
+class FileBasedCache(StatsMixin, filebased.FileBasedCache):
+    pass
+
+
+class DatabaseCache(StatsMixin, db.DatabaseCache):
+    pass
+
+
+class RedisCache(StatsMixin, redis.RedisCache):
+    pass
+
+
+class PyMemcacheCache(StatsMixin, memcached.PyMemcacheCache):
+    pass
+
+
+def get_cache_stats() -> dict[str, dict[str, Any]]:
+    """Return hits, misses and hit rate for every configured cache alias."""
+    stats: dict[str, dict[str, Any]] = {}
+    for alias in settings.CACHES:
+        backend = caches[alias]
+        if not isinstance(backend, StatsMixin):
+            continue
+        row: dict[str, Any] = dict(backend.get_stats())
+        total = row["hits"] + row["misses"]
+        row["hit_rate"] = row["hits"] / total if total else None
+        stats[alias] = row
+    return stats
@@ -0,0 +1,49 @@
+from importlib.util import find_spec
+from typing import Any
+
+from django.conf import settings
+from django.core.checks import CheckMessage, Error, Tags, register
+
+
+@register(Tags.caches)
+def check_cache_shared(**kwargs: Any) -> list[CheckMessage]:
+    """Refuse a per-process cache outside of DEBUG.
+
+    The Verified bit, unit access, the last_seen log and import_export's
+    uploads are all invalidated or read back across worker processes, which
+    a per-process cache silently breaks."""
+    del kwargs
+    if settings.DEBUG or settings.CACHE_SHARED:
+        return []
+    return [
+        Error(
+            f"CACHE_BACKEND={settings.CACHE_BACKEND!r} isn't shared between "
+            "processes, which is only allowed with DEBUG on",
+            hint='Set CACHE_BACKEND to "file", "db", "redis" or "memcached".',
+            id="core.E001",
+        )
+    ]
+
+
+# The client library each cache server backend imports on first use; neither
+# is a dependency of otis-web, so deployments using one install it themselves
+CACHE_CLIENT_MODULES = {"redis": "redis", "memcached": "pymemcache"}
+
+
+@register(Tags.caches)
+def check_cache_client(**kwargs: Any) -> list[CheckMessage]:
+    """Refuse a cache server backend whose client library isn't installed,
+    which would otherwise only fail at the first cache access."""
+    del kwargs
+    module = CACHE_CLIENT_MODULES.get(settings.CACHE_BACKEND)
+    if module is None or find_spec(module) is not None:
+        return []
+    return [
+        Error(
+            f"CACHE_BACKEND={settings.CACHE_BACKEND!r} needs the {module!r} "
+            "package, which isn't installed",
+            hint=f"Install it with `uv pip install {module}`, or pick another "
+            "CACHE_BACKEND.",
+            id="core.E002",
+        )
+    ]
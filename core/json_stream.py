@@ -0,0 +1,76 @@
+"""JSON responses that are encoded while they're sent.
+
+`StreamingJsonResponse` takes the same kind of data as JsonResponse, except
+that any list in it may instead be a QuerySet (or another iterator). Those
+are read from the database CHUNK_SIZE rows at a time and encoded row by row,
+so a queue with tens of thousands of rows is never held in memory all at
+once, either as model data or as the encoded document.
+
+The bytes sent are exactly what JsonResponse would have sent for the same
+data with the querysets evaluated, so clients can't tell the difference.
+One caveat: the status line goes out before the querysets are read, so a
+database error halfway through leaves the client with truncated JSON (and
+the error in the logs) rather than a 500.
+"""
+
+import json
+from collections.abc import Iterator, Mapping
+from typing import Any
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.query import QuerySet
+from django.http.response import StreamingHttpResponse
+
+# Rows fetched from the database per round trip
+CHUNK_SIZE = 2000
+# Encoded output is sent in pieces of about this many characters
+BUFFER_SIZE = 64 * 1024
+
+
+def _iter_json(value: Any, encoder: json.JSONEncoder) -> Iterator[str]:
+    if isinstance(value, Mapping):
+        yield "{"
+        for i, (key, item) in enumerate(value.items()):
+            if not isinstance(key, str):
+                raise TypeError(f"keys must be str, not {type(key).__name__}")
+            yield (", " if i else "") + encoder.encode(key) + ": "
+            yield from _iter_json(item, encoder)
+        yield "}"
+    elif isinstance(value, QuerySet):
+        # rows of a queryset can't hold querysets themselves, so each one is
+        # encoded in one go, which is much faster than walking it
+        yield "["
+        for i, row in enumerate(value.iterator(chunk_size=CHUNK_SIZE)):
+            yield (", " if i else "") + encoder.encode(row)
+        yield "]"
+    elif isinstance(value, list | tuple | Iterator):
+        yield "["
+        for i, item in enumerate(value):
+            if i:
+                yield ", "
+            yield from _iter_json(item, encoder)
+        yield "]"
+    else:
+        yield encoder.encode(value)
+
+
+def iter_json(data: Any, buffer_size: int = BUFFER_SIZE) -> Iterator[bytes]:
+    """Encode `data` as JSON, yielding UTF-8 pieces of about `buffer_size`."""
+    encoder = DjangoJSONEncoder()
+    buffer: list[str] = []
+    length = 0
+    for piece in _iter_json(data, encoder):
+        buffer.append(piece)
+        length += len(piece)
+        if length >= buffer_size:
+            yield "".join(buffer).encode()
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    def __init__(self, data: Any, **kwargs: Any):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(iter_json(data), **kwargs)
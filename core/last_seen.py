@@ -0,0 +1,151 @@
+"""Write-behind tracking of UserProfile.last_seen.
+
+LastSeenMiddleware calls `touch`, which only talks to the cache. Each user is
+recorded at most once per LAST_SEEN_THROTTLE_SECONDS, by appending the pair
+(user, time) to a log in the cache: a counter hands out slot numbers and each
+pair is claimed under its slot with cache.add.
+
+That needs incr and add to be atomic, which only holds on a cache server
+(Redis or Memcached) and on LocMem, which locks within its one process. The
+file and database backends do both as a read followed by a write, so two
+processes could claim the same slot and one touch would silently replace the
+other. With those backends (see `uses_log`) touches skip the log and are
+written straight to the database, still at most once per throttle period.
+
+`flush` reads every slot written since the last flush and applies them with
+a single UPDATE ... CASE statement. It runs from the request that pushes the
+log past LAST_SEEN_FLUSH_THRESHOLD entries or LAST_SEEN_FLUSH_SECONDS of age,
+and from `manage.py flush_last_seen`.
+
+With a per-process cache such as LocMem each process keeps its own log and
+flushes it itself, and the management command only sees its own (empty) one.
+If the cache can't keep a counter at all, or a touch can't claim a slot in
+SLOT_CLAIM_ATTEMPTS tries, the touch is written straight away.
+A touch whose slot the flusher can't read (evicted, or not yet written when
+the flush ran) is lost; the next touch after the throttle makes up for it.
+Size the cache for a log of LAST_SEEN_FLUSH_THRESHOLD entries plus one
+throttle key per active user; a cache that culls entries early drops touches.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from core.models import UserProfile
+
+CACHE_KEY_PREFIX = "core.last_seen"
+COUNTER_KEY = f"{CACHE_KEY_PREFIX}.counter"
+# (last slot flushed, when it was flushed)
+FLUSHED_KEY = f"{CACHE_KEY_PREFIX}.flushed"
+# Unflushed slots outlive any reasonable flush interval, but don't pile up
+SLOT_TIMEOUT_SECONDS = 24 * 60 * 60
+# How many slot numbers a touch tries before writing straight to the database
+SLOT_CLAIM_ATTEMPTS = 5
+UPDATE_BATCH_SIZE = 500
+
+
+def _slot_key(slot: int) -> str:
+    return f"{CACHE_KEY_PREFIX}.slot.{slot}"
+
+
+def _get_flushed() -> tuple[int, datetime.datetime | None]:
+    return cache.get(FLUSHED_KEY, (0, None))
+
+
+def uses_log() -> bool:
+    """Whether touches go through the log in the cache, which needs atomic
+    incr and add: true for a cache server or a per-process LocMem cache."""
+    return settings.CACHE_SERVER or not settings.CACHE_SHARED
+
+
+def _claim_slot(user_id: int, when: datetime.datetime) -> int | None:
+    """Store (user_id, when) under a slot no one else has, returning its number,
+    or None if there is no counter or no free slot turned up (say the counter
+    was evicted and started over below slots that are still unflushed)."""
+    cache.add(COUNTER_KEY, 0, timeout=None)
+    for _ in range(SLOT_CLAIM_ATTEMPTS):
+        try:
+            slot = cache.incr(COUNTER_KEY)
+        except ValueError:  # no counter to be had, e.g. DummyCache
+            return None
+        if cache.add(_slot_key(slot), (user_id, when), SLOT_TIMEOUT_SECONDS):
+            return slot
+    return None
+
+
+def touch(user_id: int, when: datetime.datetime | None = None) -> None:
+    """Record that `user_id` was seen at `when`, flushing the log if it's due."""
+    throttle_key = f"{CACHE_KEY_PREFIX}.recent.{user_id}"
+    if not cache.add(throttle_key, 1, settings.LAST_SEEN_THROTTLE_SECONDS):
+        return
+    when = when or timezone.now()
+
+    slot = _claim_slot(user_id, when) if uses_log() else None
+    if slot is None:
+        write_last_seen({user_id: when})
+        return
+
+    cursor, flushed_at = _get_flushed()
+    if (
+        slot - cursor >= settings.LAST_SEEN_FLUSH_THRESHOLD
+        or slot < cursor  # the counter was evicted and started over
+        or flushed_at is None
+        or (when - flushed_at).total_seconds() >= settings.LAST_SEEN_FLUSH_SECONDS
+    ):
+        flush()
+
+
+def flush() -> int:
+    """Write every logged touch to the database; returns how many users."""
+    end = cache.get(COUNTER_KEY, 0)
+    cursor, _ = _get_flushed()
+    if end < cursor:
+        cursor = 0
+    # Claim the range first, so concurrent touches don't all flush it too.
+    # Two flushes racing for the same range is harmless, just wasteful.
+    cache.set(FLUSHED_KEY, (end, timezone.now()), timeout=None)
+    if end == cursor:
+        return 0
+
+    keys = [_slot_key(slot) for slot in range(cursor + 1, end + 1)]
+    latest: dict[int, datetime.datetime] = {}
+    for user_id, when in cache.get_many(keys).values():
+        if user_id not in latest or when > latest[user_id]:
+            latest[user_id] = when
+    cache.delete_many(keys)
+    write_last_seen(latest)
+    return len(latest)
+
+
+def write_last_seen(latest: dict[int, datetime.datetime]) -> None:
+    """Set last_seen for each user in `latest`, creating missing profiles."""
+    user_ids = list(latest)
+    updated = 0
+    for i in range(0, len(user_ids), UPDATE_BATCH_SIZE):
+        batch = user_ids[i : i + UPDATE_BATCH_SIZE]
+        updated += UserProfile.objects.filter(user__in=batch).update(
+            last_seen=Case(
+                *(When(user=user_id, then=Value(latest[user_id])) for user_id in batch),
+                output_field=DateTimeField(),
+            )
+        )
+    if updated < len(user_ids):
+        _create_missing_profiles(latest)
+
+
+def _create_missing_profiles(latest: dict[int, datetime.datetime]) -> None:
+    have_profiles = UserProfile.objects.filter(user__in=list(latest))
+    missing = set(latest) - set(have_profiles.values_list("user", flat=True))
+    UserProfile.objects.bulk_create(
+        [
+            UserProfile(user_id=user_id, last_seen=latest[user_id])
+            for user_id in User.objects.filter(pk__in=missing).values_list(
+                "pk", flat=True
+            )
+        ],
+        ignore_conflicts=True,
+    )
@@ -1,30 +1,57 @@
 import zoneinfo
 from collections.abc import Callable
+from functools import partial
 
-from django.core.cache import cache
 from django.http.request import HttpRequest
 from django.http.response import HttpResponse
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
+from .last_seen import touch
 from .models import UserProfile
 
 
+def get_request_profile(
+    request: HttpRequest, create: bool = True
+) -> UserProfile | None:
+    """Return the profile of the logged in user, creating it if `create` is set.
+
+    The profile is cached on `request.user` as `request.user.profile`, which
+    Django loads afresh for every request, so this queries at most once per
+    request however many times it's called. Anonymous users get None.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.profile  # type: ignore[union-attr]
+    except UserProfile.DoesNotExist:
+        if not create:
+            return None
+    profile, _ = UserProfile.objects.get_or_create(user=user)
+    user.profile = profile  # type: ignore[union-attr]
+    return profile
+
+
+class ProfileMiddleware:
+    """Sets `request.profile` to the lazily loaded `get_request_profile`."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest):
+        request.profile = SimpleLazyObject(partial(get_request_profile, request))  # type: ignore[attr-defined]
+        return self.get_response(request)
+
+
 class LastSeenMiddleware:
     def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
         self.get_response = get_response
 
-    # following the idea of https://stackoverflow.com/a/57344768/4826845
     def __call__(self, request: HttpRequest):
         response = self.get_response(request)
-        if not request.user.is_authenticated or not request.session.session_key:
-            return response
-        up, _ = UserProfile.objects.get_or_create(user=request.user)
-        key = f"last-seen-{request.session.session_key}"
-        recently_seen = cache.get(key)
-        if not recently_seen:
-            cache.set(key, 1, 60 * 15)  # we won't update last_seen for 15 minutes
-            up.last_seen = timezone.now()
-            up.save(update_fields=("last_seen",))
+        if request.user.is_authenticated and request.session.session_key:
+            touch(request.user.pk)
         return response
 
 
@@ -34,7 +61,7 @@ class TimezoneMiddleware:
 
     def __call__(self, request: HttpRequest):
         if request.user.is_authenticated:
-            up = UserProfile.objects.filter(user=request.user).only("timezone").first()
+            up = get_request_profile(request, create=False)
             if up and up.timezone:
                 try:
                     timezone.activate(zoneinfo.ZoneInfo(up.timezone))
@@ -0,0 +1,128 @@
+# Keeps the cached unit access (see core.unit_access), Verified bits
+# (see core.verified) and user search tokens (see roster.user_search) in step
+# with the tables they are worked out from. Writes made with QuerySet.update()
+# bypass these receivers, so code doing those calls invalidate_unit_access or
+# reindex_users itself.
+
+from typing import Any
+
+from allauth.socialaccount.models import SocialAccount
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from dashboard.models import PSet, UploadedFile
+from roster.models import Student
+from roster.user_search import reindex_users
+
+from .models import Semester
+from .unit_access import invalidate_unit_access
+from .verified import invalidate_verified
+
+
+def student_users(student_ids: Any) -> list[int]:
+    return list(
+        Student.objects.filter(pk__in=student_ids).values_list("user", flat=True)
+    )
+
+
+@receiver((post_save, post_delete), sender=PSet)
+def pset_changed(sender: type[PSet], instance: PSet, **kwargs: Any) -> None:
+    invalidate_unit_access(student_users([instance.student_id]))  # type: ignore[attr-defined]
+
+
+@receiver((post_save, post_delete), sender=UploadedFile)
+def upload_changed(
+    sender: type[UploadedFile], instance: UploadedFile, **kwargs: Any
+) -> None:
+    invalidate_unit_access(student_users([instance.benefactor_id]))  # type: ignore[attr-defined]
+
+
+@receiver(post_save, sender=Student)
+def student_changed(sender: type[Student], instance: Student, **kwargs: Any) -> None:
+    # moving semesters or being disabled can reveal solutions
+    invalidate_unit_access([instance.user_id])  # type: ignore[attr-defined]
+
+
+@receiver(post_save, sender=Semester)
+def semester_changed(sender: type[Semester], instance: Semester, **kwargs: Any) -> None:
+    users = Student.objects.filter(semester=instance).values_list("user", flat=True)
+    invalidate_unit_access(users)
+
+
+@receiver(m2m_changed, sender=Student.unlocked_units.through)
+def unlocked_units_changed(
+    sender: Any,
+    instance: Student | Any,
+    action: str,
+    reverse: bool,
+    pk_set: set[int] | None,
+    **kwargs: Any,
+) -> None:
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_unit_access([instance.user_id])
+    elif action in ("post_add", "post_remove"):
+        invalidate_unit_access(student_users(pk_set or ()))
+    elif action == "pre_clear":
+        # once cleared there's no telling whose units they were
+        invalidate_unit_access(
+            Student.objects.filter(unlocked_units=instance).values_list(
+                "user", flat=True
+            )
+        )
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def groups_changed(
+    sender: Any,
+    instance: User | Group,
+    action: str,
+    reverse: bool,
+    pk_set: set[int] | None,
+    **kwargs: Any,
+) -> None:
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_verified([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        invalidate_verified(pk_set or ())
+    elif action == "pre_clear":
+        invalidate_verified(
+            User.objects.filter(groups=instance).values_list("pk", flat=True)
+        )
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender: type[Group], instance: Group, **kwargs: Any) -> None:
+    # renaming a group to or from Verified changes all of its members
+    invalidate_verified(instance.user_set.values_list("pk", flat=True))
+
+
+# the fields of a user that roster.user_search reads
+USER_SEARCH_FIELDS = frozenset(("first_name", "last_name", "username", "email"))
+
+
+@receiver(post_save, sender=User)
+def user_saved(
+    sender: type[User],
+    instance: User,
+    update_fields: frozenset[str] | None,
+    **kwargs: Any,
+) -> None:
+    # logging in saves last_login alone, which needn't touch the index
+    if update_fields is None or update_fields & USER_SEARCH_FIELDS:
+        reindex_users([instance.pk])
+
+
+@receiver((post_save, post_delete), sender=SocialAccount)
+def social_account_changed(
+    sender: type[SocialAccount], instance: SocialAccount, **kwargs: Any
+) -> None:
+    origin = kwargs.get("origin")
+    # when the user itself is being deleted, its tokens go with it; writing
+    # them again here would stop the user from being deleted
+    if isinstance(origin, User) or getattr(origin, "model", None) is User:
+        return
+    reindex_users([instance.user_id])  # type: ignore[attr-defined]
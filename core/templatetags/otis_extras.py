@@ -43,24 +43,23 @@ def getenv(s: str) -> str:
     return os.getenv(s) or ""
 
 
+# These go through user.profile, which core.middleware.get_request_profile
+# has usually loaded already for request.user, so they cost no queries.
 @register.filter(name="getprofile")
 def getprofile(user: User) -> UserProfile | None:
+    if isinstance(user, AnonymousUser):
+        return None
     try:
-        return UserProfile.objects.get(user=user)
+        return user.profile  # type: ignore[attr-defined]
     except UserProfile.DoesNotExist:
         return None
 
 
 @register.filter(name="getconfig")
 def getconfig(user: User, config: str) -> bool:
-    if isinstance(user, AnonymousUser):
+    if (profile := getprofile(user)) is None:
         return False
-    try:
-        profile: UserProfile = UserProfile.objects.get(user=user)
-    except UserProfile.DoesNotExist:
-        return False
-    else:
-        return getattr(profile, config)
+    return getattr(profile, config)
 
 
 @register.filter(name="clubs_multiplier")
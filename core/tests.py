@@ -1,33 +1,53 @@
+import datetime
 import io
 import json
+import os
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 from typing import Any
 from unittest import mock
 
 import pytest
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.core.files.base import ContentFile
 from django.core.files.storage import storages
-from django.test.utils import override_settings
+from django.db import connection
+from django.http.response import JsonResponse
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from freezegun import freeze_time
 from pypdf import PdfReader
 from reportlab.pdfgen.canvas import Canvas
 
+from arch.factories import HintFactory
+from core import cache_stats, last_seen
+from core.checks import check_cache_client, check_cache_shared
 from core.factories import (
     GroupFactory,
     SemesterFactory,
     UnitFactory,
     UnitGroupFactory,
     UserFactory,
+    UserProfileFactory,
     mock_pdf,
 )
-from core.models import Semester
+from core.json_stream import StreamingJsonResponse, iter_json
+from core.models import Semester, UserProfile
+from core.unit_access import UnitAccess, get_unit_access, get_unit_access_bulk
 from core.utils import CACHE_MAX_AGE_SECONDS
 from core.watermark import (
     get_corner_text,
+    get_overlay_template,
     get_watermark_text,
     verify_corner_stamp,
     watermark_pdf,
 )
-from dashboard.factories import PSetFactory
+from core.watermark_cache import evict, get_watermark_cache_stats
+from dashboard.factories import PSetFactory, UploadedFileFactory
 from roster.factories import StudentFactory
 from rpg.factories import BonusLevelFactory
 
@@ -87,6 +107,60 @@ def test_staff_core_views(otis):
         otis.get_20x(v, u.pk)
 
 
+@pytest.mark.django_db
+def test_unit_access():
+    alice = StudentFactory.create()
+    old_alice = StudentFactory.create(user=alice.user, semester__active=False)
+    units = UnitFactory.create_batch(5)
+    alice.unlocked_units.add(units[0])
+    PSetFactory.create(student=alice, unit=units[1])
+    UploadedFileFactory.create(
+        benefactor=old_alice, unit=units[2], benefactor__semester__active=False
+    )
+    old_alice.semester.uses_legacy_pset_system = True
+    old_alice.semester.save()
+    old_alice.unlocked_units.add(units[3])
+    bob = StudentFactory.create()
+    bob.unlocked_units.add(units[4])
+
+    with CaptureQueriesContext(connection) as ctx:
+        access = get_unit_access_bulk([alice.user.pk, bob.user.pk])
+    assert len(ctx.captured_queries) == 1
+    pks = [u.pk for u in units]
+    assert access[alice.user.pk] == UnitAccess(
+        problems=frozenset(pks[:4]), solutions=frozenset(pks[1:4])
+    )
+    assert access[bob.user.pk] == UnitAccess(frozenset(pks[4:]), frozenset())
+
+    with CaptureQueriesContext(connection) as ctx:
+        assert get_unit_access(alice.user.pk) == access[alice.user.pk]
+    assert len(ctx.captured_queries) == 0  # cached
+
+    alice.unlocked_units.remove(units[0])
+    assert units[0].pk not in get_unit_access(alice.user.pk).problems
+    PSetFactory.create(student=bob, unit=units[4])
+    assert units[4].pk in get_unit_access(bob.user.pk).solutions
+    bob.enabled = False
+    bob.save()
+    units[0].students_unlocked.add(bob)  # type: ignore[attr-defined]
+    assert units[0].pk in get_unit_access(bob.user.pk).solutions
+
+
+@pytest.mark.django_db
+def test_unit_access_invalidated_on_commit(django_capture_on_commit_callbacks):
+    alice = StudentFactory.create()
+    unit = UnitFactory.create()
+    with django_capture_on_commit_callbacks(execute=False) as callbacks:
+        alice.unlocked_units.add(unit)
+        # another request reading before the commit caches the access again
+        assert unit.pk in get_unit_access(alice.user.pk).problems
+    with CaptureQueriesContext(connection) as ctx:
+        for callback in callbacks:
+            callback()
+        get_unit_access(alice.user.pk)
+    assert len(ctx.captured_queries) == 1  # read again after the commit
+
+
 @pytest.mark.django_db
 @override_settings(TESTING_NEEDS_MOCK_MEDIA=True)
 def test_pdf_watermark(otis):
@@ -100,7 +174,7 @@ def test_pdf_watermark(otis):
     otis.login(alice)
 
     resp = otis.get_20x("view-problems", unit.pk)
-    text = PdfReader(io.BytesIO(resp.content)).pages[0].extract_text()
+    text = PdfReader(io.BytesIO(resp.getvalue())).pages[0].extract_text()
     assert "Prob" in text  # the original content is still there
     assert "Alice Aardvark" in text
     assert alice.user.username in text
@@ -111,7 +185,7 @@ def test_pdf_watermark(otis):
     assert stamp.pk == alice.user.pk
 
     # TeX files are served as-is
-    assert otis.get_20x("view-tex", unit.pk).content == b"TeX"
+    assert otis.get_20x("view-tex", unit.pk).getvalue() == b"TeX"
 
 
 @pytest.mark.django_db
@@ -136,19 +210,26 @@ def test_watermark_text_transliteration():
     assert text.isascii()
 
 
-@pytest.mark.django_db
-def test_watermark_all_pages():
-    # A leaker sharing just one page (not necessarily the first) should still
-    # be traceable, so every page gets both stamps, not just the first.
-    alice = UserFactory.create()
+def _three_page_pdf() -> bytes:
     buffer = io.BytesIO()
     canvas = Canvas(buffer, pagesize=(612, 792))
     for i in range(3):
         canvas.drawString(72, 720, f"Page {i + 1}")
         canvas.showPage()
     canvas.save()
+    return buffer.getvalue()
+
 
-    out = watermark_pdf(buffer.getvalue(), alice)
+@pytest.mark.django_db
+@pytest.mark.parametrize("engine", ["incremental", "rewrite"])
+def test_watermark_all_pages(settings, engine: str):
+    # A leaker sharing just one page (not necessarily the first) should still
+    # be traceable, so every page gets both stamps, not just the first.
+    settings.WATERMARK_ENGINE = engine
+    alice = UserFactory.create()
+    content = _three_page_pdf()
+    out = watermark_pdf(content, alice)
+    assert out.startswith(content) == (engine == "incremental")
     reader = PdfReader(io.BytesIO(out))
     assert len(reader.pages) == 3
     for i, page in enumerate(reader.pages):
@@ -160,6 +241,43 @@ def test_watermark_all_pages():
         assert stamp.pk == alice.pk
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize("engine", ["incremental", "rewrite"])
+def test_watermark_page_sizes(settings, engine: str):
+    # Each page size gets its own layout; parentheses in names must be escaped.
+    settings.WATERMARK_ENGINE = engine
+    bob = UserFactory.create(first_name="Bob", last_name="(Robert) \\o/")
+    buffer = io.BytesIO()
+    canvas = Canvas(buffer)
+    for size in ((612, 792), (595, 842), (200, 300), (612, 792)):
+        canvas.setPageSize(size)
+        canvas.drawString(20, 20, f"{size[0]}x{size[1]}")
+        canvas.showPage()
+    canvas.save()
+
+    reader = PdfReader(io.BytesIO(watermark_pdf(buffer.getvalue(), bob)))
+    for page in reader.pages:
+        text = page.extract_text()
+        assert "Bob (Robert) \\o/" in text
+        assert verify_corner_stamp(text) is not None
+    assert get_overlay_template((0.0, 0.0, 200.0, 300.0)).margin_length == 264
+
+
+@pytest.mark.django_db
+def test_watermark_incremental_fallback(settings):
+    # A file whose cross-reference offset is off can't safely be appended to,
+    # but pypdf can still repair and rewrite it.
+    settings.WATERMARK_ENGINE = "incremental"
+    alice = UserFactory.create()
+    content = _three_page_pdf()
+    index = content.rindex(b"startxref")
+    broken = content[:index] + b"startxref\n12\n%%EOF\n"
+    out = watermark_pdf(broken, alice)
+    assert not out.startswith(broken)
+    for page in PdfReader(io.BytesIO(out)).pages:
+        assert alice.username in page.extract_text()
+
+
 @pytest.mark.django_db
 @override_settings(TESTING_NEEDS_MOCK_MEDIA=True)
 def test_protected_file_etag(otis):
@@ -230,7 +348,7 @@ def test_protected_file_etag_invalidation(otis):
     resp = otis.get("view-problems", unit.pk, headers={"if-none-match": etag})
     assert resp.status_code == 200
     assert resp.headers["ETag"] != etag
-    assert "Revised" in PdfReader(io.BytesIO(resp.content)).pages[0].extract_text()
+    assert "Revised" in PdfReader(io.BytesIO(resp.getvalue())).pages[0].extract_text()
 
 
 @pytest.mark.django_db
@@ -250,7 +368,132 @@ def test_protected_file_without_mtime(otis, error: type[Exception]):
     ):
         resp = otis.get_20x("view-problems", unit.pk)
     assert "ETag" not in resp.headers
-    assert "Prob" in PdfReader(io.BytesIO(resp.content)).pages[0].extract_text()
+    assert "Prob" in PdfReader(io.BytesIO(resp.getvalue())).pages[0].extract_text()
+
+
+@pytest.mark.django_db
+@override_settings(TESTING_NEEDS_MOCK_MEDIA=True, WATERMARK_TIMESTAMP_GRANULARITY=86400)
+def test_watermark_cache(otis, settings, tmp_path):
+    settings.WATERMARK_CACHE_DIR = str(tmp_path)
+    alice = StudentFactory.create()
+    bob = StudentFactory.create()
+    unit = UnitFactory.create()
+    alice.unlocked_units.add(unit)
+    bob.unlocked_units.add(unit)
+    otis.login(alice)
+
+    with freeze_time("2026-03-14 09:00", tz_offset=0):
+        first = otis.get_20x("view-problems", unit.pk).getvalue()
+    assert "on 2026-03-14." in PdfReader(io.BytesIO(first)).pages[0].extract_text()
+    assert get_watermark_cache_stats() == {"hits": 0, "misses": 1, "evictions": 0}
+
+    # later the same day, neither storage nor the watermarker is touched
+    protected = storages["protected"]
+    unread = mock.MagicMock()
+    unread.read.side_effect = AssertionError("fetched from storage")
+    with (
+        freeze_time("2026-03-14 21:00", tz_offset=0),
+        mock.patch("core.utils.watermark_pdf", side_effect=AssertionError),
+        mock.patch.object(protected, "open", return_value=unread),
+    ):
+        assert otis.get_20x("view-problems", unit.pk).getvalue() == first
+    assert get_watermark_cache_stats()["hits"] == 1
+
+    # a new day, a new user, or a new file each get a fresh stamp
+    with freeze_time("2026-03-15 09:00", tz_offset=0):
+        assert otis.get_20x("view-problems", unit.pk).getvalue() != first
+        otis.login(bob)
+        assert otis.get_20x("view-problems", unit.pk).getvalue() != first
+        path = f"unit-pdf/{unit.problems_pdf_filename}"
+        protected.delete(path)
+        protected.save(path, ContentFile(mock_pdf(b"Revised")))
+        resp = otis.get_20x("view-problems", unit.pk)
+    assert "Revised" in PdfReader(io.BytesIO(resp.getvalue())).pages[0].extract_text()
+    assert get_watermark_cache_stats()["misses"] == 4
+
+
+@pytest.mark.django_db
+@override_settings(TESTING_NEEDS_MOCK_MEDIA=True)
+def test_protected_file_ranges(otis, settings, tmp_path):
+    alice = StudentFactory.create()
+    unit = UnitFactory.create()
+    alice.unlocked_units.add(unit)
+    otis.login(alice)
+
+    # no cache, so no promise the next download has the same bytes
+    resp = otis.get_20x("view-problems", unit.pk, headers={"range": "bytes=0-9"})
+    assert resp.status_code == 200
+    assert "Accept-Ranges" not in resp.headers
+
+    settings.WATERMARK_CACHE_DIR = str(tmp_path)
+    full = otis.get_20x("view-problems", unit.pk)
+    assert full.headers["Accept-Ranges"] == "bytes"
+    body = full.getvalue()
+    size = len(body)
+
+    resp = otis.get("view-problems", unit.pk, headers={"range": "bytes=0-99"})
+    assert resp.status_code == 206
+    assert resp.headers["Content-Range"] == f"bytes 0-99/{size}"
+    assert resp.headers["Content-Length"] == "100"
+    assert resp.getvalue() == body[:100]
+
+    resp = otis.get("view-problems", unit.pk, headers={"range": "bytes=-50"})
+    assert resp.status_code == 206
+    assert resp.getvalue() == body[-50:]
+
+    resp = otis.get("view-problems", unit.pk, headers={"range": f"bytes={size}-"})
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == f"bytes */{size}"
+
+    # our ETags are weak, so they can't vouch for a byte range
+    resp = otis.get(
+        "view-problems",
+        unit.pk,
+        headers={"range": "bytes=0-99", "if-range": full.headers["ETag"]},
+    )
+    assert resp.status_code == 200
+    assert resp.getvalue() == body
+
+    tex = otis.get("view-tex", unit.pk, headers={"range": "bytes=1-"})
+    assert tex.status_code == 206
+    assert tex.getvalue() == b"eX"
+
+
+@pytest.mark.django_db
+def test_protected_file_memory_ceiling(otis, settings):
+    settings.PROTECTED_FILE_CHUNK_SIZE = 64 * 1024
+    alice = StudentFactory.create()
+    unit = UnitFactory.create()
+    alice.unlocked_units.add(unit)
+    big = b"% filler\n" * 2**20  # 9 MiB
+    storages["protected"].save(
+        f"unit-tex/{unit.problems_tex_filename}", ContentFile(big)
+    )
+    otis.login(alice)
+
+    # the first request imports and sets up plenty that isn't per request
+    for _ in otis.get_20x("view-tex", unit.pk).streaming_content:
+        pass
+    tracemalloc.start()
+    try:
+        resp = otis.get_20x("view-tex", unit.pk)
+        assert resp.headers["Content-Length"] == str(len(big))
+        received = sum(len(chunk) for chunk in resp.streaming_content)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert received == len(big)
+    assert peak < 2**20, f"peak of {peak} bytes to serve a {len(big)} byte file"
+
+
+def test_watermark_cache_eviction(tmp_path):
+    for i, name in enumerate(("old", "middle", "new")):
+        entry = tmp_path / f"{name}.pdf"
+        entry.write_bytes(b"x" * 100)
+        os.utime(entry, (1000 + i, 1000 + i))
+    assert evict(tmp_path, max_bytes=250) == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["middle.pdf", "new.pdf"]
+    assert evict(tmp_path, max_bytes=250) == 0
 
 
 @pytest.mark.django_db
@@ -308,6 +551,66 @@ def test_check_stamp(otis):
     otis.assert_message(resp, "No valid stamp found in that text.")
 
 
+@pytest.mark.django_db
+def test_cache_stats(otis, monkeypatch):
+    otis.get_30x("cache-stats")
+    otis.login(UserFactory.create(is_staff=True))
+    otis.get_40x("cache-stats")
+    otis.login(UserFactory.create(is_staff=True, is_superuser=True))
+
+    computed = caches["computed"]
+    computed.set("answer", 42)
+    assert computed.get("answer") == 42
+    assert computed.get_many(["answer", "question"]) == {"answer": 42}
+    resp = otis.get_20x("cache-stats")
+    row = resp.context["aliases"]["computed"]
+    assert (row["hits"], row["misses"], row["hit_rate"]) == (2, 1, 2 / 3)
+    assert set(resp.context["aliases"]) == set(settings.CACHES)
+
+    # tallies are flushed into the cache, where other workers can see them
+    monkeypatch.setattr(cache_stats, "STATS_FLUSH_EVERY", 4)
+    computed.get("question")
+    other_worker = caches.create_connection("computed")
+    assert other_worker.get_stats() == {"hits": 2, "misses": 2}
+    # instances of a LocMem alias must keep sharing the lock on their store
+    assert other_worker._lock is computed._lock
+
+
+def test_cache_config(tmp_path):
+    params = {"VERSION": 1, "OPTIONS": {"MAX_ENTRIES": 10}}
+    one = cache_stats.FileBasedCache(str(tmp_path), params)
+    two = cache_stats.FileBasedCache(str(tmp_path), params)
+    one.set("key", "value")
+    assert two.get("key") == "value"
+    assert (one.get_stats(), two.get_stats()) == (
+        {"hits": 0, "misses": 0},
+        {"hits": 1, "misses": 0},
+    )
+
+    # the next deploy doesn't see the old release's values
+    deployed = cache_stats.FileBasedCache(str(tmp_path), params | {"VERSION": 2})
+    assert deployed.get("key") is None
+
+
+def test_cache_shared_check():
+    with override_settings(DEBUG=True, CACHE_SHARED=False):
+        assert check_cache_shared() == []
+    with override_settings(DEBUG=False, CACHE_SHARED=False):
+        assert [error.id for error in check_cache_shared()] == ["core.E001"]
+    with override_settings(DEBUG=False, CACHE_SHARED=True):
+        assert check_cache_shared() == []
+
+
+def test_cache_client_check(monkeypatch):
+    assert check_cache_client() == []  # locmem needs no client
+    monkeypatch.setattr("core.checks.find_spec", lambda name: None)
+    for backend in ("redis", "memcached"):
+        with override_settings(CACHE_BACKEND=backend):
+            assert [error.id for error in check_cache_client()] == ["core.E002"]
+    with override_settings(CACHE_BACKEND="file"):
+        assert check_cache_client() == []
+
+
 @pytest.mark.django_db
 def test_sorted_unit_list(otis):
     otis.login(UserFactory.create())
@@ -749,6 +1052,141 @@ def test_timezone_middleware_does_not_create_profile():
     assert not UserProfile.objects.filter(user=user).exists()
 
 
+@pytest.mark.django_db
+@override_settings(TESTING_NEEDS_MOCK_MEDIA=True)
+def test_profile_queries_per_request(otis):
+    verified_group = GroupFactory.create(name="Verified")
+    alice = StudentFactory.create(user__groups=(verified_group,))
+    UserProfileFactory.create(user=alice.user, timezone="America/New_York")
+    unit = UnitFactory.create()
+    alice.curriculum.set([unit])
+    alice.unlocked_units.set([unit])
+    hint = HintFactory.create()
+    otis.login(alice)
+
+    pages = (
+        ("portal", alice.pk),
+        ("inquiry", alice.pk),
+        ("view-problems", unit.pk),
+        ("hint-list", hint.problem.puid),
+        ("profile",),
+    )
+    # the first request also records last_seen
+    otis.get_20x(*pages[0])
+    for page in pages:
+        with CaptureQueriesContext(connection) as ctx:
+            otis.get_20x(*page)
+        profile_queries = [
+            q for q in ctx.captured_queries if '"core_userprofile"' in q["sql"]
+        ]
+        assert len(profile_queries) <= 1, page
+
+
+@pytest.mark.django_db
+@override_settings(LAST_SEEN_FLUSH_THRESHOLD=3, LAST_SEEN_FLUSH_SECONDS=3600)
+def test_last_seen_write_behind():
+    alice, bob, carol = UserFactory.create_batch(3)
+    UserProfileFactory.create(user=alice)
+    UserProfileFactory.create(user=bob)
+    last_seen.flush()
+
+    with freeze_time("2026-03-01 12:00:00", tz_offset=0):
+        with CaptureQueriesContext(connection) as ctx:
+            last_seen.touch(alice.pk)
+            last_seen.touch(bob.pk)
+            last_seen.touch(alice.pk)  # throttled
+        assert len(ctx.captured_queries) == 0
+        assert alice.profile.last_seen < timezone.now()
+
+        # the third user fills the log and flushes it, creating carol's profile
+        with CaptureQueriesContext(connection) as ctx:
+            last_seen.touch(carol.pk)
+        assert ctx.captured_queries[0]["sql"].startswith("UPDATE")
+        assert "CASE" in ctx.captured_queries[0]["sql"]
+        for user in (alice, bob, carol):
+            assert UserProfile.objects.get(user=user).last_seen == timezone.now()
+
+    assert last_seen.flush() == 0
+
+
+@pytest.mark.django_db
+@override_settings(LAST_SEEN_FLUSH_THRESHOLD=10**6, LAST_SEEN_FLUSH_SECONDS=3600)
+def test_last_seen_slot_claim(monkeypatch):
+    alice, bob = UserFactory.create_batch(2)
+    last_seen.flush()
+    cache = caches["default"]
+    slot = cache.get(last_seen.COUNTER_KEY, 0)
+    earlier = timezone.now() - datetime.timedelta(hours=1)
+
+    # bob's touch in another process got the next number from a non-atomic
+    # incr but hasn't bumped the counter yet; alice mustn't overwrite it
+    cache.set(last_seen._slot_key(slot + 1), (bob.pk, earlier))
+    last_seen.touch(alice.pk)
+    assert cache.get(last_seen._slot_key(slot + 1)) == (bob.pk, earlier)
+    assert cache.get(last_seen._slot_key(slot + 2))[0] == alice.pk
+    assert last_seen.flush() == 2
+
+    # with no slot to be had, the touch is written at once
+    monkeypatch.setattr(last_seen, "SLOT_CLAIM_ATTEMPTS", 0)
+    last_seen.touch(bob.pk)
+    assert UserProfile.objects.get(user=bob).last_seen > earlier
+
+
+@pytest.mark.django_db
+@override_settings(
+    CACHE_SHARED=True,
+    CACHE_SERVER=False,
+    LAST_SEEN_FLUSH_THRESHOLD=10**6,
+    LAST_SEEN_FLUSH_SECONDS=3600,
+)
+def test_last_seen_without_atomic_cache():
+    # e.g. the file cache, whose add and incr aren't atomic across processes
+    alice = UserFactory.create()
+    last_seen.flush()
+    with freeze_time("2026-03-01 12:00:00", tz_offset=0):
+        last_seen.touch(alice.pk)
+        assert UserProfile.objects.get(user=alice).last_seen == timezone.now()
+    assert last_seen.flush() == 0
+
+
+@pytest.mark.django_db
+@override_settings(
+    LAST_SEEN_FLUSH_THRESHOLD=10**6,
+    LAST_SEEN_FLUSH_SECONDS=3600,
+)
+def test_last_seen_concurrent_touches():
+    users = UserFactory.create_batch(200)
+    last_seen.flush()
+
+    # touches don't use the database, so threads are fine here
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(last_seen.touch, [u.pk for u in users for _ in range(3)]))
+
+    with CaptureQueriesContext(connection) as ctx:
+        assert last_seen.flush() == 200
+    assert len(ctx.captured_queries) <= 4
+    assert not UserProfile.objects.filter(
+        user__in=users, last_seen__lt=timezone.now() - datetime.timedelta(minutes=1)
+    ).exists()
+
+
+@pytest.mark.django_db
+@override_settings(
+    CACHES={
+        **settings.CACHES,
+        "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    }
+)
+def test_last_seen_without_cache(otis):
+    alice = UserFactory.create()
+    UserProfileFactory.create(user=alice)
+    otis.login(alice)
+    otis.get_ok("profile")
+    assert UserProfile.objects.get(user=alice).last_seen > timezone.now() - (
+        datetime.timedelta(minutes=1)
+    )
+
+
 @pytest.mark.django_db
 def test_timezone_in_profile_form(otis):
     from core.models import UserProfile
@@ -810,3 +1248,41 @@ def test_profile_timezone_search_js(otis):
     assert "Los_Angeles" in content
     assert "Asia/Seoul" in content
     assert "Europe/Vienna" in content
+
+
+@pytest.mark.django_db
+def test_streaming_json_matches_json_response():
+    SemesterFactory.create_batch(3)
+    UserFactory.create(first_name="Bôb", last_name='"Quoted"')
+    data = {
+        "semesters": Semester.objects.values("pk", "name", "first_payment_deadline"),
+        "users": User.objects.values("first_name", "last_name", "date_joined"),
+        "nested": [{"a": (1, 2.5, None)}, [], {}, iter(["x", True])],
+        "decimal": Decimal("12.50"),
+        "empty": User.objects.none().values("pk"),
+    }
+    expected = {
+        "semesters": list(data["semesters"]),
+        "users": list(data["users"]),
+        "nested": [{"a": (1, 2.5, None)}, [], {}, ["x", True]],
+        "decimal": Decimal("12.50"),
+        "empty": [],
+    }
+    response = StreamingJsonResponse(data)
+    assert response["Content-Type"] == "application/json"
+    assert response.getvalue() == JsonResponse(expected).content
+
+    with pytest.raises(TypeError):
+        b"".join(iter_json({1: "keys must be strings"}))
+
+
+def test_streaming_json_memory():
+    rows = (
+        {"pk": i, "name": f"Student {i}", "feedback": "x" * 200} for i in range(50_000)
+    )
+    tracemalloc.start()
+    size = sum(len(piece) for piece in iter_json({"rows": rows}, buffer_size=4096))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert size > 50_000 * 200
+    assert peak < 2**20
@@ -0,0 +1,108 @@
+"""Which units' problems and solutions a user may download.
+
+A student may see the problems for a unit they have unlocked or submitted a
+problem set for, and the solutions once they've submitted (or, for students
+from past semesters and disabled students, as soon as it is unlocked).
+
+The answer for each user is one query, cached until one of the receivers in
+core.signals notices a change; see `invalidate_unit_access`.
+"""
+
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q, Value
+
+from dashboard.models import PSet, UploadedFile
+from roster.models import Student
+
+CACHE_KEY_PREFIX = "core.unit_access"
+# A safety net for writes that slip past the signal handlers. A per-process
+# cache only hears about changes made in its own process, so there it's all
+# that makes a change in another process apply.
+CACHE_TIMEOUT_SECONDS = 15 * 60 if settings.CACHE_SHARED else 60
+
+
+class UnitAccess(NamedTuple):
+    problems: frozenset[int]
+    solutions: frozenset[int]
+
+
+def _cache_key(user_id: int) -> str:
+    return f"{CACHE_KEY_PREFIX}.{user_id}"
+
+
+def _query_unit_access(user_ids: Iterable[int]) -> dict[int, UnitAccess]:
+    """Work out the unit access of each of `user_ids` in a single query."""
+    user_ids = list(user_ids)
+    always = ExpressionWrapper(Value(True), output_field=BooleanField())
+    psets = (
+        PSet.objects.filter(student__user__in=user_ids)
+        .annotate(solutions=always)
+        .values_list("student__user", "unit", "solutions")
+        .order_by()
+    )
+    uploads = (
+        UploadedFile.objects.filter(
+            benefactor__semester__uses_legacy_pset_system=True,
+            benefactor__user__in=user_ids,
+            category="psets",
+            unit__isnull=False,
+        )
+        .annotate(solutions=always)
+        .values_list("benefactor__user", "unit", "solutions")
+        .order_by()
+    )
+    unlocked = (
+        Student.unlocked_units.through.objects.filter(student__user__in=user_ids)
+        .annotate(
+            solutions=ExpressionWrapper(
+                Q(student__semester__active=False) | Q(student__enabled=False),
+                output_field=BooleanField(),
+            )
+        )
+        .values_list("student__user", "unit", "solutions")
+        .order_by()
+    )
+
+    problems: dict[int, set[int]] = {user_id: set() for user_id in user_ids}
+    solutions: dict[int, set[int]] = {user_id: set() for user_id in user_ids}
+    for user_id, unit_id, may_see_solutions in psets.union(uploads, unlocked, all=True):
+        problems[user_id].add(unit_id)
+        if may_see_solutions:
+            solutions[user_id].add(unit_id)
+    return {
+        user_id: UnitAccess(frozenset(problems[user_id]), frozenset(solutions[user_id]))
+        for user_id in user_ids
+    }
+
+
+def get_unit_access_bulk(user_ids: Iterable[int]) -> dict[int, UnitAccess]:
+    """Return the unit access of each of `user_ids`, querying only for misses."""
+    keys = {_cache_key(user_id): user_id for user_id in user_ids}
+    found = caches["computed"].get_many(keys)
+    access = {keys[key]: value for key, value in found.items()}
+    if missing := [user_id for key, user_id in keys.items() if key not in found]:
+        fresh = _query_unit_access(missing)
+        caches["computed"].set_many(
+            {_cache_key(user_id): value for user_id, value in fresh.items()},
+            timeout=CACHE_TIMEOUT_SECONDS,
+        )
+        access.update(fresh)
+    return access
+
+
+def get_unit_access(user_id: int) -> UnitAccess:
+    return get_unit_access_bulk([user_id])[user_id]
+
+
+def invalidate_unit_access(user_ids: Iterable[int]) -> None:
+    """Forget the unit access of each of `user_ids`, now and again when the
+    current transaction commits, since a request reading in between would
+    cache what the transaction is about to change."""
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    caches["computed"].delete_many(keys)
+    transaction.on_commit(lambda: caches["computed"].delete_many(keys))
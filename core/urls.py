@@ -23,6 +23,7 @@ urlpatterns = [
     path(r"dismiss/news/", views.dismiss, name="dismiss-news"),
     path(r"calendar/", views.calendar, name="calendar"),
     path(r"userinfo/<int:pk>/", views.UserInfoView.as_view(), name="user-info"),
+    path(r"cache-stats/", views.cache_stats, name="cache-stats"),
     path(
         r"check-stamp/",
         views.check_stamp,
@@ -1,5 +1,11 @@
+import io
 import logging
+import os
+import re
+from collections.abc import Iterator
+from typing import IO
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from django.core.files.storage import Storage, storages
@@ -7,13 +13,21 @@ from django.http import Http404, HttpRequest
 from django.http.response import (
     HttpResponse,
     HttpResponseBadRequest,
+    HttpResponseBase,
     HttpResponseServerError,
+    StreamingHttpResponse,
 )
 from django.utils.cache import get_conditional_response
 from django.utils.crypto import salted_hmac
 
-from core.models import UserProfile
+from core.middleware import get_request_profile
 from core.watermark import watermark_pdf
+from core.watermark_cache import (
+    get_cache_key,
+    get_watermark_time,
+    open_cached_pdf,
+    store_cached_pdf,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -22,31 +36,123 @@ ETAG_LENGTH = 32
 
 CACHE_MAX_AGE_SECONDS = 15 * 60
 
+BYTE_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
 
-def get_protected_etag(storage: Storage, path: str, user: User) -> str | None:
+def get_protected_mtime(storage: Storage, path: str) -> float | None:
     try:
-        mtime = storage.get_modified_time(path)
+        return storage.get_modified_time(path).timestamp()
     except Exception:
         logger.exception("Could not stat %s, serving it unconditionally", path)
         return None
-    payload = f"{path}:{mtime.timestamp()}:{user.pk}"
+
+
+def get_protected_etag(path: str, mtime: float | None, user: User) -> str | None:
+    if mtime is None:
+        return None
+    payload = f"{path}:{mtime}:{user.pk}"
     digest = salted_hmac(ETAG_SALT, payload, algorithm="sha256").hexdigest()
     return f'W/"{digest[:ETAG_LENGTH]}"'
 
 
-def add_cache_headers(response: HttpResponse, etag: str | None) -> HttpResponse:
+def add_cache_headers(response: HttpResponseBase, etag: str | None) -> HttpResponseBase:
     if etag is not None:
         response["ETag"] = etag
     response["Cache-Control"] = f"private, max-age={CACHE_MAX_AGE_SECONDS}"
     return response
 
 
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def get_byte_range(
+    request: HttpRequest, size: int, etag: str | None
+) -> tuple[int, int] | None:
+    """Return the (first, last) byte asked for by a Range header, if any.
+
+    Only a single range is supported; for anything else, or an If-Range
+    naming another version, the whole file is served instead.
+    """
+    header = request.headers.get("Range")
+    if header is None:
+        return None
+    # A weak validator never matches an If-Range (RFC 9110, section 13.1.5)
+    if_range = request.headers.get("If-Range")
+    if if_range is not None and (
+        etag is None or etag.startswith("W/") or if_range != etag
+    ):
+        return None
+    match = BYTE_RANGE_RE.fullmatch(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None  # syntactically invalid, so ignored
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start > end:
+        raise UnsatisfiableRange
+    return start, end
+
+
+def iter_file(file: IO[bytes], start: int, length: int) -> Iterator[bytes]:
+    """Yield `length` bytes of `file` from `start` a chunk at a time, then close it."""
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(settings.PROTECTED_FILE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def stream_file(
+    request: HttpRequest,
+    file: IO[bytes],
+    size: int,
+    etag: str | None,
+    allow_ranges: bool,
+) -> HttpResponseBase:
+    """Stream `file` to the client, honoring a Range header if `allow_ranges`.
+
+    The response takes ownership of `file` and closes it when it's done.
+    """
+    byte_range = None
+    if allow_ranges:
+        try:
+            byte_range = get_byte_range(request, size, etag)
+        except UnsatisfiableRange:
+            file.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(
+        iter_file(file, start, end - start + 1), status=206 if byte_range else 200
+    )
+    response["Content-Length"] = str(end - start + 1)
+    if byte_range is not None:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if allow_ranges:
+        response["Accept-Ranges"] = "bytes"
+    return response
+
+
 def get_protected_file(
     folder: str, filename: str, request: HttpRequest, missing_is_404: bool = False
 ):
     if not isinstance(request.user, User):
         raise PermissionDenied("Only logged in users may query core storage.")
-    profile, _ = UserProfile.objects.get_or_create(user=request.user)
+    profile = get_request_profile(request)
+    assert profile is not None
     inline_pdf = profile.inline_pdf
     inline_tex = profile.inline_tex
     ext = filename[-4:]
@@ -64,24 +170,43 @@ def get_protected_file(
         logger.critical(errmsg)
         return HttpResponseServerError("File not found")
 
-    with file:
-        etag = get_protected_etag(storage, path, request.user)
-        conditional_response = get_conditional_response(request, etag=etag)
-        if conditional_response is not None:
-            return add_cache_headers(conditional_response, etag)
-        content = file.read()
-
-    if ext == ".pdf":
-        response = HttpResponse(content=watermark_pdf(content, request.user))
-        response["Content-Type"] = "application/pdf"
-        response["Content-Disposition"] = (
-            f'{"inline" if inline_pdf else "attachment"}; filename="{filename}"'
-        )
-    else:
-        response = HttpResponse(content=content)
+    mtime = get_protected_mtime(storage, path)
+    etag = get_protected_etag(path, mtime, request.user)
+    conditional_response = get_conditional_response(request, etag=etag)
+    if conditional_response is not None:
+        file.close()
+        return add_cache_headers(conditional_response, etag)
+
+    if ext == ".tex":
+        # the storage file goes out as-is, so it's read a chunk at a time
+        response = stream_file(request, file, file.size, etag, allow_ranges=True)
         response["Content-Type"] = "text/plain; charset=utf-8"
         response["Content-Disposition"] = (
             f'{"inline" if inline_tex else "attachment"}; filename="{filename}"'
         )
+        return add_cache_headers(response, etag)
+
+    when = get_watermark_time()
+    # Without an mtime we can't tell a stale entry from a fresh one
+    cache_key = (
+        None if mtime is None else get_cache_key(path, mtime, request.user, when)
+    )
+    cached = None if cache_key is None else open_cached_pdf(cache_key)
+    if cached is not None:
+        # the file is only fetched from storage once it is read
+        file.close()
+        output, size, cacheable = cached, os.fstat(cached.fileno()).st_size, True
+    else:
+        with file:
+            watermarked = watermark_pdf(file.read(), request.user, when)
+        # Byte ranges are only safe to serve when every request for this
+        # version of the file sees the same bytes, that is, out of the cache.
+        cacheable = cache_key is not None and store_cached_pdf(cache_key, watermarked)
+        output, size = io.BytesIO(watermarked), len(watermarked)
 
+    response = stream_file(request, output, size, etag, allow_ranges=cacheable)
+    response["Content-Type"] = "application/pdf"
+    response["Content-Disposition"] = (
+        f'{"inline" if inline_pdf else "attachment"}; filename="{filename}"'
+    )
     return add_cache_headers(response, etag)
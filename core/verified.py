@@ -0,0 +1,41 @@
+"""Whether a user is in the Verified group, without a query per request.
+
+The answer is kept in the "computed" cache until one of the receivers in
+core.signals notices the user's groups change; see `invalidate_verified`.
+"""
+
+from collections.abc import Iterable
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+
+VERIFIED_GROUP = "Verified"
+CACHE_KEY_PREFIX = "core.verified"
+# A safety net for writes that slip past the signal handlers. A per-process
+# cache only hears about changes made in its own process, so there it's all
+# that makes a change in another process apply.
+CACHE_TIMEOUT_SECONDS = 60 * 60 if settings.CACHE_SHARED else 60
+
+
+def _cache_key(user_id: int) -> str:
+    return f"{CACHE_KEY_PREFIX}.{user_id}"
+
+
+def is_verified(user: User) -> bool:
+    """Return whether `user` is in the Verified group (staff aren't implied)."""
+    cache = caches["computed"]
+    key = _cache_key(user.pk)
+    if (verified := cache.get(key)) is None:
+        verified = user.groups.filter(name=VERIFIED_GROUP).exists()
+        cache.set(key, verified, CACHE_TIMEOUT_SECONDS)
+    return verified
+
+
+def invalidate_verified(user_ids: Iterable[int]) -> None:
+    """Forget the Verified bit of each of `user_ids`, now and again when the
+    current transaction commits (see `invalidate_unit_access`)."""
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    caches["computed"].delete_many(keys)
+    transaction.on_commit(lambda: caches["computed"].delete_many(keys))
@@ -2,6 +2,7 @@ import zoneinfo
 from typing import Any
 
 from braces.views import LoginRequiredMixin
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import AnonymousUser, User
@@ -30,17 +31,21 @@ from django.views.generic.edit import UpdateView
 from django.views.generic.list import ListView
 from sql_util.utils import Exists
 
+from core.middleware import get_request_profile
 from core.models import EMAIL_PREFERENCE_FIELDS, Semester, UserProfile
-from dashboard.models import PSet, UploadedFile
+from dashboard.models import PSet
 from otisweb.decorators import admin_required, staff_required, verified_required
 from otisweb.mixins import AdminRequiredMixin
 from otisweb.utils import AuthHttpRequest
 from roster.models import Student
 
+from .cache_stats import get_cache_stats
 from .forms import CatalogFilterForm, CheckStampForm
 from .models import Unit, UnitGroup
+from .unit_access import get_unit_access
 from .utils import get_protected_file
 from .watermark import verify_corner_stamp
+from .watermark_cache import get_watermark_cache_stats
 
 # Create your views here.
 
@@ -227,31 +232,8 @@ def permitted(unit: Unit, request: HttpRequest, asking_solution: bool) -> bool:
         return True
     elif isinstance(request.user, AnonymousUser):
         return False
-    elif (
-        PSet.objects.filter(student__user=request.user, unit=unit).exists()
-        or UploadedFile.objects.filter(
-            benefactor__semester__uses_legacy_pset_system=True,
-            benefactor__user=request.user,
-            category="psets",
-            unit=unit,
-        ).exists()
-        or (
-            not asking_solution
-            and Student.objects.filter(user=request.user, unlocked_units=unit).exists()
-        )
-        or Student.objects.filter(
-            user=request.user,
-            unlocked_units=unit,
-            semester__active=False,
-        ).exists()
-        or Student.objects.filter(
-            user=request.user,
-            unlocked_units=unit,
-            enabled=False,
-        ).exists()
-    ):
-        return True
-    return False
+    access = get_unit_access(request.user.pk)
+    return unit.pk in (access.solutions if asking_solution else access.problems)
 
 
 @login_required
@@ -312,7 +294,8 @@ class UserProfileUpdateView(
         return f"Updated settings for {self.object.user.username}!"
 
     def get_object(self, queryset: QuerySet[Model] | None = None) -> UserProfile:
-        userprofile, _ = UserProfile.objects.get_or_create(user=self.request.user)
+        userprofile = get_request_profile(self.request)
+        assert userprofile is not None
         return userprofile
 
     def get_context_data(self, **kwargs):
@@ -349,7 +332,7 @@ class UserProfileUpdateView(
 def dismiss(request: AuthHttpRequest) -> JsonResponse:
     if not request.method == "POST":
         raise PermissionDenied("Must use POST")
-    profile = get_object_or_404(UserProfile, user=request.user)
+    profile = request.profile
     profile.last_notif_dismiss = timezone.now()
     profile.save()
     return JsonResponse({"result": "success"})
@@ -401,6 +384,17 @@ def check_stamp(request: HttpRequest) -> HttpResponse:
     return render(request, "core/check_stamp.html", context)
 
 
+@admin_required
+def cache_stats(request: HttpRequest) -> HttpResponse:
+    context: dict[str, Any] = {
+        "aliases": get_cache_stats(),
+        "watermark": get_watermark_cache_stats(),
+        "backend": settings.CACHE_BACKEND,
+        "version": settings.CACHE_VERSION,
+    }
+    return render(request, "core/cache_stats.html", context)
+
+
 @staff_required
 def unit_dump(request: HttpRequest) -> JsonResponse:
     del request
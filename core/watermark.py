@@ -4,18 +4,30 @@ See `verify_corner_stamp` for how to check a stamp's authenticity.
 """
 
 import datetime
+import functools
 import hmac
 import io
 import logging
 import re
 from typing import NamedTuple
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.crypto import salted_hmac
 from pypdf import PageObject, PdfReader, PdfWriter
-from reportlab.lib.colors import Color
-from reportlab.pdfgen.canvas import Canvas
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+)
+from reportlab.pdfbase.pdfmetrics import getFont
 from unidecode import unidecode
 
 logger = logging.getLogger(__name__)
@@ -25,30 +37,46 @@ FONT_SIZE = 7
 MIN_FONT_SIZE = 4
 RIGHT_MARGIN = 12  # points from the right edge of the page to the text baseline
 END_MARGIN = 18  # points of clearance at the top and bottom of the page
-VISIBLE_COLOR = Color(0.45, 0.45, 0.45, alpha=0.85)
+VISIBLE_RGB = (0.45, 0.45, 0.45)
+VISIBLE_ALPHA = 0.85
 
 CORNER_MARGIN = 8  # points from the bottom-right corner of the page
 CORNER_FONT_SIZE = 6
-INVISIBLE_COLOR = Color(1, 1, 1, alpha=0.05)
+INVISIBLE_ALPHA = 0.05  # and white
 
 WATERMARK_SALT = "core.watermark"
 SIG_LENGTH = 32  # hex chars (128 bits) of the HMAC-SHA256 digest; plenty
 CORNER_STAMP_RE = re.compile(rf"OTIS PK (\d+) TS (\d+) SIG ([0-9a-f]{{{SIG_LENGTH}}})")
 
+# Resource names used by the stamps
+STAMP_FONT = "/OTISStampFont"
+VISIBLE_GS = "/OTISVisible"
+INVISIBLE_GS = "/OTISInvisible"
+STAMP_XOBJECT = "/OTISStamp"  # when appended as a form XObject
+XREF_STREAM_RE = re.compile(rb"\d+\s+\d+\s+obj")
 
-def get_watermark_text(user: User) -> str:
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def get_watermark_text(user: User, when: datetime.datetime | None = None) -> str:
     """Return the line of text identifying `user` as the downloader.
 
     The stamp font only covers ASCII, so names are transliterated; a name
     unidecode can't render as anything meaningful is dropped rather than
     shown as boxes, falling back to username/email.
+    The time of day is left out when watermark timestamps are day-granular.
     """
     full_name = unidecode(user.get_full_name()).strip()
     username = unidecode(user.username).strip()
     parts = [full_name, username, user.email]
     who = " / ".join(part for part in parts if part)
-    when = timezone.now().strftime("%Y-%m-%d %H:%M %Z")
-    return f"Downloaded from OTIS by {who} on {when}. Not for redistribution."
+    when = when or timezone.now()
+    if settings.WATERMARK_TIMESTAMP_GRANULARITY % SECONDS_PER_DAY == 0:
+        stamp = when.strftime("%Y-%m-%d")
+    else:
+        stamp = when.strftime("%Y-%m-%d %H:%M %Z")
+    return f"Downloaded from OTIS by {who} on {stamp}. Not for redistribution."
 
 
 def _sign(payload: str) -> str:
@@ -58,9 +86,9 @@ def _sign(payload: str) -> str:
     ]
 
 
-def get_corner_text(user: User) -> str:
+def get_corner_text(user: User, when: datetime.datetime | None = None) -> str:
     """Return the invisible corner stamp: a signed pk and timestamp."""
-    epoch = int(timezone.now().timestamp())
+    epoch = int((when or timezone.now()).timestamp())
     sig = _sign(f"{user.pk}:{epoch}")
     return f"OTIS PK {user.pk} TS {epoch} SIG {sig}"
 
@@ -82,95 +110,382 @@ def verify_corner_stamp(text: str) -> CornerStamp | None:
     return CornerStamp(pk=int(pk), when=when)
 
 
-def _build_margin_overlay(text: str, page: PageObject) -> PageObject:
-    """Return a single-page PDF holding the rotated right-margin stamp."""
-    box = page.mediabox
-    bottom = float(box.bottom)
-    right, top = float(box.right), float(box.top)
+class OverlayTemplate(NamedTuple):
+    """Where the stamps go on pages of one size; see `get_overlay_template`."""
+
+    bbox: tuple[float, float, float, float]
+    margin_x: float  # baseline of the rotated margin stamp
+    margin_middle: float  # height the margin stamp is centered on
+    margin_length: float  # room the margin stamp has to fit in
+    corner_x: float  # where the corner stamp ends
+    corner_y: float  # baseline of the corner stamp
+
+
+@functools.lru_cache(maxsize=64)
+def get_overlay_template(box: tuple[float, float, float, float]) -> OverlayTemplate:
+    """Return the stamp layout for pages with mediabox `box`.
+
+    Only a handful of page sizes ever turn up, so this is worked out once
+    per size per process; filling in a user's text is then just a couple
+    of width lookups and string formatting.
+    """
+    _, bottom, right, top = box
+    return OverlayTemplate(
+        bbox=box,
+        margin_x=right - RIGHT_MARGIN,
+        margin_middle=(bottom + top) / 2,
+        margin_length=(top - bottom) - 2 * END_MARGIN,
+        corner_x=right - CORNER_MARGIN,
+        corner_y=bottom + CORNER_MARGIN,
+    )
+
+
+def _num(x: float) -> str:
+    return f"{x:.3f}".rstrip("0").rstrip(".")
+
+
+def _encode(text: str) -> bytes:
+    """Return `text` in the stamp font's encoding."""
+    return text.encode("cp1252", errors="replace")
+
+
+@functools.cache
+def _glyph_widths() -> tuple[int, ...]:
+    """Return the stamp font's glyph widths by byte, in thousandths of an em."""
+    font = getFont(FONT_NAME)
+    return tuple(font.widths)  # type: ignore[attr-defined]
+
+
+def _text_width(encoded: bytes, font_size: float) -> float:
+    return sum(map(_glyph_widths().__getitem__, encoded)) * font_size / 1000
 
-    buffer = io.BytesIO()
-    canvas = Canvas(buffer, pagesize=(right, top))
-    canvas.setFillColor(VISIBLE_COLOR)
 
-    # Shrink to fit between the top and bottom margins.
+def _pdf_string(encoded: bytes) -> str:
+    """Return `encoded` as a PDF literal string."""
+    text = encoded.decode("latin-1")
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"({escaped})"
+
+
+def _fit_font_size(encoded: bytes, length: float) -> tuple[float, float]:
+    """Return the largest allowed font size at which the text fits in `length`,
+    and the text's width at that size."""
+    # Glyph widths scale with the font size, so one lookup does.
+    width = _text_width(encoded, FONT_SIZE)
     font_size = FONT_SIZE
-    max_length = (top - bottom) - 2 * END_MARGIN
-    while (
-        font_size > MIN_FONT_SIZE
-        and canvas.stringWidth(text, FONT_NAME, font_size) > max_length
-    ):
+    while font_size > MIN_FONT_SIZE and width * font_size / FONT_SIZE > length:
         font_size -= 0.5
+    return font_size, width * font_size / FONT_SIZE
+
+
+def get_stamp_ops(
+    margin_text: str, corner_text: str, template: OverlayTemplate
+) -> bytes:
+    """Return content stream operators drawing both stamps."""
+    margin = _encode(margin_text)
+    corner = _encode(corner_text)
+    font_size, margin_width = _fit_font_size(margin, template.margin_length)
+    margin_start = template.margin_middle - margin_width / 2
+    corner_start = template.corner_x - _text_width(corner, CORNER_FONT_SIZE)
+    r, g, b = VISIBLE_RGB
+    ops = (
+        # the margin stamp runs up the page, rotated a quarter turn
+        f"q {VISIBLE_GS} gs {_num(r)} {_num(g)} {_num(b)} rg "
+        f"BT {STAMP_FONT} {_num(font_size)} Tf "
+        f"0 1 -1 0 {_num(template.margin_x)} {_num(margin_start)} Tm "
+        f"{_pdf_string(margin)} Tj ET Q\n"
+        f"q {INVISIBLE_GS} gs 1 1 1 rg "
+        f"BT {STAMP_FONT} {_num(CORNER_FONT_SIZE)} Tf "
+        f"1 0 0 1 {_num(corner_start)} {_num(template.corner_y)} Tm "
+        f"{_pdf_string(corner)} Tj ET Q\n"
+    )
+    return ops.encode("latin-1")
+
+
+def _stamp_resources() -> DictionaryObject:
+    """Return the resources `get_stamp_ops` refers to."""
+    return DictionaryObject(
+        {
+            NameObject("/Font"): DictionaryObject(
+                {
+                    NameObject(STAMP_FONT): DictionaryObject(
+                        {
+                            NameObject("/Type"): NameObject("/Font"),
+                            NameObject("/Subtype"): NameObject("/Type1"),
+                            NameObject("/BaseFont"): NameObject(f"/{FONT_NAME}"),
+                            NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+                        }
+                    )
+                }
+            ),
+            NameObject("/ExtGState"): DictionaryObject(
+                {
+                    NameObject(VISIBLE_GS): DictionaryObject(
+                        {NameObject("/ca"): FloatObject(VISIBLE_ALPHA)}
+                    ),
+                    NameObject(INVISIBLE_GS): DictionaryObject(
+                        {NameObject("/ca"): FloatObject(INVISIBLE_ALPHA)}
+                    ),
+                }
+            ),
+        }
+    )
+
+
+def _stamp_overlay(ops: bytes, template: OverlayTemplate) -> PageObject:
+    """Return a page holding just the stamps, for `PageObject.merge_page`."""
+    left, bottom, right, top = template.bbox
+    overlay = PageObject.create_blank_page(width=right - left, height=top - bottom)
+    contents = DecodedStreamObject()
+    contents.set_data(ops)
+    overlay[NameObject("/Contents")] = contents
+    overlay[NameObject("/Resources")] = _stamp_resources()
+    return overlay
+
+
+def _stamp_form(ops: bytes, template: OverlayTemplate) -> StreamObject:
+    """Return the stamps as a self-contained form XObject."""
+    form = DecodedStreamObject()
+    form.set_data(ops)
+    form.update(
+        {
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject(FloatObject(x) for x in template.bbox),
+            NameObject("/Resources"): _stamp_resources(),
+        }
+    )
+    return form.flate_encode()
+
+
+def _stamp_by_rewrite(content: bytes, margin_text: str, corner_text: str) -> bytes:
+    """Merge the stamps into every page's content and write a new file."""
+    writer = PdfWriter(clone_from=io.BytesIO(content))
+    if not writer.pages:
+        return content
 
-    canvas.setFont(FONT_NAME, font_size)
-    canvas.saveState()
-    canvas.translate(right - RIGHT_MARGIN, bottom)
-    canvas.rotate(90)
-    canvas.drawCentredString((top - bottom) / 2, 0, text)
-    canvas.restoreState()
-    canvas.save()
-    buffer.seek(0)
-    return PdfReader(buffer).pages[0]
+    # Reuse overlays across pages that share a mediabox.
+    overlays: dict[tuple[float, float, float, float], PageObject] = {}
+    for page in writer.pages:
+        key = _box_key(page)
+        if key not in overlays:
+            template = get_overlay_template(key)
+            ops = get_stamp_ops(margin_text, corner_text, template)
+            overlays[key] = _stamp_overlay(ops, template)
+        page.merge_page(overlays[key])
+
+    # merge_page leaves page content streams uncompressed and the
+    # now-unreferenced original stream objects still in the file, which
+    # roughly quadruples output size on a content-heavy PDF. Recompress
+    # and prune before writing.
+    for page in writer.pages:
+        page.compress_content_streams()
+    writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
 
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
 
-def _build_corner_overlay(text: str, page: PageObject) -> PageObject:
-    """Return a single-page PDF holding the invisible bottom-right stamp."""
+
+def _box_key(page: PageObject) -> tuple[float, float, float, float]:
     box = page.mediabox
-    bottom, right = float(box.bottom), float(box.right)
-    top = float(box.top)
+    return (float(box.left), float(box.bottom), float(box.right), float(box.top))
+
+
+def _find_startxref(content: bytes) -> int:
+    """Return the offset of the last cross-reference section in `content`."""
+    index = content.rfind(b"startxref")
+    if index == -1:
+        raise ValueError("No startxref")
+    offset = int(content[index + len(b"startxref") :].split()[0])
+    if not (
+        content.startswith(b"xref", offset)
+        or XREF_STREAM_RE.match(content, offset) is not None
+    ):
+        raise ValueError("startxref does not point at a cross-reference section")
+    return offset
 
-    buffer = io.BytesIO()
-    canvas = Canvas(buffer, pagesize=(right, top))
-    canvas.setFillColor(INVISIBLE_COLOR)
-    canvas.setFont(FONT_NAME, CORNER_FONT_SIZE)
-    canvas.drawRightString(right - CORNER_MARGIN, bottom + CORNER_MARGIN, text)
-    canvas.save()
-    buffer.seek(0)
-    return PdfReader(buffer).pages[0]
 
+class _IncrementalUpdate:
+    """New and replaced objects to be appended to an existing PDF.
+
+    Objects are serialized as they are added, so only the appended section
+    is ever held in memory besides the original bytes.
+    """
 
-def watermark_pdf(content: bytes, user: User) -> bytes:
-    """Return `content` with `user` stamped on every page.
+    def __init__(self, reader: PdfReader, content: bytes) -> None:
+        self.reader = reader
+        self.content = content
+        self.prefix = b"" if content.endswith(b"\n") else b"\n"
+        self.base = len(content) + len(self.prefix)
+        self.buffer = io.BytesIO()
+        self.offsets: dict[int, tuple[int, int]] = {}
+        self.next_idnum = int(reader.trailer["/Size"])  # type: ignore[call-overload]
+
+    def replace(self, idnum: int, generation: int, obj: PdfObject) -> None:
+        self.offsets[idnum] = (self.base + self.buffer.tell(), generation)
+        self.buffer.write(f"{idnum} {generation} obj\n".encode())
+        obj.write_to_stream(self.buffer)
+        self.buffer.write(b"\nendobj\n")
+
+    def add(self, obj: PdfObject) -> IndirectObject:
+        ref = IndirectObject(self.next_idnum, 0, self.reader)
+        self.next_idnum += 1
+        self.replace(ref.idnum, 0, obj)
+        return ref
+
+    def _trailer(self, prev: int) -> DictionaryObject:
+        trailer = DictionaryObject(
+            {
+                NameObject("/Size"): NumberObject(self.next_idnum),
+                NameObject("/Prev"): NumberObject(prev),
+            }
+        )
+        for key in ("/Root", "/Info", "/ID"):
+            if key in self.reader.trailer:
+                trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+        return trailer
+
+    def _subsections(self) -> list[list[int]]:
+        runs: list[list[int]] = []
+        for idnum in sorted(self.offsets):
+            if runs and runs[-1][-1] + 1 == idnum:
+                runs[-1].append(idnum)
+            else:
+                runs.append([idnum])
+        return runs
+
+    def finish(self) -> bytes:
+        """Return the original bytes with the update appended."""
+        prev = _find_startxref(self.content)
+        # The update's cross-reference section matches the style of the last
+        # one, since a table can't follow a stream in a pre-1.5 reader.
+        if self.content.startswith(b"xref", prev):
+            xref_offset = self.base + self.buffer.tell()
+            # the free-list head, which some readers expect to lead every table
+            self.buffer.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+            for run in self._subsections():
+                self.buffer.write(f"{run[0]} {len(run)}\n".encode())
+                for idnum in run:
+                    offset, generation = self.offsets[idnum]
+                    self.buffer.write(f"{offset:010d} {generation:05d} n\r\n".encode())
+            self.buffer.write(b"trailer\n")
+            self._trailer(prev).write_to_stream(self.buffer)
+        else:
+            xref_idnum = self.next_idnum
+            self.next_idnum += 1
+            xref_offset = self.base + self.buffer.tell()
+            self.offsets[xref_idnum] = (xref_offset, 0)
+            runs = self._subsections()
+            xref = DecodedStreamObject()
+            xref.set_data(
+                b"".join(
+                    b"\x01"
+                    + self.offsets[idnum][0].to_bytes(4)
+                    + self.offsets[idnum][1].to_bytes(2)
+                    for run in runs
+                    for idnum in run
+                )
+            )
+            xref.update(self._trailer(prev))
+            xref.update(
+                {
+                    NameObject("/Type"): NameObject("/XRef"),
+                    NameObject("/W"): ArrayObject(NumberObject(w) for w in (1, 4, 2)),
+                    NameObject("/Index"): ArrayObject(
+                        NumberObject(n) for run in runs for n in (run[0], len(run))
+                    ),
+                }
+            )
+            del self.offsets[xref_idnum]  # written by replace() below
+            self.replace(xref_idnum, 0, xref.flate_encode())
+        self.buffer.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+        return self.content + self.prefix + self.buffer.getvalue()
+
+
+def _stamp_incrementally(content: bytes, margin_text: str, corner_text: str) -> bytes:
+    """Append the stamps to `content` as a PDF incremental update.
+
+    Each distinct mediabox gets one form XObject holding the stamps, shared
+    by every page of that size, and each page's content array gains a
+    stream drawing them. The original bytes, and every stream in them, are
+    left exactly as they were. Raises on anything out of the ordinary, so
+    the caller can fall back to rewriting the file.
+    """
+    reader = PdfReader(io.BytesIO(content))
+    if reader.is_encrypted:
+        raise ValueError("Encrypted PDFs are not stamped incrementally")
+    if not reader.pages:
+        return content
+
+    update = _IncrementalUpdate(reader, content)
+    push = DecodedStreamObject()
+    push.set_data(b"q\n")
+    push_ref = update.add(push)
+    draw = DecodedStreamObject()
+    draw.set_data(f"\nQ q {STAMP_XOBJECT} Do Q\n".encode())
+    draw_ref = update.add(draw)
+
+    forms: dict[tuple[float, float, float, float], IndirectObject] = {}
+    for page in reader.pages:
+        if page.indirect_reference is None:
+            raise ValueError("Page is not an indirect object")
+        key = _box_key(page)
+        if key not in forms:
+            template = get_overlay_template(key)
+            ops = get_stamp_ops(margin_text, corner_text, template)
+            forms[key] = update.add(_stamp_form(ops, template))
+
+        # pypdf has already copied any inherited resources onto the page
+        resources = DictionaryObject(page.get("/Resources", DictionaryObject()))
+        xobjects = DictionaryObject(resources.get("/XObject", DictionaryObject()))
+        if STAMP_XOBJECT in xobjects:
+            raise ValueError("Page already uses our XObject name")
+        xobjects[NameObject(STAMP_XOBJECT)] = forms[key]
+        resources[NameObject("/XObject")] = xobjects
+
+        streams: list[PdfObject] = []
+        if "/Contents" in page:
+            contents = page.raw_get("/Contents")
+            if isinstance(contents.get_object(), ArrayObject):
+                streams = list(contents.get_object())  # type: ignore[call-overload]
+            else:
+                streams = [contents]
+
+        stamped = DictionaryObject({key: page.raw_get(key) for key in page})
+        stamped[NameObject("/Resources")] = resources
+        stamped[NameObject("/Contents")] = ArrayObject([push_ref, *streams, draw_ref])
+        ref = page.indirect_reference
+        update.replace(ref.idnum, ref.generation, stamped)
+
+    return update.finish()
+
+
+def watermark_pdf(
+    content: bytes, user: User, when: datetime.datetime | None = None
+) -> bytes:
+    """Return `content` with `user` stamped on every page, dated `when` (or now).
+
+    WATERMARK_ENGINE picks how: "rewrite" (the default) merges the stamps into
+    every page and writes the file out again; "incremental" appends them to the
+    file untouched, falling back to "rewrite" on PDFs it can't handle.
 
     Watermarking is best-effort: if the bytes cannot be parsed as a PDF (or the
     stamping otherwise fails) the original content is returned unchanged, since
     serving an unmarked file beats serving a broken one.
     """
+    margin_text = get_watermark_text(user, when)
+    corner_text = get_corner_text(user, when)
+    if settings.WATERMARK_ENGINE == "incremental":
+        try:
+            return _stamp_incrementally(content, margin_text, corner_text)
+        except Exception:
+            logger.info(
+                "Could not stamp a PDF incrementally, rewriting it instead",
+                exc_info=True,
+            )
     try:
-        writer = PdfWriter(clone_from=io.BytesIO(content))
-        if not writer.pages:
-            return content
-
-        margin_text = get_watermark_text(user)
-        corner_text = get_corner_text(user)
-        # Reuse overlays across pages that share a mediabox.
-        overlays: dict[
-            tuple[float, float, float, float], tuple[PageObject, PageObject]
-        ] = {}
-        for page in writer.pages:
-            box = page.mediabox
-            key = (float(box.left), float(box.bottom), float(box.right), float(box.top))
-            if key not in overlays:
-                overlays[key] = (
-                    _build_margin_overlay(margin_text, page),
-                    _build_corner_overlay(corner_text, page),
-                )
-            margin_overlay, corner_overlay = overlays[key]
-            page.merge_page(margin_overlay)
-            page.merge_page(corner_overlay)
-
-        # merge_page leaves page content streams uncompressed and the
-        # now-unreferenced original stream objects still in the file, which
-        # roughly quadruples output size on a content-heavy PDF. Recompress
-        # and prune before writing.
-        for page in writer.pages:
-            page.compress_content_streams()
-        writer.compress_identical_objects(
-            remove_duplicates=True, remove_unreferenced=True
-        )
-
-        buffer = io.BytesIO()
-        writer.write(buffer)
-        return buffer.getvalue()
+        return _stamp_by_rewrite(content, margin_text, corner_text)
     except Exception:
         logger.exception("Could not watermark a PDF for %s, serving as-is", user)
         return content
@@ -0,0 +1,143 @@
+"""An on-disk cache of watermarked PDFs, so repeat downloads skip the rewrite.
+
+Entries are keyed by the path and storage mtime of the source file, the user,
+and the watermark timestamp rounded down to WATERMARK_TIMESTAMP_GRANULARITY,
+so a student downloading the same unit twice within one period gets the same
+bytes back without the file being fetched from storage or re-stamped.
+
+The cache lives in WATERMARK_CACHE_DIR (unset disables it) and is trimmed to
+WATERMARK_CACHE_MAX_BYTES, least recently used first. Hits and misses are
+counted in the Django cache; see `get_watermark_cache_stats`.
+"""
+
+import contextlib
+import datetime
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.watermark import get_watermark_text
+
+logger = logging.getLogger(__name__)
+
+# Bump when the watermark layout changes so old entries stop matching
+CACHE_FORMAT_VERSION = 1
+SUFFIX = ".pdf"
+STATS = ("hits", "misses", "evictions")
+STATS_KEY_PREFIX = "core.watermark_cache"
+
+
+def get_cache_dir() -> Path | None:
+    if not settings.WATERMARK_CACHE_DIR:
+        return None
+    return Path(settings.WATERMARK_CACHE_DIR)
+
+
+def get_watermark_time(now: datetime.datetime | None = None) -> datetime.datetime:
+    """Return `now` rounded down to the configured timestamp granularity."""
+    now = now or timezone.now()
+    granularity = max(1, int(settings.WATERMARK_TIMESTAMP_GRANULARITY))
+    epoch = int(now.timestamp())
+    return datetime.datetime.fromtimestamp(epoch - epoch % granularity, tz=datetime.UTC)
+
+
+def get_cache_key(path: str, mtime: float, user: User, when: datetime.datetime) -> str:
+    # The visible text goes in too, so renaming yourself busts your entries.
+    payload = "\0".join(
+        (
+            str(CACHE_FORMAT_VERSION),
+            settings.WATERMARK_ENGINE,
+            path,
+            repr(mtime),
+            str(user.pk),
+            str(int(when.timestamp())),
+            get_watermark_text(user, when),
+        )
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _bump(stat: str) -> None:
+    key = f"{STATS_KEY_PREFIX}.{stat}"
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add and incr; not worth retrying
+        pass
+
+
+def get_watermark_cache_stats() -> dict[str, int]:
+    values = cache.get_many([f"{STATS_KEY_PREFIX}.{stat}" for stat in STATS])
+    return {stat: values.get(f"{STATS_KEY_PREFIX}.{stat}", 0) for stat in STATS}
+
+
+def open_cached_pdf(key: str) -> BinaryIO | None:
+    """Return the cached file for `key`, or None on a miss or when disabled."""
+    if (cache_dir := get_cache_dir()) is None:
+        return None
+    entry = cache_dir / f"{key}{SUFFIX}"
+    try:
+        f = entry.open("rb")
+    except OSError:
+        _bump("misses")
+        return None
+    # Eviction goes by mtime, so this marks it recently used. The entry may
+    # have been evicted since we opened it, but the open handle still works.
+    with contextlib.suppress(OSError):
+        os.utime(entry)
+    _bump("hits")
+    return f
+
+
+def store_cached_pdf(key: str, content: bytes) -> bool:
+    """Save `content` under `key`, then trim the cache back under its limit.
+
+    Returns whether the entry was saved.
+    """
+    if (cache_dir := get_cache_dir()) is None:
+        return False
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary name first so readers never see half a file
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_name, cache_dir / f"{key}{SUFFIX}")
+    except OSError:
+        logger.exception("Could not write watermark cache entry %s", key)
+        return False
+    evict(cache_dir, settings.WATERMARK_CACHE_MAX_BYTES)
+    return True
+
+
+def evict(cache_dir: Path, max_bytes: int) -> int:
+    """Delete least recently used entries until the cache fits in `max_bytes`.
+
+    Returns the number of entries deleted.
+    """
+    entries: list[tuple[float, int, Path]] = []
+    for entry in cache_dir.glob(f"*{SUFFIX}"):
+        try:
+            stat = entry.stat()
+        except OSError:  # another worker got to it first
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        entry.unlink(missing_ok=True)
+        total -= size
+        evicted += 1
+        _bump("evictions")
+    return evicted
@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.db.models import QuerySet
 from django.http import HttpRequest
+from django.utils import timezone
+
+from rpg.levelsys import refresh_meters
 
 from .models import Announcement, PSet, SemesterDownloadFile, UploadedFile
 
@@ -125,17 +128,20 @@ class PSetAdmin(admin.ModelAdmin):
                 pset.student.unlocked_units.add(pset.next_unit_to_unlock)
             if pset.unit is not None:
                 pset.student.unlocked_units.remove(pset.unit)
-        queryset.update(status="A")
+        queryset.update(status="A", updated_at=timezone.now())
+        refresh_meters(queryset.values("student__user"), "psets")
 
     def accept_pset_without_unlock(
         self, request: HttpRequest, queryset: QuerySet[PSet]
     ):
         del request
-        queryset.update(status="A")
+        queryset.update(status="A", updated_at=timezone.now())
+        refresh_meters(queryset.values("student__user"), "psets")
 
     def reject_pset(self, request: HttpRequest, queryset: QuerySet[PSet]):
         del request
-        queryset.update(status="R")
+        queryset.update(status="R", updated_at=timezone.now())
+        refresh_meters(queryset.values("student__user"), "psets")
 
     actions = (
         "accept_pset",
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.7 on 2026-10-18 12:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("dashboard", "0091_announcement_archived"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pset",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
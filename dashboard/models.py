@@ -209,6 +209,7 @@ class PSet(models.Model):
         help_text="Comments by Evan on this problem set",
         blank=True,
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = "PSet submission"
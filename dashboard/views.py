@@ -48,10 +48,13 @@ def portal(request: AuthHttpRequest, student_pk: int) -> HttpResponse:
     if not request.user.is_staff and student.is_delinquent:
         return HttpResponseRedirect(reverse("invoice", args=(student_pk,)))
     semester = student.semester
-    profile, _ = UserProfile.objects.get_or_create(user=request.user)
-    student_profile, _ = UserProfile.objects.get_or_create(user=student.user)
+    profile = request.profile
+    if student.user_id == request.user.pk:  # type: ignore[attr-defined]
+        student_profile = profile
+    else:
+        student_profile, _ = UserProfile.objects.get_or_create(user=student.user)
 
-    level_info = get_level_info(student)
+    level_info = get_level_info(student, student_profile)
     if request.user == student.user:
         result = check_level_up(student, level_info)
         if result is True and profile.show_bars is True:
@@ -233,7 +236,9 @@ class StudentPSetList(LoginRequiredMixin, ListView[PSet]):
         if not isinstance(request.user, User):
             return super().dispatch(request, *args, **kwargs)  # login required mixin
 
-        self.student = get_object_or_404(Student, pk=kwargs.pop("student_pk"))
+        self.student = get_object_or_404(
+            Student.objects.with_payment_status(), pk=kwargs.pop("student_pk")
+        )
         if not can_view(request, self.student):
             raise PermissionDenied(
                 "You do not have permission to view this student's problem sets"
@@ -4,16 +4,24 @@ Expects a freshly migrated database with the unit and level fixtures already
 loaded; `fixtures/gen-dummy-data.sh` does both of those steps first.
 The random seed is fixed, so the shape of the output (how many units each
 student has, who submitted which quiz, ...) is the same on every run.
+
+The defaults give something small to click around in. For load testing, scale
+it up, e.g. `--students 20000 --semesters 12 --psets-per-student 40`; the big
+tables are then streamed into the database in batches of `--batch-size` rows,
+so memory use stays flat however many rows are made.
 """
 
 # Django models can't be imported before the app registry is ready,
 # hence the imports sitting below the django.setup() call.
 
 import argparse
+import itertools
 import math
 import os
 import random
 import sys
+import time
+from collections.abc import Generator, Iterable
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any
@@ -27,6 +35,8 @@ django.setup()
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db.models import Model
 from django.utils import timezone
 from factory.base import Factory
 from factory.declarations import Iterator
@@ -61,14 +71,23 @@ from rpg.models import Achievement
 from suggestions.factories import ProblemSuggestionFactory
 
 # How many objects to create; each one is also a command-line flag.
-# (flag, name, default, help text)
-ARGUMENTS: tuple[tuple[str, str, int, str], ...] = (
-    ("-s", "stu_num", 25, "number of students"),
-    ("-d", "achievement_num", 5, "number of diamonds or achievements"),
-    ("-p", "arch_num", 3, "number of arch problems"),
-    ("-e", "exam_num", 5, "number of tests and quizzes, respectively"),
-    ("-a", "assistant_num", 2, "number of assistants"),
-    ("-m", "market_num", 3, "number of markets"),
+# (flag, long flag, name, default, help text)
+ARGUMENTS: tuple[tuple[str, str, str, int, str], ...] = (
+    ("-s", "--students", "stu_num", 25, "number of students"),
+    ("-d", "--achievements", "achievement_num", 5, "number of diamonds"),
+    ("-p", "--problems", "arch_num", 3, "number of arch problems"),
+    ("-e", "--exams", "exam_num", 5, "number of tests and quizzes, respectively"),
+    ("-a", "--assistants", "assistant_num", 2, "number of assistants"),
+    ("-m", "--markets", "market_num", 3, "number of markets per semester"),
+    ("-S", "--semesters", "sem_num", 2, "number of semesters, the last one active"),
+    (
+        "-P",
+        "--psets-per-student",
+        "pset_num",
+        0,
+        "problem sets per student and semester (0 for a random handful)",
+    ),
+    ("-b", "--batch-size", "batch_size", 1000, "rows per INSERT statement"),
 )
 
 # Dice rolls deciding who gets what; tweak to taste.
@@ -91,17 +110,40 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Populates the local django with some test data."
     )
-    for flag, name, default, help_text in ARGUMENTS:
+    for flag, long_flag, name, default, help_text in ARGUMENTS:
         parser.add_argument(
-            flag, dest=name, default=default, metavar="INT", type=int, help=help_text
+            flag,
+            long_flag,
+            dest=name,
+            default=default,
+            metavar="INT",
+            type=int,
+            help=help_text,
         )
     return parser.parse_args()
 
 
+# Rows per INSERT, set from --batch-size; MySQL chokes on a single huge one
+BATCH_SIZE = 1000
+
+
 # create_batch doesn't optimize, so here's
 # some hacky code to use bulk_create
 def fast_bulk_create(cls: type[Factory], size: int, **kwargs: Any) -> Any:  # type: ignore
-    return cls._meta.model.objects.bulk_create(cls.build_batch(size, **kwargs))  # type: ignore
+    return cls._meta.model.objects.bulk_create(  # type: ignore
+        cls.build_batch(size, **kwargs), batch_size=BATCH_SIZE
+    )
+
+
+def stream_bulk_create(model: type[Model], objs: Iterable[Model]) -> int:
+    """Saves objects as they are generated, a batch at a time, and
+    returns how many there were. Unlike bulk_create, this never holds
+    more than one batch in memory, but nothing is returned to link to."""
+    count = 0
+    for batch in itertools.batched(objs, BATCH_SIZE):
+        model.objects.bulk_create(batch)  # type: ignore[attr-defined]
+        count += len(batch)
+    return count
 
 
 def bulk_create_rows(
@@ -215,8 +257,11 @@ def create_sem_independent(args: argparse.Namespace, users: list[User]):
     HanabiContestFactory.create()
 
 
-def assign_curriculums(students: list[Student]):
-    """Gives each student some units, unlocking and psetting a few of them."""
+def assign_curriculums(students: list[Student], pset_num: int):
+    """Gives each student some units, unlocking and psetting a few of them.
+
+    With `pset_num` set, each student instead psets exactly that many units
+    (as far as there are units to go around), without uploaded files."""
     units = list(Unit.objects.all())
     max_stu_units = min(len(units), MAX_STU_UNITS)
     min_pset_units = min(max_stu_units, MIN_PSET_UNITS)
@@ -225,46 +270,53 @@ def assign_curriculums(students: list[Student]):
     CurriculumThroughModel = Student.curriculum.through
     UnlockedThroughModel = Student.unlocked_units.through
 
-    curriculum_bulk = []
-    unlocked_units_bulk = []
-    psets: list[PSet] = []
-
-    print("Populating curriculums and creating psets (this could take a while...)")
+    # which units each student has, and which of those are unlocked
+    plans: list[tuple[Student, list[Unit], list[Unit]]] = []
     for student in students:
-        stu_curriculum_num = random.randint(1, max_stu_units)
-        stu_unlocked_num = random.randint(1, stu_curriculum_num)
-        stu_units = random.sample(units, stu_curriculum_num)
-
-        curriculum_bulk += [
-            CurriculumThroughModel(student_id=student.pk, unit_id=unit.pk)
-            for unit in stu_units
-        ]
-        unlocked_units_bulk += [
-            UnlockedThroughModel(student_id=student.pk, unit_id=unit.pk)
-            for unit in stu_units[:stu_unlocked_num]
-        ]
-
-        # the last unit is left alone, so that every pset has a unit to unlock
-        for i in range(min_pset_units, stu_curriculum_num - 1):
-            if random.random() > P_PSET:
-                continue
-            status = "P" if random.random() > P_PSET_APPROVED else "A"
-            psets.append(
-                PSetFactory.build(
+        if pset_num > 0:
+            # everything psetted except the last unit, which is being worked on
+            stu_units = random.sample(units, min(len(units), pset_num + 1))
+            plans.append((student, stu_units, stu_units[-1:]))
+        else:
+            stu_curriculum_num = random.randint(1, max_stu_units)
+            stu_unlocked_num = random.randint(1, stu_curriculum_num)
+            stu_units = random.sample(units, stu_curriculum_num)
+            plans.append((student, stu_units, stu_units[:stu_unlocked_num]))
+
+    def curriculum_rows() -> Generator[Model]:
+        for student, stu_units, _ in plans:
+            for unit in stu_units:
+                yield CurriculumThroughModel(student_id=student.pk, unit_id=unit.pk)
+
+    def unlocked_rows() -> Generator[Model]:
+        for student, _, stu_unlocked in plans:
+            for unit in stu_unlocked:
+                yield UnlockedThroughModel(student_id=student.pk, unit_id=unit.pk)
+
+    def pset_rows() -> Generator[PSet]:
+        for student, stu_units, _ in plans:
+            # the last unit is left alone, so that every pset has a unit to unlock
+            start = 0 if pset_num > 0 else min_pset_units
+            for i in range(start, len(stu_units) - 1):
+                if pset_num == 0 and random.random() > P_PSET:
+                    continue
+                status = "P" if random.random() > P_PSET_APPROVED else "A"
+                # each upload is its own INSERT, far too slow at scale
+                extra = {"upload": None} if pset_num > 0 else {}
+                yield PSetFactory.build(
                     student=student,
                     unit=stu_units[i],
                     next_unit_to_unlock=stu_units[i + 1],
                     hours=random.randint(1, 54),
                     clubs=random.randint(30, 200),
                     status=status,
+                    **extra,
                 )
-            )
 
-    CurriculumThroughModel.objects.bulk_create(curriculum_bulk)
-    UnlockedThroughModel.objects.bulk_create(unlocked_units_bulk)
-
-    print(f"Creating {len(psets)} problem sets")
-    PSet.objects.bulk_create(psets, batch_size=50)
+    print("Populating curriculums and creating psets (this could take a while...)")
+    stream_bulk_create(CurriculumThroughModel, curriculum_rows())
+    stream_bulk_create(UnlockedThroughModel, unlocked_rows())
+    print(f"Created {stream_bulk_create(PSet, pset_rows())} problem sets")
 
 
 def create_quiz_attempts(students: list[Student], quizzes: list[PracticeExam]):
@@ -344,7 +396,7 @@ def create_sem_dependent(
         student.reg = reg
     Student.objects.bulk_update(students, fields=("reg",), batch_size=50)
 
-    assign_curriculums(students)
+    assign_curriculums(students, args.pset_num)
     create_quiz_attempts(students, quizzes)
     create_quest_completes(students)
     create_market_guesses(students, markets)
@@ -352,9 +404,12 @@ def create_sem_dependent(
 
 
 def main():
+    global BATCH_SIZE
     args = parse_args()
+    BATCH_SIZE = args.batch_size
     settings.TESTING = True
     random.seed("OTIS-WEB")
+    start_time = time.perf_counter()
 
     verified_group, _ = Group.objects.get_or_create(name="Verified")
     staff_group, _ = Group.objects.get_or_create(name="Active Staff")
@@ -378,25 +433,31 @@ def main():
     create_sem_independent(args, users)
 
     current_year = timezone.now().year
-    old_semester: Semester = SemesterFactory.create(
-        show_invoices=False,
-        active=False,
-        end_year=current_year - 1,
-        exam_family="Foxtrot",
-    )
+    for years_ago in range(args.sem_num - 1, 0, -1):
+        old_semester: Semester = SemesterFactory.create(
+            show_invoices=False,
+            active=False,
+            end_year=current_year - years_ago,
+            exam_family="Foxtrot",
+        )
+        print(f"Populating {old_semester}")
+        create_sem_dependent(
+            args, old_semester, random.sample(users, int(0.6 * len(users)))
+        )
     current_semester: Semester = SemesterFactory.create(
         show_invoices=True,
         end_year=current_year,
         exam_family="Waltz",
     )
-
-    create_sem_dependent(
-        args, old_semester, random.sample(users, int(0.6 * len(users)))
-    )
+    print(f"Populating {current_semester}")
     create_sem_dependent(
         args, current_semester, random.sample(users, int(0.7 * len(users)))
     )
 
+    print("Computing meters")
+    call_command("rebuild_meters")
+    print(f"Done in {time.perf_counter() - start_time:.0f} seconds")
+
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,8 @@ from django.db.models import F
 from django.db.models.query import QuerySet
 from django.http.request import HttpRequest
 
+from rpg.levelsys import refresh_meters
+
 from .models import Guess, Market
 
 
@@ -42,6 +44,9 @@ class MarketAdmin(admin.ModelAdmin):
             start_date=F("start_date") + timedelta(days=num_days),
             end_date=F("end_date") + timedelta(days=num_days),
         )
+        refresh_meters(
+            Guess.objects.filter(market__in=queryset).values("user"), "markets"
+        )
 
     @admin.action(description="Postpone market by one week")
     def postpone_market(self, request: HttpRequest, queryset: QuerySet[Market]):
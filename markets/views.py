@@ -25,6 +25,7 @@ from markets.forms import MarketCreateForm
 from otisweb.decorators import admin_required
 from otisweb.mixins import AdminRequiredMixin, VerifiedRequiredMixin
 from otisweb.utils import AuthHttpRequest
+from rpg.levelsys import refresh_meters
 
 from .models import Guess, Market
 
@@ -142,6 +143,7 @@ def recompute(request: AuthHttpRequest, market_slug: str):
     for guess in guesses:
         guess.set_score()
     Guess.objects.bulk_update(guesses, fields=("score",), batch_size=50)
+    refresh_meters(guesses.values("user"), "markets")
     messages.success(
         request,
         f"Successfully recomputed all {guesses.count()} scores for this market!",
@@ -1,5 +1,7 @@
 import pytest
 from django.contrib.messages import constants as message_levels
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from core.factories import UserFactory
 from roster.factories import StudentFactory
@@ -11,6 +13,14 @@ Carol Cutie\t37"""
 USEMO_GRADER_TEST_DATA = """Alice Aardvark
 Bob Beta
 Carol Cutie"""
+USEMO_MATCHING_TEST_DATA = """  alice   AARDVARK \t 20
+Zoe Quinn\tnotes\t30
+Dup Licate\t40
+Past Student\t50
+Nobody\t60
+Bob Beta
+
+"""
 
 
 @pytest.fixture
@@ -76,3 +86,38 @@ def test_usemo_grading(otis, mouse_setup):
     assert any(m.level == message_levels.SUCCESS for m in resp.context["messages"])
     assert len(spades_list) == 3
     assert set(spades_list) == {15}
+
+
+@pytest.mark.django_db
+def test_usemo_score_matching(otis, mouse_setup):
+    StudentFactory.create(
+        user__first_name="Zoë", user__last_name="Quinn", semester__active=True
+    )
+    StudentFactory.create_batch(
+        2, user__first_name="Dup", user__last_name="Licate", semester__active=True
+    )
+    StudentFactory.create(
+        user__first_name="Past", user__last_name="Student", semester__active=False
+    )
+    otis.login("evan")
+    with CaptureQueriesContext(connection) as queries:
+        resp = otis.post_20x("usemo-score", data={"text": USEMO_MATCHING_TEST_DATA})
+    # the roster is read once, not once per line
+    students_read = [
+        q for q in queries.captured_queries if 'FROM "roster_student"' in q["sql"]
+    ]
+    assert len(students_read) == 1
+
+    assert dict(
+        QuestComplete.objects.filter(category="US").values_list(
+            "student__user__first_name", "spades"
+        )
+    ) == {"Alice": 20, "Zoë": 30}
+    warnings = [
+        m.message for m in resp.context["messages"] if m.level == message_levels.WARNING
+    ]
+    assert warnings == [
+        "No active student is called: Past Student\t50; Nobody\t60",
+        "Several active students share the name on: Dup Licate\t40",
+        "No score at the end of: Bob Beta",
+    ]
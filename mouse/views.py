@@ -5,7 +5,8 @@ from django.shortcuts import render
 from django.utils import timezone
 
 from otisweb.decorators import admin_required
-from roster.models import Student
+from roster.utils import RosterMatch, match_roster_lines
+from rpg.levelsys import refresh_meters
 from rpg.models import QuestComplete
 
 from .forms import GraderForm, ScoreForm
@@ -15,31 +16,52 @@ from .forms import GraderForm, ScoreForm
 YEAR = timezone.localdate().year
 
 
+def _report_problems(request: HttpRequest, match: RosterMatch) -> None:
+    if match.unmatched:
+        messages.warning(
+            request, "No active student is called: " + "; ".join(match.unmatched)
+        )
+    if match.ambiguous:
+        messages.warning(
+            request,
+            "Several active students share the name on: " + "; ".join(match.ambiguous),
+        )
+
+
+def _build_records(request: HttpRequest, qcs: list[QuestComplete]) -> None:
+    QuestComplete.objects.bulk_create(qcs, batch_size=500)
+    refresh_meters({qc.student.user_id for qc in qcs}, "quests")  # type: ignore[attr-defined]
+    messages.success(request, f"Built {len(qcs)} records")
+
+
 @admin_required
 def usemo_score(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         form = ScoreForm(request.POST)
         if form.is_valid():
-            students = Student.objects.filter(semester__active=True)
+            match = match_roster_lines(form.cleaned_data["text"])
             qcs = []
-            for s in students:
-                for line in form.cleaned_data["text"].splitlines():
-                    line = line.strip()
-                    if not line:
-                        continue
-                    name = line[: line.index("\t")].strip()
-                    spades = int(line[line.rindex("\t") + 1 :].strip())
-                    if s.user.get_full_name().lower() == name.lower():
-                        qcs.append(
-                            QuestComplete(
-                                student=s,
-                                title=f"USEMO {YEAR}",
-                                category="US",
-                                spades=spades,
-                            )
-                        )
-            QuestComplete.objects.bulk_create(qcs)
-            messages.success(request, f"Built {len(qcs)} records")
+            unscored = []
+            for student, fields in match.matched:
+                try:
+                    spades = int(fields[-1])
+                except ValueError:
+                    unscored.append("\t".join(fields))
+                    continue
+                qcs.append(
+                    QuestComplete(
+                        student=student,
+                        title=f"USEMO {YEAR}",
+                        category="US",
+                        spades=spades,
+                    )
+                )
+            _build_records(request, qcs)
+            _report_problems(request, match)
+            if unscored:
+                messages.warning(
+                    request, "No score at the end of: " + "; ".join(unscored)
+                )
     else:
         form = ScoreForm()
 
@@ -55,27 +77,20 @@ def usemo_grader(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         form = GraderForm(request.POST)
         if form.is_valid():
-            students = Student.objects.filter(semester__active=True)
-            qcs = []
-            for s in students:
-                for line in form.cleaned_data["text"].splitlines():
-                    line = line.strip()
-                    if not line:
-                        continue
-                    if "\t" in line:
-                        line = line[: line.index("\t")]
-                    name = line.strip()
-                    if s.user.get_full_name().lower() == name.lower():
-                        qcs.append(
-                            QuestComplete(
-                                student=s,
-                                title="USEMO Points",
-                                category="UG",
-                                spades=15,
-                            )
-                        )
-            QuestComplete.objects.bulk_create(qcs)
-            messages.success(request, f"Built {len(qcs)} records")
+            match = match_roster_lines(form.cleaned_data["text"])
+            _build_records(
+                request,
+                [
+                    QuestComplete(
+                        student=student,
+                        title="USEMO Points",
+                        category="UG",
+                        spades=15,
+                    )
+                    for student, _ in match.matched
+                ],
+            )
+            _report_problems(request, match)
     else:
         form = GraderForm()
 
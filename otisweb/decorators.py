@@ -5,6 +5,8 @@ from django.contrib.auth.models import AbstractBaseUser, AnonymousUser, User
 from django.core.exceptions import PermissionDenied
 from django.http.response import HttpResponseBase
 
+from core.verified import is_verified
+
 AnyUser = AbstractBaseUser | AnonymousUser
 ViewFunc = Callable[..., HttpResponseBase | Awaitable[HttpResponseBase]]
 
@@ -31,7 +33,7 @@ def verified_required[V: ViewFunc](view_func: V) -> V:
     """
     actual_decorator = user_passes_test(
         auth_test(
-            lambda u: u.groups.filter(name="Verified").exists() or u.is_staff,
+            lambda u: u.is_staff or is_verified(u),
             error_msg="Not in Verified group",
         ),
     )
@@ -0,0 +1,233 @@
+"""Ship log records to Discord without making the request wait for it.
+
+`DiscordQueueHandler` is what LOGGING installs. In the request it only turns
+the record into an embed (using django_discordo's layout and webhook
+settings, since that needs the request) and puts it on a bounded queue.
+A `DiscordQueueListener` thread, started lazily in each process, takes them
+off and posts them:
+
+* embeds for the same webhook are batched into one message, up to Discord's
+  limits of EMBEDS_PER_MESSAGE embeds and MESSAGE_CHARS characters, waiting
+  at most `flush_interval` seconds after the first one arrives;
+* a post that is rate limited, fails with a 5xx or can't connect is retried
+  up to `max_retries` times, backing off exponentially (or as long as
+  Discord's Retry-After says);
+* if the queue is full, records are dropped rather than making the caller
+  wait, and the next message to that webhook says how many were lost.
+"""
+
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+import requests
+from django_discordo import DiscordWebhookHandler
+
+# Discord's limits on a single webhook message
+EMBEDS_PER_MESSAGE = 10
+MESSAGE_CHARS = 6000
+
+# connect timeout / read timeout, in seconds
+POST_TIMEOUT = (3.05, 10.0)
+
+Embed = dict[str, Any]
+
+
+def embed_size(embed: Embed) -> int:
+    """The characters Discord counts towards MESSAGE_CHARS for `embed`."""
+    return (
+        len(embed.get("title", ""))
+        + len(embed.get("description", ""))
+        + sum(len(f["name"]) + len(f["value"]) for f in embed.get("fields", ()))
+    )
+
+
+def dropped_embed(count: int) -> Embed:
+    return {
+        "title": f":warning: {count} log records dropped",
+        "description": "The Discord log queue was full, so these were never sent.",
+        "color": 16497928,
+    }
+
+
+class DiscordQueueListener(QueueListener):
+    """Takes (url, embed) pairs off the queue and posts them in batches."""
+
+    def __init__(
+        self,
+        work: queue.Queue[Any],
+        flush_interval: float,
+        max_retries: int,
+        retry_delay: float,
+        dropped: Counter[str],
+        dropped_lock: threading.Lock,
+    ):
+        super().__init__(work)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.dropped = dropped
+        self.dropped_lock = dropped_lock
+        self.session = requests.Session()
+        self.batches: dict[str, list[Embed]] = {}
+        self.deadlines: dict[str, float] = {}
+        self.stopping = False
+
+    def dequeue(self, block: bool) -> Any:
+        # Wait for the next record, but no longer than until a batch is due
+        while True:
+            timeout = None
+            if self.deadlines:
+                timeout = max(0.0, min(self.deadlines.values()) - time.monotonic())
+            try:
+                return self.queue.get(block, timeout)
+            except queue.Empty:
+                self.flush(due_only=True)
+
+    def enqueue_sentinel(self) -> None:
+        # unlike put_nowait, this doesn't fail when the queue is full
+        self.queue.put(self._sentinel)
+
+    def handle(self, record: Any) -> None:
+        url, embed = record
+        batch = self.batches.setdefault(url, [])
+        if batch and (
+            len(batch) == EMBEDS_PER_MESSAGE
+            or sum(map(embed_size, batch)) + embed_size(embed) > MESSAGE_CHARS
+        ):
+            self.send(url)
+            batch = self.batches.setdefault(url, [])
+        batch.append(embed)
+        self.deadlines.setdefault(url, time.monotonic() + self.flush_interval)
+
+    def flush(self, due_only: bool = False) -> None:
+        now = time.monotonic()
+        if not due_only:
+            # drops for a webhook with nothing queued still get reported
+            with self.dropped_lock:
+                for url in self.dropped:
+                    self.batches.setdefault(url, [])
+        for url in list(self.batches):
+            if not due_only or self.deadlines.get(url, now) <= now:
+                self.send(url)
+
+    def send(self, url: str) -> None:
+        embeds = self.batches.pop(url)
+        self.deadlines.pop(url, None)
+        with self.dropped_lock:
+            dropped = self.dropped.pop(url, 0)
+        if dropped:
+            embeds.append(dropped_embed(dropped))
+        for i in range(0, len(embeds), EMBEDS_PER_MESSAGE):
+            self.post(url, embeds[i : i + EMBEDS_PER_MESSAGE])
+
+    def post(self, url: str, embeds: list[Embed]) -> None:
+        """Post one message, retrying as configured; never raises."""
+        attempts = 1 if self.stopping else self.max_retries + 1
+        for attempt in range(attempts):
+            delay = self.retry_delay * 2**attempt
+            try:
+                response = self.session.post(
+                    url, json={"embeds": embeds}, timeout=POST_TIMEOUT
+                )
+            except requests.RequestException:
+                pass
+            else:
+                if response.status_code < 400:
+                    return
+                if response.status_code == 429:
+                    delay = max(delay, float(response.headers.get("Retry-After", 0)))
+                elif response.status_code < 500:
+                    break  # Discord won't take this one however often we ask
+            if attempt + 1 < attempts:
+                time.sleep(delay)
+        if logging.raiseExceptions:
+            sys.stderr.write(f"Could not post {len(embeds)} log records to Discord\n")
+
+    def stop(self) -> None:
+        """Send what is queued, with no retries, and stop the thread."""
+        self.stopping = True
+        super().stop()
+        self.flush()
+        self.session.close()
+
+
+class DiscordQueueHandler(QueueHandler):
+    """Queues records for Discord; see the module docstring."""
+
+    def __init__(
+        self,
+        level: int | str = logging.NOTSET,
+        queue_size: int = 1000,
+        flush_interval: float = 2.0,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+    ):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.setLevel(level)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # builds the embeds and picks the webhooks; never posts anything
+        self.webhook = DiscordWebhookHandler()
+        self.dropped: Counter[str] = Counter()
+        self._dropped_lock = threading.Lock()
+        self._listener_lock = threading.Lock()
+        self.listener: DiscordQueueListener | None = None
+        self._pid: int | None = None
+
+    def _ensure_listener(self) -> None:
+        # Started here rather than in __init__, since prefork servers configure
+        # logging before forking and threads don't survive a fork
+        with self._listener_lock:
+            if self.listener is not None and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)  # type: ignore[attr-defined]
+            self._pid = os.getpid()
+            self.listener = DiscordQueueListener(
+                self.queue,  # type: ignore[arg-type]
+                self.flush_interval,
+                self.max_retries,
+                self.retry_delay,
+                self.dropped,
+                self._dropped_lock,
+            )
+            self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> tuple[str, Embed] | None:  # type: ignore[override]
+        url = self.webhook.get_url(record)
+        if url is None:
+            return None
+        return url, self.webhook.get_payload(record)["embeds"][0]
+
+    def emit(self, record: logging.LogRecord) -> None:
+        listener = self.listener
+        # requests and urllib3 log too, which mustn't loop back to Discord
+        if listener is not None and threading.current_thread() is listener._thread:
+            return
+        try:
+            item = self.prepare(record)
+            if item is None:
+                return
+            self._ensure_listener()
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                with self._dropped_lock:
+                    self.dropped[item[0]] += 1
+        except Exception:  # noqa: BLE001 -- see logging.Handler.handleError
+            self.handleError(record)
+
+    def close(self) -> None:
+        with self._listener_lock:
+            listener, self.listener = self.listener, None
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()
+        super().close()
@@ -0,0 +1,17 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from core.last_seen import flush
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes pending last_seen times to the database; meant to be run periodically"
+    )
+
+    def handle(self, *args: Any, **options: Any):
+        del args
+        del options
+
+        print(f"Updated last_seen for {flush()} users")
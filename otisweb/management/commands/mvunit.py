@@ -4,6 +4,7 @@ from typing import Any
 from django.core.management.base import BaseCommand
 
 from core.models import Unit
+from core.unit_access import invalidate_unit_access
 from dashboard.models import UploadedFile
 from roster.models import Student
 
@@ -33,7 +34,9 @@ class Command(BaseCommand):
         if input("Are you sure? ").strip().lower() != "y":
             return
 
+        benefactors = list(u.values_list("benefactor__user", flat=True))
         u.update(unit=dest_pk)
+        invalidate_unit_access(benefactors)
         for s in s1:
             s.curriculum.remove(source_pk)
             s.curriculum.add(dest_pk)
@@ -0,0 +1,45 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rpg.levelsys import compute_meter_totals, empty_meter_totals
+from rpg.models import MeterLedger
+
+
+class Command(BaseCommand):
+    help = "Recomputes every user's meter ledger from scratch"
+
+    def handle(self, *args: Any, **options: Any):
+        del args
+        del options
+
+        totals = compute_meter_totals()
+        empty = empty_meter_totals()
+        now = timezone.now()
+
+        ledgers = list(MeterLedger.objects.all())
+        fixed: list[MeterLedger] = []
+        for ledger in ledgers:
+            values = totals.pop(ledger.user_id, empty)  # type: ignore[attr-defined]
+            if any(getattr(ledger, key) != value for key, value in values.items()):
+                for key, value in values.items():
+                    setattr(ledger, key, value)
+                ledger.updated_at = now
+                fixed.append(ledger)
+        MeterLedger.objects.bulk_update(
+            fixed, fields=(*empty.keys(), "updated_at"), batch_size=100
+        )
+
+        MeterLedger.objects.bulk_create(
+            [
+                MeterLedger(user_id=user_id, **values)
+                for user_id, values in totals.items()
+            ],
+            batch_size=100,
+            ignore_conflicts=True,
+        )
+        print(
+            f"Fixed {len(fixed)} of {len(ledgers)} existing ledgers, "
+            f"created {len(totals)} new ones"
+        )
@@ -0,0 +1,22 @@
+from typing import Any
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from roster.models import UserSearchToken
+from roster.user_search import reindex_users
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the search tokens behind the user lookup for every user"
+
+    def handle(self, *args: Any, **options: Any):
+        del args
+        del options
+
+        user_ids = list(User.objects.values_list("pk", flat=True))
+        reindex_users(user_ids)
+        print(
+            f"Indexed {len(user_ids)} users "
+            f"with {UserSearchToken.objects.count()} tokens"
+        )
@@ -0,0 +1,19 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from rpg.levelsys import take_leaderboard_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the leaderboard snapshot "
+        "(viewing the leaderboard also does once it is stale)"
+    )
+
+    def handle(self, *args: Any, **options: Any):
+        del args
+        del options
+
+        snapshot = take_leaderboard_snapshot()
+        print(f"Ranked {len(snapshot.rows)} students")
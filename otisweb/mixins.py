@@ -6,6 +6,8 @@ from braces.views import (
     SuperuserRequiredMixin,
 )
 
+from core.verified import VERIFIED_GROUP, is_verified
+
 
 class StaffRequiredMixin(StaffuserRequiredMixin):
     raise_exception = True
@@ -18,9 +20,10 @@ class AdminRequiredMixin(SuperuserRequiredMixin):
 
 
 class VerifiedRequiredMixin(GroupRequiredMixin):
-    group_required = "Verified"
+    group_required = VERIFIED_GROUP
     raise_exception = True
     redirect_unauthenticated_users = True
 
     def check_membership(self, groups: Any) -> bool:
-        return self.request.user.is_staff or super().check_membership(groups)  # type: ignore[union-attr]
+        user = self.request.user
+        return user.is_staff or user.is_superuser or is_verified(user)  # type: ignore[union-attr, arg-type]
@@ -6,6 +6,7 @@ import inspect
 import logging
 import os
 import sys
+import tempfile
 from pathlib import Path
 from typing import Any
 
@@ -134,6 +135,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "allauth.account.middleware.AccountMiddleware",
     "hijack.middleware.HijackUserMiddleware",
+    "core.middleware.ProfileMiddleware",
     "core.middleware.LastSeenMiddleware",
     "core.middleware.TimezoneMiddleware",
 ]
@@ -185,6 +187,79 @@ else:
         }
     }
 
+# Caches
+
+# CACHE_BACKEND is one of
+#   "locmem": in memory, separately in every process (the default outside
+#             production, and refused by core.checks when DEBUG is off)
+#   "file": shared between the processes of one machine through files under
+#           CACHE_LOCATION (the default in production)
+#   "db": shared through tables named CACHE_LOCATION_<alias> in the database,
+#         which `manage.py createcachetable` creates
+#   "redis", "memcached": a cache server at CACHE_LOCATION, which needs the
+#                         `redis` or `pymemcache` package installed (checked
+#                         by core.checks, as neither is a dependency)
+# Every alias is stored separately, so clearing one leaves the others intact,
+# except on a cache server, where the aliases only differ by key prefix.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND") or ("file" if PRODUCTION else "locmem")
+CACHE_LOCATION = os.getenv("CACHE_LOCATION") or {
+    "db": "otisweb_cache",
+    "redis": "redis://127.0.0.1:6379",
+    "memcached": "127.0.0.1:11211",
+}.get(CACHE_BACKEND, f"{tempfile.gettempdir()}/otisweb")
+# Whether a key deleted by one process is gone for all of them. Without this,
+# invalidating cached values only reaches the process that did it, so code
+# caching anything that other processes invalidate keeps it briefly.
+CACHE_SHARED = CACHE_BACKEND != "locmem"
+# Whether the cache is a server, whose operations are atomic across processes
+CACHE_SERVER = CACHE_BACKEND in ("redis", "memcached")
+# Set this to a new number on every deploy (e.g. `git rev-list --count HEAD`)
+# so that values computed by the previous release are ignored. Sessions are
+# not versioned, so a deploy doesn't log everybody out.
+CACHE_VERSION = int(os.getenv("CACHE_VERSION") or 1)
+
+
+def cache_config(alias: str, versioned: bool = True) -> dict[str, Any]:
+    backends = {
+        "locmem": ("core.cache_stats.LocMemCache", alias),
+        "file": ("core.cache_stats.FileBasedCache", f"{CACHE_LOCATION}/{alias}"),
+        "db": ("core.cache_stats.DatabaseCache", f"{CACHE_LOCATION}_{alias}"),
+        "redis": ("core.cache_stats.RedisCache", CACHE_LOCATION),
+        "memcached": ("core.cache_stats.PyMemcacheCache", CACHE_LOCATION),
+    }
+    if CACHE_BACKEND not in backends:
+        raise ImproperlyConfigured(
+            f"CACHE_BACKEND must be one of {', '.join(backends)}, not {CACHE_BACKEND!r}"
+        )
+    backend, location = backends[CACHE_BACKEND]
+    config: dict[str, Any] = {
+        "BACKEND": backend,
+        "LOCATION": location,
+        "VERSION": CACHE_VERSION if versioned else 1,
+    }
+    if CACHE_SERVER:
+        config["KEY_PREFIX"] = alias
+    else:
+        config["OPTIONS"] = {"MAX_ENTRIES": 10_000}
+    return config
+
+
+CACHES = {
+    # small shared state: counters, throttles, write-behind logs, and
+    # import_export's uploads between the preview and the confirmation
+    "default": cache_config("default"),
+    # results of expensive queries, such as who may see which units
+    "computed": cache_config("computed"),
+}
+
+# Sessions can only live in the cache if a logout there reaches every process
+# at once, which only a cache server promises; otherwise they stay in the
+# database alone, as Django's documentation advises
+if CACHE_SERVER:
+    CACHES["sessions"] = cache_config("sessions", versioned=False)
+    SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+    SESSION_CACHE_ALIAS = "sessions"
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -255,6 +330,8 @@ if PRODUCTION:
     }
     GS_BUCKET_NAME = require_env("GS_BUCKET_NAME")
     MEDIA_URL = require_env("MEDIA_URL")
+    # stored in the default cache, which core.checks makes sure is shared, so
+    # that the confirmation can be handled by another worker than the preview
     IMPORT_EXPORT_TMP_STORAGE_CLASS = import_export.tmp_storages.CacheStorage
 else:
     STORAGES = {
@@ -270,6 +347,31 @@ SECRET_KEY = env_secret("DJANGO_SECRET_KEY", "evan_chen_is_really_cool")
 
 TESTING_NEEDS_MOCK_MEDIA = False  # true only for a few tests
 
+# Protected files are streamed to the client this many bytes at a time
+PROTECTED_FILE_CHUNK_SIZE = 64 * 1024
+# "rewrite" merges the watermark into every page and writes a new file.
+# "incremental" (opt-in) appends it to the original file instead, which is
+# faster but leaves the unmarked pages in the file for anyone who strips the
+# appended update; it falls back to "rewrite" on files it can't handle.
+WATERMARK_ENGINE = os.getenv("WATERMARK_ENGINE") or "rewrite"
+# Watermarked PDFs are cached on local disk; unset disables the cache
+WATERMARK_CACHE_DIR = os.getenv("WATERMARK_CACHE_DIR")
+WATERMARK_CACHE_MAX_BYTES = int(os.getenv("WATERMARK_CACHE_MAX_BYTES") or 512 * 2**20)
+# Watermark timestamps are rounded down to this many seconds; repeat downloads
+# within one period can be served from the cache. A whole number of days
+# drops the time of day from the visible stamp.
+WATERMARK_TIMESTAMP_GRANULARITY = int(
+    os.getenv("WATERMARK_TIMESTAMP_GRANULARITY") or 60
+)
+
+# last_seen is recorded at most this often per user; see core.last_seen
+LAST_SEEN_THROTTLE_SECONDS = 15 * 60
+# Pending last_seen touches are written once there are this many of them,
+# or once the oldest is this many seconds old (only with a cache server or
+# LocMem; on other caches every touch is written at once)
+LAST_SEEN_FLUSH_THRESHOLD = int(os.getenv("LAST_SEEN_FLUSH_THRESHOLD") or 100)
+LAST_SEEN_FLUSH_SECONDS = int(os.getenv("LAST_SEEN_FLUSH_SECONDS") or 60)
+
 FILE_UPLOAD_HANDLERS = ("django.core.files.uploadhandler.MemoryFileUploadHandler",)
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
@@ -398,7 +500,9 @@ LOGGING = {
             ],
         },
         "discord": {
-            "class": "django_discordo.DiscordWebhookHandler",
+            # "()" rather than "class", which would have dictConfig set up
+            # a QueueHandler and listener its own way
+            "()": "otisweb.discord_log.DiscordQueueHandler",
             "level": "VERBOSE",
             "filters": [
                 "require_debug_false",
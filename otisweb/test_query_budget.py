@@ -0,0 +1,214 @@
+"""Query budgets for the pages that get hit the most.
+
+This covers a hand-picked set of views, not every route: the student portal
+and stats pages, problem downloads, the roster index, past and leaderboard
+pages, and the API's init sync. Every other view is unbudgeted, and an N+1
+pattern there goes unnoticed here; to cover a view, add a scenario building
+data it reads to SCENARIOS. Each scenario is measured at only two sizes
+(SCALES), enough to tell a constant query count from a growing one but not
+to catch queries that only appear past some size (e.g. with pagination).
+
+Each scenario builds a dataset at a couple of sizes, requests its view at each,
+and records the number of SQL queries, the time spent in the database, and the
+wall time. Two things must hold:
+
+* The query count does not grow with the size of the dataset. A count that
+  does is an N+1 pattern: something is querying once per row.
+* The query count is at most the one recorded in query_budget.json, so that
+  a page which quietly picks up a few more queries shows up in review.
+
+Set QUERY_BUDGET_REPORT to a path to get every measurement written there as
+JSON, and QUERY_BUDGET_UPDATE=1 to rewrite the baseline from this run.
+Wall and database times are only reported, never checked; they are too noisy.
+"""
+
+import json
+import os
+import pathlib
+import time
+from collections.abc import Callable
+from hashlib import sha256
+from typing import Any, NamedTuple
+
+import pytest
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from core.factories import SemesterFactory, UnitFactory, UserFactory
+from dashboard.factories import PSetFactory
+from otisweb.test_view_guards import _project_routes
+from payments.factories import JobFactory
+from roster.factories import StudentFactory, UnitInquiryFactory
+from suggestions.factories import ProblemSuggestionFactory
+
+BASELINE_PATH = pathlib.Path(__file__).resolve().parent / "query_budget.json"
+
+# Dataset sizes each scenario is measured at; see above for what two miss
+SCALES = (2, 6)
+
+API_PASSWORD = "query budget password"
+API_HASH = sha256(API_PASSWORD.encode("ascii")).hexdigest()
+
+
+class Request(NamedTuple):
+    """What to log in as and what to ask for."""
+
+    user: Any
+    url: str
+    method: str = "get"
+    data: dict[str, Any] | None = None
+
+
+def _portal_student(n: int):
+    student = StudentFactory.create()
+    units = UnitFactory.create_batch(n)
+    student.curriculum.set(units)
+    student.unlocked_units.set(units[: n // 2])
+    for unit in units[n // 2 :]:
+        PSetFactory.create(student=student, unit=unit, status="A", clubs=5, hours=2)
+    return student
+
+
+def portal(n: int) -> Request:
+    student = _portal_student(n)
+    return Request(student.user, reverse("portal", args=(student.pk,)))
+
+
+def stats(n: int) -> Request:
+    student = _portal_student(n)
+    return Request(student.user, reverse("stats", args=(student.pk,)))
+
+
+def view_problems(n: int) -> Request:
+    student = _portal_student(n)
+    unit = student.unlocked_units.first()
+    return Request(student.user, reverse("view-problems", args=(unit.pk,)))  # type: ignore[union-attr]
+
+
+def _cohort(n: int, active: bool = True) -> None:
+    semester = SemesterFactory.create(active=active)
+    for student in StudentFactory.create_batch(n, semester=semester):
+        PSetFactory.create(student=student, status="A", clubs=5, hours=2)
+
+
+def index(n: int) -> Request:
+    _cohort(n)
+    return Request(UserFactory.create(is_staff=True), reverse("index"))
+
+
+def past(n: int) -> Request:
+    _cohort(n, active=False)
+    return Request(UserFactory.create(is_staff=True), reverse("past"))
+
+
+def leaderboard(n: int) -> Request:
+    _cohort(n)
+    return Request(UserFactory.create(is_staff=True), reverse("leaderboard"))
+
+
+def api_init(n: int) -> Request:
+    semester = SemesterFactory.create(active=True)
+    for student in StudentFactory.create_batch(n, semester=semester):
+        PSetFactory.create(student=student, status="P")
+        UnitInquiryFactory.create(student=student, status="INQ_NEW")
+        ProblemSuggestionFactory.create(user=student.user, status="SUGG_NEW")
+        JobFactory.create(progress="JOB_SUB")
+    return Request(
+        None,
+        reverse("api"),
+        method="post",
+        data={"action": "init", "token": API_PASSWORD},
+    )
+
+
+SCENARIOS: dict[str, Callable[[int], Request]] = {
+    "portal": portal,
+    "stats": stats,
+    "view-problems": view_problems,
+    "index": index,
+    "past": past,
+    "leaderboard": leaderboard,
+    "api": api_init,
+}
+
+
+def _measure(client: Any, request: Request) -> dict[str, Any]:
+    client.logout()
+    if request.user is not None:
+        client.force_login(request.user)
+
+    def send():
+        if request.method == "post":
+            return client.post(
+                request.url,
+                data=json.dumps(request.data),
+                content_type="application/json",
+            )
+        return client.get(request.url)
+
+    # warm up first, so one-off work (ledgers, caches, snapshots) isn't counted
+    assert send().status_code == 200
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        response = send()
+        if response.streaming:  # its queries only run as it's read
+            response.getvalue()
+        wall = time.perf_counter() - start
+    assert response.status_code == 200
+    return {
+        "queries": len(ctx.captured_queries),
+        "db_seconds": round(sum(float(q["time"]) for q in ctx.captured_queries), 4),
+        "wall_seconds": round(wall, 4),
+    }
+
+
+def test_scenarios_name_real_routes():
+    names = {name for _, _, name in _project_routes()}
+    assert not set(SCENARIOS) - names, "Some scenarios name views no longer routed"
+
+
+@pytest.mark.django_db
+@override_settings(API_TARGET_HASH=API_HASH, TESTING_NEEDS_MOCK_MEDIA=True)
+def test_query_budgets(client):
+    report: dict[str, dict[str, Any]] = {}
+    for name, scenario in SCENARIOS.items():
+        report[name] = {}
+        for n in SCALES:
+            with transaction.atomic():
+                cache.clear()
+                report[name][str(n)] = _measure(client, scenario(n))
+                transaction.set_rollback(True)
+
+    if path := os.environ.get("QUERY_BUDGET_REPORT"):
+        pathlib.Path(path).write_text(json.dumps(report, indent=2) + "\n")
+
+    counts = {
+        name: {int(n): row["queries"] for n, row in rows.items()}
+        for name, rows in report.items()
+    }
+    if os.environ.get("QUERY_BUDGET_UPDATE"):
+        baseline = {name: max(by_n.values()) for name, by_n in counts.items()}
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+    baseline = json.loads(BASELINE_PATH.read_text())
+
+    problems: list[str] = []
+    for name, by_n in counts.items():
+        small, large = by_n[min(SCALES)], by_n[max(SCALES)]
+        if large > small:
+            problems.append(
+                f"{name}: {small} queries at N={min(SCALES)} but {large} at "
+                f"N={max(SCALES)}; something runs a query per row"
+            )
+        if name not in baseline:
+            problems.append(f"{name}: no baseline in {BASELINE_PATH.name}")
+        elif large > baseline[name]:
+            problems.append(
+                f"{name}: {large} queries, up from {baseline[name]} in the baseline"
+            )
+
+    assert not problems, (
+        "Query budgets exceeded. If the new queries are intended, rerun with "
+        "QUERY_BUDGET_UPDATE=1 and commit the baseline:\n  " + "\n  ".join(problems)
+    )
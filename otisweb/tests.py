@@ -1,5 +1,11 @@
+import json
 import logging
 import os
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
 
 import pytest
 from allauth.account.models import EmailAddress
@@ -13,14 +19,18 @@ from django.contrib.messages.storage.base import Message
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.contrib.sites.models import Site
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
 from django.http import HttpRequest, HttpResponse
 from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import Resolver404, resolve, reverse
 from django.utils.log import log_response
 
 import otisweb.settings
-from core.factories import UserFactory
+from arch.factories import ProblemFactory
+from core.factories import GroupFactory, SemesterFactory, UserFactory
 from otisweb.adapters import AUTH_PROCESS_LOGIN_EXISTING
+from otisweb.discord_log import DiscordQueueHandler
 from otisweb.settings import env_secret, fix_response_location, require_env
 
 
@@ -290,3 +300,126 @@ def test_env_secret(monkeypatch: pytest.MonkeyPatch, production: bool):
             env_secret("OTIS_MADE_UP_SECRET", "insecure")
     else:
         assert env_secret("OTIS_MADE_UP_SECRET", "insecure") == "insecure"
+
+
+@pytest.mark.django_db
+def test_verified_fast_path(otis):
+    verified_group = GroupFactory.create(name="Verified")
+    alice = UserFactory.create(groups=(verified_group,))
+    SemesterFactory.create(active=True, calendar_url="https://example.com/cal")
+    problem = ProblemFactory.create()
+    otis.login(alice)
+
+    for name, args in (("calendar", ()), ("hint-list", (problem.puid,))):
+        otis.get(name, *args)  # warm up the caches
+        with CaptureQueriesContext(connection) as ctx:
+            assert otis.get(name, *args).status_code in (200, 302)
+        tables = " ".join(q["sql"] for q in ctx.captured_queries)
+        # the Verified bit comes from the cache (the session only does with a
+        # cache server, see SESSION_ENGINE)
+        assert "auth_user_groups" not in tables
+
+    # leaving the group takes effect straight away, from either side
+    alice.groups.remove(verified_group)
+    otis.get_40x("calendar")
+    verified_group.user_set.add(alice)
+    otis.get_30x("calendar")
+    verified_group.user_set.clear()
+    otis.get_40x("hint-list", problem.puid)
+
+
+WEBHOOK_DELAY = 0.3
+
+
+class StubWebhook:
+    """A local stand-in for a Discord webhook, which takes WEBHOOK_DELAY
+    seconds to answer each post with the next of `statuses` (then 204)."""
+
+    def __init__(self) -> None:
+        self.received: list[dict[str, Any]] = []
+        self.statuses: list[int] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(WEBHOOK_DELAY)
+                stub.received.append(json.loads(body))
+                self.send_response(stub.statuses.pop(0) if stub.statuses else 204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:
+                del format, args
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/webhook"
+
+    def embeds(self) -> list[str]:
+        return [e["title"] for message in self.received for e in message["embeds"]]
+
+
+@pytest.fixture
+def stub_webhook(settings) -> Iterator[StubWebhook]:
+    stub = StubWebhook()
+    settings.DISCORD_WEBHOOK_URLS = {"DEFAULT": stub.url}
+    thread = threading.Thread(target=stub.server.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+def make_record(i: int) -> logging.LogRecord:
+    return logging.LogRecord(
+        "otisweb", logging.ERROR, __file__, 1, "Problem %d", (i,), None
+    )
+
+
+def test_discord_log_batches(stub_webhook: StubWebhook):
+    handler = DiscordQueueHandler(flush_interval=60)
+    start = time.perf_counter()
+    for i in range(25):
+        handler.handle(make_record(i))
+    # none of the three webhook round trips happen in the caller
+    assert time.perf_counter() - start < WEBHOOK_DELAY
+    handler.close()
+    assert [len(message["embeds"]) for message in stub_webhook.received] == [10, 10, 5]
+    assert stub_webhook.embeds() == [f":x: Problem {i}" for i in range(25)]
+
+
+def test_discord_log_flush_interval(stub_webhook: StubWebhook):
+    handler = DiscordQueueHandler(flush_interval=0.05)
+    handler.handle(make_record(0))
+    deadline = time.monotonic() + 5
+    while not stub_webhook.received and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert stub_webhook.embeds() == [":x: Problem 0"]
+    handler.close()
+
+
+def test_discord_log_retries(stub_webhook: StubWebhook):
+    stub_webhook.statuses = [500, 429]
+    handler = DiscordQueueHandler(flush_interval=0.01, retry_delay=0.01)
+    handler.handle(make_record(0))
+    deadline = time.monotonic() + 5
+    while len(stub_webhook.received) < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    handler.close()
+    # failed twice, then delivered; nothing more after that
+    assert stub_webhook.embeds() == [":x: Problem 0"] * 3
+
+
+def test_discord_log_backpressure(stub_webhook: StubWebhook):
+    handler = DiscordQueueHandler(queue_size=2, flush_interval=0.01)
+    start = time.perf_counter()
+    for i in range(20):
+        handler.handle(make_record(i))
+    assert time.perf_counter() - start < WEBHOOK_DELAY
+    handler.close()
+
+    titles = stub_webhook.embeds()
+    delivered = [title for title in titles if "Problem" in title]
+    (summary,) = [title for title in titles if "dropped" in title]
+    assert summary == f":warning: {20 - len(delivered)} log records dropped"
+    assert len(delivered) < 20
@@ -1,15 +1,20 @@
 import datetime
 import logging
+from typing import TYPE_CHECKING
 
 from django.contrib.auth.models import User
 from django.http import HttpRequest
 from django.utils import timezone
 
+if TYPE_CHECKING:
+    from core.models import UserProfile
+
 logger = logging.getLogger(__name__)
 
 
 class AuthHttpRequest(HttpRequest):
     user: User
+    profile: "UserProfile"  # set by core.middleware.ProfileMiddleware
 
 
 def get_days_since(t: datetime.datetime | None) -> float | None:
@@ -1,9 +1,12 @@
 from django.contrib import admin
 from django.db.models.query import QuerySet
 from django.http.request import HttpRequest
+from django.utils import timezone
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
+from rpg.levelsys import refresh_meters
+
 from .models import Job, JobFolder, PaymentLog, Worker
 
 
@@ -160,4 +163,6 @@ class JobAdmin(ImportExportModelAdmin):
 
     def unassign_job(self, request: HttpRequest, queryset: QuerySet[Job]):
         del request
-        queryset.update(progress="JOB_NEW", assignee=None)
+        users = list(queryset.values_list("assignee__user", flat=True))
+        queryset.update(progress="JOB_NEW", assignee=None, updated_at=timezone.now())
+        refresh_meters(users, "jobs")
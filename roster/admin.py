@@ -8,6 +8,7 @@ from django.db.models import F, FloatField, QuerySet
 from django.db.models.base import Model
 from django.db.models.functions import Cast
 from django.http import HttpRequest
+from django.utils import timezone
 from import_export import fields, resources, widgets
 from import_export.admin import ImportExportModelAdmin
 
@@ -22,6 +23,7 @@ from .models import (
     StudentRegistration,
     UnitInquiry,
 )
+from .utils import accept_inquiries
 
 
 class RosterResource(resources.ModelResource):
@@ -308,6 +310,44 @@ class InvoiceInline(admin.StackedInline):
     )
 
 
+class PaymentStatusFilter(admin.SimpleListFilter):
+    title = "payment status"
+    parameter_name = "payment_status"
+
+    def lookups(
+        self,
+        request: HttpRequest,
+        model_admin: ModelAdmin[Any],
+    ) -> list[tuple[str, str]]:
+        del request, model_admin
+        return [
+            ("clear", "Clear"),
+            ("owing", "Owing, not yet due"),
+            ("reminded", "Payment due soon"),
+            ("late", "Late"),
+            ("locked", "Locked (over a week late)"),
+            ("delinquent", "Delinquent (locked and not forgiven)"),
+        ]
+
+    def queryset(self, request: HttpRequest, queryset: QuerySet[Student]):
+        del request
+        if self.value() is None:
+            return queryset
+        queryset = Student.objects.with_payment_status().filter(pk__in=queryset)
+        if self.value() == "clear":
+            return queryset.filter(payment_status_code=0)
+        elif self.value() == "owing":
+            return queryset.filter(payment_status_code=4)
+        elif self.value() == "reminded":
+            return queryset.filter(payment_status_code__in=(1, 5))
+        elif self.value() == "late":
+            return queryset.filter(payment_status_code__in=(2, 6))
+        elif self.value() == "locked":
+            return queryset.filter(payment_status_code__in=(3, 7))
+        elif self.value() == "delinquent":
+            return queryset.filter(payment_delinquent=True)
+
+
 @admin.register(Student)
 class StudentAdmin(ImportExportModelAdmin):
     list_display = (
@@ -330,6 +370,7 @@ class StudentAdmin(ImportExportModelAdmin):
         "enabled",
         "newborn",
         "semester",
+        PaymentStatusFilter,
     )
     search_fields = (
         "pk",
@@ -444,20 +485,19 @@ class UnitInquiryAdmin(admin.ModelAdmin):
 
     def hold_petition(self, request: HttpRequest, queryset: QuerySet[UnitInquiry]):
         del request
-        queryset.update(status="INQ_HOLD")
+        queryset.update(status="INQ_HOLD", updated_at=timezone.now())
 
     def reject_petition(self, request: HttpRequest, queryset: QuerySet[UnitInquiry]):
         del request
-        queryset.update(status="INQ_REJ")
+        queryset.update(status="INQ_REJ", updated_at=timezone.now())
 
     def accept_petition(self, request: HttpRequest, queryset: QuerySet[UnitInquiry]):
         del request
-        for inquiry in queryset:
-            inquiry.run_accept()
+        accept_inquiries(queryset)
 
     def reset_petition(self, request: HttpRequest, queryset: QuerySet[UnitInquiry]):
         del request
-        queryset.update(status="INQ_NEW")
+        queryset.update(status="INQ_NEW", updated_at=timezone.now())
 
 
 # REGISTRATION
@@ -0,0 +1,93 @@
+# Generated by Django 6.0.9 on 2026-10-18 06:21
+
+import re
+from typing import Any
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from unidecode import unidecode
+
+# A frozen copy of roster.user_search as of this migration, so that later
+# changes to the tokenizer don't change what this migration does
+SOCIAL_SEARCH_KEYS = ("username", "global_name", "login", "name", "email")
+TOKEN_LENGTH = 64
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    normalized = " ".join(unidecode(text).lower().split())
+    return [token[:TOKEN_LENGTH] for token in TOKEN_RE.findall(normalized)]
+
+
+def user_tokens(user: Any, social_accounts: Any) -> set[str]:
+    texts = [user.first_name, user.last_name, user.username, user.email]
+    for account in social_accounts:
+        texts.append(account.uid)
+        if isinstance(account.extra_data, dict):
+            texts.extend(
+                str(account.extra_data[key])
+                for key in SOCIAL_SEARCH_KEYS
+                if account.extra_data.get(key)
+            )
+    return {token for text in texts for token in tokenize(text)}
+
+
+def index_users(apps: object, schema_editor: object) -> None:
+    User = apps.get_model("auth", "User")  # type: ignore[attr-defined]
+    UserSearchToken = apps.get_model("roster", "UserSearchToken")  # type: ignore[attr-defined]
+    users = User.objects.prefetch_related("socialaccount_set")
+    UserSearchToken.objects.bulk_create(
+        (
+            UserSearchToken(user=user, token=token)
+            for user in users.iterator(chunk_size=500)
+            for token in user_tokens(user, user.socialaccount_set.all())
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("roster", "0118_applyuuid_applicant_name_applyuuid_memo"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("socialaccount", "0006_alter_socialaccount_extra_data"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSearchToken",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "token",
+                    models.CharField(
+                        db_index=True,
+                        help_text="Lowercase ASCII letters and digits",
+                        max_length=64,
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        help_text="The user this word describes",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_tokens",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "token")},
+            },
+        ),
+        migrations.RunPython(index_users, reverse_code=migrations.RunPython.noop),
+    ]
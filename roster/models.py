@@ -1,14 +1,16 @@
 import os
 from _pydecimal import Decimal
+from collections.abc import Sequence
 from datetime import datetime, timedelta
 from hashlib import pbkdf2_hmac
-from typing import TypedDict
+from typing import Any, TypedDict
 
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import FileExtensionValidator
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, ExpressionWrapper, F, Q, When
+from django.db.models.functions import Round
 from django.db.models.query import QuerySet
 from django.urls import reverse
 from django.utils.timezone import localtime, now
@@ -87,6 +89,93 @@ class Assistant(models.Model):
         return self.user.get_full_name()
 
 
+class StudentQuerySet(QuerySet["Student"]):
+    def with_payment_status(self, when: datetime | None = None) -> "StudentQuerySet":
+        """Annotate `payment_status_code` and `payment_delinquent`, which are
+        Student.payment_status and Student.is_delinquent at `when` (default
+        now) worked out in the database, so they can be filtered on, and read
+        off the students without loading their invoices. Those properties
+        return the annotations when they're present."""
+        when = when or localtime()
+        week = timedelta(days=7)
+        cost = (
+            F("semester__prep_rate") * F("invoice__preps_taught")
+            + F("semester__hour_rate") * F("invoice__hours_taught")
+            + F("invoice__extras")
+            + F("invoice__adjustment")
+        )
+        paid = F("invoice__total_paid")
+
+        def cents(amount: Any) -> Round:
+            # The amounts all have two decimal places, so rounding to those is
+            # exact, and compares like the Decimals in Python even on SQLite,
+            # whose arithmetic on DECIMAL columns is floating point.
+            return Round(
+                ExpressionWrapper(
+                    amount,
+                    output_field=models.DecimalField(max_digits=12, decimal_places=2),
+                ),
+                2,
+            )
+
+        def overdue(deadline: str, t: datetime) -> Q:
+            # max(invoice created, deadline) < t
+            return Q(invoice__created_at__lt=t, **{f"{deadline}__lt": t})
+
+        initial = "payment_initial_deadline"
+        most = "semester__most_payment_deadline"
+        return self.alias(
+            payment_owed=cents(cost - paid - F("invoice__credits")),
+            # negative when less than two thirds has been paid
+            payment_thirds=cents(3 * paid - 2 * cost),
+            payment_initial_deadline=Case(
+                When(
+                    Q(
+                        semester__one_semester_date__isnull=False,
+                        semester__most_payment_deadline__isnull=False,
+                        invoice__created_at__gt=F("semester__one_semester_date"),
+                    ),
+                    then=F("semester__most_payment_deadline"),
+                ),
+                default=F("semester__first_payment_deadline"),
+            ),
+        ).annotate(
+            payment_status_code=Case(
+                When(semester__show_invoices=False, then=0),
+                When(invoice__isnull=True, then=0),
+                When(payment_owed__lte=0, then=0),
+                *(
+                    When(
+                        Q(payment_initial_deadline__isnull=False)
+                        & Q(invoice__total_paid__lte=0)
+                        & overdue(initial, t),
+                        then=code,
+                    )
+                    for code, t in ((3, when - week), (2, when), (1, when + week))
+                ),
+                *(
+                    When(
+                        Q(semester__most_payment_deadline__isnull=False)
+                        & Q(payment_thirds__lt=0)
+                        & overdue(most, t),
+                        then=code,
+                    )
+                    for code, t in ((7, when - week), (6, when), (5, when + week))
+                ),
+                default=4,
+                output_field=models.IntegerField(),
+            ),
+            payment_delinquent=ExpressionWrapper(
+                Q(payment_status_code__in=(3, 7))
+                & (
+                    Q(invoice__forgive_date__isnull=True)
+                    | Q(invoice__forgive_date__lt=when)
+                ),
+                output_field=models.BooleanField(),
+            ),
+        )
+
+
 class Student(models.Model):
     """This is really a pair of a user and a semester (with a display name),
     endowed with the data of the curriculum of that student.
@@ -151,6 +240,8 @@ class Student(models.Model):
         default=0, help_text="The last level the student was seen at."
     )
 
+    objects = StudentQuerySet.as_manager()
+
     class Meta:
         unique_together = (
             "user",
@@ -249,28 +340,7 @@ class Student(models.Model):
         return self.has_submitted_pset(unit)
 
     def generate_curriculum_rows(self) -> list[CurriculumRowTypeDict]:
-        curriculum = self.generate_curriculum_queryset().order_by("position")
-        unlocked_units_pks = self.unlocked_units.values_list("pk", flat=True)
-
-        rows = []
-        for i, unit in enumerate(curriculum):
-            n = i + 1
-            row: CurriculumRowTypeDict = {
-                "unit": unit,
-                "number": n,
-                "student_still_active": self.semester.active and self.enabled,
-                "is_submitted": getattr(unit, "has_pset", False),
-                "is_current": unit.pk in unlocked_units_pks,
-            }
-            row["is_visible"] = row["is_submitted"] or row["is_current"]
-            if self.semester.uses_legacy_pset_system is True:
-                row["is_accepted"] = row["is_submitted"] and not row["is_current"]
-                row["is_rejected"] = False
-            else:
-                row["is_accepted"] = unit.accepted  # type: ignore
-                row["is_rejected"] = unit.rejected  # type: ignore
-            rows.append(row)
-        return rows
+        return generate_curriculum_rows_bulk([self])[self.pk]
 
     @property
     def payment_status(self):
@@ -284,6 +354,8 @@ class Student(models.Model):
         6: warn of late payment for primary deadline
         7: lock late payment for primary deadline (more than 1 week past)
         """
+        if (status := getattr(self, "payment_status_code", None)) is not None:
+            return status
         if self.semester.show_invoices is False:
             return 0
         try:
@@ -331,11 +403,94 @@ class Student(models.Model):
 
     @property
     def is_delinquent(self) -> bool:
+        if (delinquent := getattr(self, "payment_delinquent", None)) is not None:
+            return delinquent
         return self.payment_status % 4 == 3 and (
             self.invoice.forgive_date is None or now() > self.invoice.forgive_date
         )
 
 
+# Markers for the curriculum state query; PSet statuses are all shorter
+UNLOCKED_MARKER = "unlocked"
+LEGACY_SUBMITTED_MARKER = "legacy"
+
+
+def generate_curriculum_rows_bulk(
+    students: Sequence[Student],
+) -> dict[int, list[CurriculumRowTypeDict]]:
+    """Return the curriculum rows of each of `students`, keyed by pk.
+
+    This takes two queries however many students and units there are: one
+    for the curricula and one for the unlocked units and submissions.
+    Select the students' semesters to avoid a query for each of those.
+    """
+    legacy_pks = [s.pk for s in students if s.semester.uses_legacy_pset_system]
+    modern_pks = [s.pk for s in students if not s.semester.uses_legacy_pset_system]
+
+    entries = (
+        Student.curriculum.through.objects.filter(student__in=[s.pk for s in students])
+        .select_related("unit__group")
+        .order_by("unit__position")
+    )
+    marker = models.CharField()
+    unlocked = (
+        Student.unlocked_units.through.objects.filter(
+            student__in=[s.pk for s in students]
+        )
+        .annotate(state=models.Value(UNLOCKED_MARKER, output_field=marker))
+        .values_list("student", "unit", "state")
+        .order_by()
+    )
+    psets = (
+        Unit.objects.filter(pset__student__in=modern_pks)
+        .values_list("pset__student", "pk", "pset__status")
+        .order_by()
+    )
+    uploads = (
+        Unit.objects.filter(
+            uploadedfile__benefactor__in=legacy_pks,
+            uploadedfile__category="psets",
+        )
+        .annotate(state=models.Value(LEGACY_SUBMITTED_MARKER, output_field=marker))
+        .values_list("uploadedfile__benefactor", "pk", "state")
+        .order_by()
+    )
+    states: dict[tuple[int, int], set[str]] = {}
+    for student_pk, unit_pk, state in unlocked.union(psets, uploads, all=True):
+        states.setdefault((student_pk, unit_pk), set()).add(state)
+
+    curricula: dict[int, list[Unit]] = {s.pk: [] for s in students}
+    for entry in entries:
+        curricula[entry.student_id].append(entry.unit)  # type: ignore[attr-defined]
+
+    rows_by_student: dict[int, list[CurriculumRowTypeDict]] = {}
+    for student in students:
+        legacy = student.semester.uses_legacy_pset_system is True
+        still_active = student.semester.active and student.enabled
+        rows: list[CurriculumRowTypeDict] = []
+        for n, unit in enumerate(curricula[student.pk], start=1):
+            unit_states = states.get((student.pk, unit.pk), set())
+            is_current = UNLOCKED_MARKER in unit_states
+            is_submitted = bool(unit_states - {UNLOCKED_MARKER})
+            row: CurriculumRowTypeDict = {
+                "unit": unit,
+                "number": n,
+                "student_still_active": still_active,
+                "is_submitted": is_submitted,
+                "is_current": is_current,
+                "is_visible": is_submitted or is_current,
+            }
+            if legacy:
+                row["is_accepted"] = is_submitted and not is_current
+                row["is_rejected"] = False
+            else:
+                row["is_accepted"] = "A" in unit_states
+                row["is_rejected"] = "R" in unit_states
+            rows.append(row)
+        rows_by_student[student.pk] = rows
+    return rows_by_student
+
+
 class Invoice(models.Model):
     """Billing information object for students."""
 
@@ -709,3 +864,25 @@ class ApplyUUID(models.Model):
     def registered_at(self) -> datetime | None:
         """When the student cashed in this UUID, or None if unused."""
         return self.reg.created_at if self.reg is not None else None
+
+
+class UserSearchToken(models.Model):
+    """One normalized word from a user's names, username, email or social
+    account handles, so the user lookup can match prefixes against an index
+    instead of scanning auth_user. See roster.user_search."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="search_tokens",
+        help_text="The user this word describes",
+    )
+    token = models.CharField(
+        max_length=64, db_index=True, help_text="Lowercase ASCII letters and digits"
+    )
+
+    class Meta:
+        unique_together = ("user", "token")
+
+    def __str__(self) -> str:
+        return f"{self.token} ({self.user_id})"  # type: ignore[attr-defined]
@@ -1,4 +1,6 @@
+import csv
 import datetime
+import io
 import re
 from decimal import Decimal
 from io import StringIO
@@ -11,8 +13,10 @@ from allauth.socialaccount.models import SocialAccount
 from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.contrib.messages import constants as message_levels
+from django.db import connection
 from django.db.models.query import QuerySet
 from django.shortcuts import get_object_or_404
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from freezegun.api import freeze_time
 
@@ -24,7 +28,7 @@ from core.factories import (
     UserProfileFactory,
 )
 from core.models import Semester, Unit, UnitGroup, UserProfile
-from dashboard.factories import PSetFactory
+from dashboard.factories import PSetFactory, UploadedFileFactory
 from roster.factories import (
     ApplyUUIDFactory,
     AssistantFactory,
@@ -32,6 +36,7 @@ from roster.factories import (
     RegistrationContainerFactory,
     StudentFactory,
     StudentRegistrationFactory,
+    UnitInquiryFactory,
 )
 from roster.models import (
     ApplyUUID,
@@ -41,10 +46,14 @@ from roster.models import (
     Student,
     StudentRegistration,
     UnitInquiry,
+    UserSearchToken,
     build_student,
+    generate_curriculum_rows_bulk,
 )
 
 from .admin import ApplyUUIDIEResource
+from .user_search import search_users, tokenize
+from .utils import accept_inquiries
 
 UTC = datetime.UTC
 
@@ -161,6 +170,47 @@ def test_user_lookup(otis) -> None:
     otis.assert_testid(resp, "user-inactive-badge")
 
 
+@pytest.mark.django_db
+def test_user_search() -> None:
+    jose = lookup_user("jnunez", "José", "Núñez")
+    josephine = lookup_user("jo", "Josephine", "Smith")
+    mary = lookup_user("mj", "Mary-Jane", "Goldsmith")
+    SocialAccount.objects.create(
+        user=mary, provider="discord", uid="424242", extra_data={"username": "MJ_W"}
+    )
+
+    assert tokenize("  José   Núñez <JN@x.org>") == ["jose", "nunez", "jn", "x", "org"]
+    # accents don't matter, and every query token has to match
+    assert search_users("jose nunez", 10) == [jose]
+    # an exact token beats a prefix
+    assert search_users("jose", 10) == [jose, josephine]
+    assert search_users("jo", 10) == [josephine, jose]
+    # social handles and uids, and substrings when no prefix matches
+    assert search_users("mj_w", 10) == [mary]
+    assert search_users("424242", 10) == [mary]
+    assert search_users("smith", 10) == [josephine]
+    assert search_users("oldsmi", 10) == [mary]
+    assert search_users("@@", 10) == []
+
+    # the index follows saves of users and their social accounts
+    mary.last_name = "Watson"
+    mary.save()
+    assert search_users("goldsmith", 10) == []
+    assert search_users("watson", 10) == [mary]
+    SocialAccount.objects.filter(user=mary).delete()
+    assert search_users("424242", 10) == []
+
+    # but logging in doesn't rebuild it
+    with CaptureQueriesContext(connection) as queries:
+        jose.save(update_fields=["last_login"])
+    assert len(queries) == 1
+
+    # deleting a user with social accounts takes the tokens too
+    SocialAccount.objects.create(user=jose, provider="github", uid="7")
+    jose.delete()
+    assert not UserSearchToken.objects.filter(token="nunez").exists()
+
+
 @pytest.mark.django_db
 def test_user_merge(otis) -> None:
     admin: User = UserFactory.create(is_superuser=True, is_staff=True)
@@ -252,6 +302,8 @@ def test_user_merge(otis) -> None:
     assert dupe_student.user == real
     assert social.user == real
     assert Student.objects.filter(user=real).count() == 2
+    # the search index followed the social account over
+    assert search_users("alicediscord", 10) == [real]
 
     # Merging into a nonexistent account does nothing, even when confirmed
     resp = otis.post_20x(
@@ -404,9 +456,37 @@ def test_giga_chart(otis) -> None:
         InvoiceFactory.create(student=student)
         UserProfileFactory.create(user=student.user)
 
+    for i, student in enumerate(students[:3]):
+        SocialAccount.objects.create(
+            user=student.user,
+            provider="Discord" if i else "github",
+            uid=str(i),
+            extra_data={"username": f"giga{i}", "discriminator": "0001"},
+        )
+    old: Student = StudentFactory.create(
+        reg=StudentRegistrationFactory.create(), semester__active=False
+    )
+    InvoiceFactory.create(student=old)
+    UserProfileFactory.create(user=old.user)
+
     admin = UserFactory.create(username="admin", is_staff=True, is_superuser=True)
     otis.login(admin)
-    otis.get_20x("giga-chart", "csv", follow=True)
+    resp = otis.get_20x("giga-chart", "csv", follow=True)
+    assert resp.streaming
+    # the rows are only read from the database as the response is sent
+    with CaptureQueriesContext(connection) as queries:
+        rows = list(csv.reader(io.StringIO(resp.getvalue().decode())))
+    assert len(queries) == 2  # invoices, then their social accounts
+    assert rows[0][:3] == ["pk", "Username", "Discord"]
+    assert {int(row[0]) for row in rows[1:]} == {student.pk for student in students}
+    discord = {int(row[0]): row[2] for row in rows[1:]}
+    assert discord[students[0].pk] == ""
+    assert discord[students[1].pk] == "giga1#0001"
+    assert discord[students[2].pk] == "giga2#0001"
+
+    resp = otis.get_20x("giga-chart", "csv", old.semester.pk)
+    rows = list(csv.reader(io.StringIO(resp.getvalue().decode())))
+    assert [int(row[0]) for row in rows[1:]] == [old.pk]
 
     # the giga-chart is an export: its rendered text is the product, so these
     # stay as content assertions
@@ -418,6 +498,12 @@ def test_giga_chart(otis) -> None:
             student.reg.parent_email,
         ]:
             otis.assert_has(resp, prop)
+    otis.assert_not_has(resp, old.name)
+
+    with mock.patch("roster.views.GIGA_CHART_PAGE_SIZE", 20):
+        resp = otis.get_20x("giga-chart", "html", data={"page": 2})
+    assert resp.context["page_obj"].paginator.num_pages == 2
+    assert len(resp.context["page_obj"].object_list) == 10
 
 
 @pytest.mark.django_db
@@ -596,6 +682,73 @@ def test_curriculum(otis) -> None:
     assert "Successfully saved curriculum of 6 units." in messages
 
 
+@pytest.mark.django_db
+def test_curriculum_rows_bulk() -> None:
+    units = UnitFactory.create_batch(6)
+    alice: Student = StudentFactory.create()
+    bob: Student = StudentFactory.create(
+        semester=SemesterFactory.create(uses_legacy_pset_system=True)
+    )
+    alice.curriculum.set(units)
+    alice.unlocked_units.set(units[:2])
+    PSetFactory.create(student=alice, unit=units[2], status="A")
+    PSetFactory.create(student=alice, unit=units[3], status="R")
+    PSetFactory.create(student=alice, unit=units[4], status="P")
+    bob.curriculum.set(units[:3])
+    bob.unlocked_units.set(units[1:2])
+    UploadedFileFactory.create(benefactor=bob, unit=units[0])
+    UploadedFileFactory.create(benefactor=bob, unit=units[1])
+
+    students = list(
+        Student.objects.filter(pk__in=(alice.pk, bob.pk)).select_related("semester")
+    )
+    with CaptureQueriesContext(connection) as ctx:
+        rows = generate_curriculum_rows_bulk(students)
+    assert len(ctx.captured_queries) == 2
+
+    def flags(row) -> tuple[bool, bool, bool, bool]:
+        return (
+            row["is_current"],
+            row["is_submitted"],
+            row["is_accepted"],
+            row["is_rejected"],
+        )
+
+    assert [row["number"] for row in rows[alice.pk]] == [1, 2, 3, 4, 5, 6]
+    assert [flags(row) for row in rows[alice.pk]] == [
+        (True, False, False, False),
+        (True, False, False, False),
+        (False, True, True, False),
+        (False, True, False, True),
+        (False, True, False, False),
+        (False, False, False, False),
+    ]
+    assert [flags(row) for row in rows[bob.pk]] == [
+        (False, True, True, False),
+        (True, True, False, False),
+        (False, False, False, False),
+    ]
+    assert rows[alice.pk] == alice.generate_curriculum_rows()
+
+    # still two queries with many more students, units and problem sets
+    more_units = UnitFactory.create_batch(30)
+    for student in StudentFactory.create_batch(10):
+        student.curriculum.set(more_units)
+        student.unlocked_units.set(more_units[:5])
+        for unit in more_units[5:15]:
+            PSetFactory.create(student=student, unit=unit, status="A")
+    students = list(Student.objects.select_related("semester"))
+    with CaptureQueriesContext(connection) as ctx:
+        rows = generate_curriculum_rows_bulk(students)
+    assert len(ctx.captured_queries) == 2
+    assert len(rows) == 12
+    assert all(
+        len(rows[student.pk]) == 30
+        for student in students
+        if student.pk not in (alice.pk, bob.pk)
+    )
+
+
 @pytest.mark.django_db
 def test_finalize(otis) -> None:
     alice: Student = StudentFactory.create(newborn=True)
@@ -998,6 +1151,46 @@ def test_inquiry(otis) -> None:
         otis.get_denied("inquiry", eve.pk)
 
 
+@pytest.mark.django_db
+def test_accept_inquiries_bulk() -> None:
+    units = UnitFactory.create_batch(5)
+    script = [
+        ("INQ_ACT_UNLOCK", 0),
+        ("INQ_ACT_APPEND", 1),
+        ("INQ_ACT_DROP", 2),
+        ("INQ_ACT_LOCK", 3),
+        ("INQ_ACT_UNLOCK", 2),
+        ("INQ_ACT_DROP", 0),
+        ("INQ_ACT_UNLOCK", 4),
+    ]
+    alice: Student = StudentFactory.create()
+    bob: Student = StudentFactory.create()
+    for student in (alice, bob):
+        student.curriculum.set(units[2:4])
+        student.unlocked_units.set(units[2:4])
+        for action_type, i in script:
+            UnitInquiryFactory.create(
+                student=student, unit=units[i], action_type=action_type
+            )
+    UnitInquiryFactory.create(student=alice, status="INQ_REJ")
+
+    for inquiry in UnitInquiry.objects.filter(student=alice).order_by("pk"):
+        if inquiry.status == "INQ_NEW":
+            inquiry.run_accept()
+    with CaptureQueriesContext(connection) as ctx:
+        n = accept_inquiries(
+            UnitInquiry.objects.filter(student=bob, status="INQ_NEW").order_by("pk")
+        )
+    assert n == len(script)
+    assert len(ctx.captured_queries) <= 12
+
+    assert set(bob.curriculum.all()) == set(alice.curriculum.all())
+    assert set(bob.unlocked_units.all()) == set(alice.unlocked_units.all())
+    assert set(bob.unlocked_units.all()) == {units[2], units[4]}
+    assert not UnitInquiry.objects.filter(student=bob).exclude(status="INQ_ACC")
+    assert UnitInquiry.objects.filter(status="INQ_REJ").count() == 1
+
+
 @pytest.mark.django_db
 def test_inquiry_cant_rapid_fire(otis) -> None:
     with freeze_time("2025-10-31", tz_offset=0):
@@ -1410,6 +1603,100 @@ def test_delinquency_for_joining_second_semester(otis) -> None:
         assert bob.is_delinquent
 
 
+@pytest.mark.django_db
+def test_payment_status_annotation(otis) -> None:
+    semester: Semester = SemesterFactory.create(
+        show_invoices=True,
+        first_payment_deadline=datetime.datetime(2022, 9, 21, tzinfo=UTC),
+        most_payment_deadline=datetime.datetime(2023, 1, 21, tzinfo=UTC),
+        one_semester_date=datetime.datetime(2022, 12, 30, tzinfo=UTC),
+    )
+    hidden: Semester = SemesterFactory.create(
+        show_invoices=False,
+        first_payment_deadline=datetime.datetime(2022, 9, 21, tzinfo=UTC),
+    )
+    StudentFactory.create(semester=semester)  # no invoice
+    with freeze_time("2022-08-05", tz_offset=0):
+        for total_paid in (0, 240, 400, 480, 1000):
+            InvoiceFactory.create(
+                student__semester=semester, preps_taught=2, total_paid=total_paid
+            )
+        InvoiceFactory.create(student__semester=hidden, preps_taught=2)
+        InvoiceFactory.create(
+            student__semester=semester,
+            preps_taught=2,
+            forgive_date=datetime.datetime(2022, 10, 31, tzinfo=UTC),
+        )
+    with freeze_time("2023-01-05", tz_offset=0):  # joined for the second half
+        InvoiceFactory.create(student__semester=semester, preps_taught=1)
+        InvoiceFactory.create(student__semester=semester, preps_taught=1, credits=240)
+
+    seen: set[int] = set()
+    for day in (
+        "2022-09-05",
+        "2022-09-17",
+        "2022-09-25",
+        "2022-10-15",
+        "2022-11-15",
+        "2023-01-17",
+        "2023-01-25",
+        "2023-02-15",
+    ):
+        with freeze_time(day, tz_offset=0):
+            students = Student.objects.with_payment_status()
+            for student in students:
+                plain = Student.objects.get(pk=student.pk)
+                assert student.payment_status == plain.payment_status, day
+                assert student.is_delinquent == plain.is_delinquent, day
+                seen.add(plain.payment_status)
+            assert {s.pk for s in students.filter(payment_delinquent=True)} == {
+                s.pk for s in Student.objects.all() if s.is_delinquent
+            }
+    assert seen == set(range(8))
+
+    admin: User = UserFactory.create(is_superuser=True, is_staff=True)
+    otis.login(admin)
+    with freeze_time("2022-10-15", tz_offset=0):
+        resp = otis.get_20x(
+            "admin:roster_student_changelist", data={"payment_status": "delinquent"}
+        )
+    assert set(resp.context["cl"].queryset) == set(
+        Student.objects.filter(
+            semester=semester,
+            invoice__preps_taught=2,
+            invoice__total_paid=0,
+            invoice__forgive_date=None,
+        )
+    )
+
+
+@pytest.mark.django_db
+def test_payment_status_annotation_decimal() -> None:
+    # 0.1 + 0.2 - 0.3 is exactly 0, but not in floating point
+    semester: Semester = SemesterFactory.create(
+        show_invoices=True,
+        first_payment_deadline=datetime.datetime(2022, 9, 21, tzinfo=UTC),
+        most_payment_deadline=datetime.datetime(2023, 1, 21, tzinfo=UTC),
+    )
+    with freeze_time("2022-08-05", tz_offset=0):
+        for total_paid, credits in (("0.3", "0"), ("0.1", "0.2"), ("0.2", "0")):
+            InvoiceFactory.create(
+                student__semester=semester,
+                preps_taught=0,
+                hours_taught=0,
+                extras=Decimal("0.1"),
+                adjustment=Decimal("0.2"),
+                total_paid=Decimal(total_paid),
+                credits=Decimal(credits),
+            )
+    for day in ("2022-09-17", "2023-01-25"):
+        with freeze_time(day, tz_offset=0):
+            for student in Student.objects.with_payment_status():
+                plain = Student.objects.get(pk=student.pk)
+                assert student.payment_status == plain.payment_status, day
+                assert student.is_delinquent == plain.is_delinquent, day
+
+
 @pytest.mark.django_db
 def test_update_invoice(otis) -> None:
     firefly: Assistant = AssistantFactory.create()
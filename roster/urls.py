@@ -16,6 +16,11 @@ urlpatterns = [
     path(r"register/", views.register, name="register"),
     path(r"profile/", views.update_profile, name="update-profile"),
     path(r"giga-chart/<str:format_as>/", views.giga_chart, name="giga-chart"),
+    path(
+        r"giga-chart/<str:format_as>/<int:semester_pk>/",
+        views.giga_chart,
+        name="giga-chart",
+    ),
     path(
         r"mystery_unlock/easier/",
         lambda request: redirect("../../mystery-unlock/easier/"),
@@ -0,0 +1,125 @@
+"""Indexed search for users by name, username, email or social handle.
+
+Every user's first and last name, username, email, and the handles and uid
+of their social accounts are split into tokens: runs of ASCII letters and
+digits after unidecode and lowercasing, so "José Núñez <jn@x.org>" gives
+jose, nunez, jn, x and org. Those are kept in UserSearchToken, rebuilt for
+a user by the receivers in core.signals whenever the user or one of their
+social accounts is saved. Code that writes with QuerySet.update() calls
+`reindex_users` itself; `manage.py rebuild_user_search` rebuilds everything.
+
+A query is tokenized the same way and a user matches if every query token
+is a prefix of one of theirs, which an index on the token column can serve.
+Matches are ranked by how many query tokens matched a token exactly. If no
+user matches by prefix, the tokens are tried as substrings instead, which
+is slower but still only reads the narrow token table.
+
+`normalize` and `tokenize` are also what other code matching pasted names
+against the roster should use, so that they agree with this search.
+"""
+
+import re
+from collections.abc import Iterable
+from functools import reduce
+from operator import or_
+from typing import Any
+
+from django.contrib.auth.models import User
+from django.db.models import Case, F, Max, Q, QuerySet, Value, When
+from unidecode import unidecode
+
+from .models import UserSearchToken
+
+# extra_data keys of a social account that hold something a person would type
+SOCIAL_SEARCH_KEYS = ("username", "global_name", "login", "name", "email")
+TOKEN_LENGTH = UserSearchToken._meta.get_field("token").max_length or 64
+# Longer queries are cut to this many tokens, to keep the ranking query small
+MAX_QUERY_TOKENS = 8
+REINDEX_BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """`text` transliterated to ASCII, lowercased, with whitespace collapsed."""
+    return " ".join(unidecode(text).lower().split())
+
+
+def tokenize(text: str) -> list[str]:
+    """The search tokens of `text`, in order."""
+    return [token[:TOKEN_LENGTH] for token in _TOKEN_RE.findall(normalize(text))]
+
+
+def user_tokens(user: Any, social_accounts: Iterable[Any]) -> set[str]:
+    """All the tokens `user` should be found by.
+
+    Migration 0119 keeps its own copy of this and `tokenize`."""
+    texts = [user.first_name, user.last_name, user.username, user.email]
+    for account in social_accounts:
+        texts.append(account.uid)
+        if isinstance(account.extra_data, dict):
+            texts.extend(
+                str(account.extra_data[key])
+                for key in SOCIAL_SEARCH_KEYS
+                if account.extra_data.get(key)
+            )
+    return {token for text in texts for token in tokenize(text)}
+
+
+def reindex_users(user_ids: Iterable[int]) -> None:
+    """Rebuild the search tokens of each of `user_ids`."""
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), REINDEX_BATCH_SIZE):
+        batch = user_ids[i : i + REINDEX_BATCH_SIZE]
+        users = User.objects.filter(pk__in=batch).prefetch_related("socialaccount_set")
+        UserSearchToken.objects.filter(user__in=batch).delete()
+        # two saves of one user can reindex at once; whichever inserts a
+        # token second just finds it there already
+        UserSearchToken.objects.bulk_create(
+            (
+                UserSearchToken(user=user, token=token)
+                for user in users
+                for token in user_tokens(user, user.socialaccount_set.all())  # type: ignore[attr-defined]
+            ),
+            ignore_conflicts=True,
+        )
+
+
+def _ranked_user_ids(terms: list[str], lookup: str, limit: int) -> list[int]:
+    def matches(term: str) -> Q:
+        return Q(**{f"token__{lookup}": term})
+
+    scores = {
+        f"term{i}": Max(
+            Case(
+                When(token=term, then=Value(2)),
+                When(matches(term), then=Value(1)),
+                default=Value(0),
+            )
+        )
+        for i, term in enumerate(terms)
+    }
+    ranked = (
+        UserSearchToken.objects.filter(reduce(or_, map(matches, terms)))
+        .values("user")
+        .annotate(**scores)
+        .filter(**{f"{name}__gt": 0 for name in scores})
+        .annotate(rank=sum((F(name) for name in scores), Value(0)))
+        .order_by("-rank", "user__username")
+    )
+    return [row["user"] for row in ranked[:limit]]
+
+
+def search_users(
+    query: str, limit: int, users: QuerySet[User] | None = None
+) -> list[User]:
+    """The best `limit` matches for `query`, best first, taken from `users`
+    (which may carry select_related and prefetch_related)."""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+    if not terms:
+        return []
+    user_ids = _ranked_user_ids(terms, "startswith", limit) or _ranked_user_ids(
+        terms, "contains", limit
+    )
+    found = (User.objects.all() if users is None else users).in_bulk(user_ids)
+    return [found[pk] for pk in user_ids if pk in found]
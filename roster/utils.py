@@ -1,15 +1,25 @@
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import NamedTuple
+
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
 from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.http import Http404
 from django.http.request import HttpRequest
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
+from core.unit_access import invalidate_unit_access
 from roster.models import Student
+from roster.user_search import normalize
 
 from . import models
 
+UNIT_ROWS_BATCH_SIZE = 500
+
 
 def get_current_students(
     queryset: QuerySet[Student] | None = None,
@@ -43,7 +53,9 @@ def get_student_by_pk(
     """Returns an ordered pair containing a Student object and
     a boolean indicating whether editing is allowed (is instructor)."""
 
-    student = get_object_or_404(models.Student, pk=student_pk)
+    student = get_object_or_404(
+        models.Student.objects.with_payment_status(), pk=student_pk
+    )
 
     if not isinstance(request.user, User):
         raise PermissionDenied("Authentication is needed, how did you even get here?")
@@ -92,3 +104,154 @@ def infer_student(request: HttpRequest) -> models.Student:
         raise Http404("No Student matches the given query.")
     else:
         return student
+
+
+def update_student_units(
+    field: str,
+    added: Iterable[tuple[int, int]] = (),
+    removed: Iterable[tuple[int, int]] = (),
+) -> None:
+    """Add and remove (student pk, unit pk) pairs from a Student-Unit relation.
+
+    `field` is "curriculum" or "unlocked_units". This writes the through
+    table directly, in a handful of queries however many pairs there are.
+    Removals are done before additions, and pairs already in the state asked
+    for are skipped. Unlike the related managers, this sends no m2m_changed
+    signals; the unit access cache is invalidated here instead.
+    """
+    through = getattr(models.Student, field).through
+    added = set(added)
+    removed = set(removed)
+    if removed:
+        rows = through.objects.filter(
+            student__in={student for student, _ in removed},
+            unit__in={unit for _, unit in removed},
+        ).values_list("pk", "student", "unit")
+        doomed = [pk for pk, student, unit in rows if (student, unit) in removed]
+        for i in range(0, len(doomed), UNIT_ROWS_BATCH_SIZE):
+            batch = doomed[i : i + UNIT_ROWS_BATCH_SIZE]
+            through.objects.filter(pk__in=batch).delete()
+    if added:
+        through.objects.bulk_create(
+            [through(student_id=student, unit_id=unit) for student, unit in added],
+            ignore_conflicts=True,
+            batch_size=UNIT_ROWS_BATCH_SIZE,
+        )
+    if field == "unlocked_units" and (students := {s for s, _ in added | removed}):
+        invalidate_unit_access(
+            Student.objects.filter(pk__in=students).values_list("user", flat=True)
+        )
+
+
+def _read_units(field: str, students: Iterable[int]) -> dict[int, set[int]]:
+    students = set(students)
+    units: dict[int, set[int]] = {student: set() for student in students}
+    through = getattr(models.Student, field).through
+    for student, unit in through.objects.filter(student__in=students).values_list(
+        "student", "unit"
+    ):
+        units[student].add(unit)
+    return units
+
+
+def _diff_units(
+    before: dict[int, set[int]], after: dict[int, set[int]]
+) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+    added = [(s, u) for s, units in after.items() for u in units - before[s]]
+    removed = [(s, u) for s, units in before.items() for u in units - after[s]]
+    return added, removed
+
+
+def accept_inquiries(inquiries: QuerySet[models.UnitInquiry]) -> int:
+    """Accept `inquiries` as UnitInquiry.run_accept would, one after another
+    in the queryset's order, but with a fixed number of queries.
+
+    Each student's curriculum and unlocked units are read once, the actions
+    are replayed on them in memory, and only the difference is written back.
+    Returns the number of inquiries accepted.
+    """
+    with transaction.atomic():
+        rows = list(inquiries.values_list("pk", "student", "unit", "action_type"))
+        for *_, action_type in rows:
+            if action_type not in (
+                "INQ_ACT_UNLOCK",
+                "INQ_ACT_APPEND",
+                "INQ_ACT_DROP",
+                "INQ_ACT_LOCK",
+            ):
+                raise ValueError(f"No action {action_type}")
+        students = {student for _, student, _, _ in rows}
+
+        before = {
+            field: _read_units(field, students)
+            for field in ("curriculum", "unlocked_units")
+        }
+        after = {
+            field: {student: set(units) for student, units in current.items()}
+            for field, current in before.items()
+        }
+
+        curriculum = after["curriculum"]
+        unlocked = after["unlocked_units"]
+        for _, student, unit, action_type in rows:
+            if action_type == "INQ_ACT_UNLOCK":
+                curriculum[student].add(unit)
+                unlocked[student].add(unit)
+            elif action_type == "INQ_ACT_APPEND":
+                curriculum[student].add(unit)
+            elif action_type == "INQ_ACT_DROP":
+                curriculum[student].discard(unit)
+                unlocked[student].discard(unit)
+            elif action_type == "INQ_ACT_LOCK":
+                unlocked[student].discard(unit)
+
+        for field in ("curriculum", "unlocked_units"):
+            added, removed = _diff_units(before[field], after[field])
+            update_student_units(field, added, removed)
+        pks = [pk for pk, *_ in rows]
+        now = timezone.now()
+        for i in range(0, len(pks), UNIT_ROWS_BATCH_SIZE):
+            models.UnitInquiry.objects.filter(
+                pk__in=pks[i : i + UNIT_ROWS_BATCH_SIZE]
+            ).update(status="INQ_ACC", updated_at=now)
+    return len(rows)
+
+
+class RosterMatch(NamedTuple):
+    """The lines of a pasted list of students, sorted by whom they name."""
+
+    # each line naming exactly one student, as that student and the line's
+    # tab-separated fields (stripped, the name first)
+    matched: list[tuple[models.Student, list[str]]]
+    unmatched: list[str]
+    # lines whose name is shared by several students
+    ambiguous: list[str]
+
+
+def match_roster_lines(
+    text: str, students: QuerySet[models.Student] | None = None
+) -> RosterMatch:
+    """Match each nonblank line of `text`, whose first tab-separated field is
+    a full name, to the student of that name among `students` (by default,
+    those of the active semester). Names are compared after normalize from
+    roster.user_search, so case, spacing and accents don't matter.
+    This reads the students once, however long `text` is."""
+    if students is None:
+        students = get_current_students()
+    index: dict[str, list[models.Student]] = defaultdict(list)
+    for student in students.select_related("user"):
+        index[normalize(student.user.get_full_name())].append(student)
+
+    result = RosterMatch([], [], [])
+    for line in text.splitlines():
+        if not (line := line.strip()):
+            continue
+        fields = [field.strip() for field in line.split("\t")]
+        candidates = index.get(normalize(fields[0]), [])
+        if len(candidates) == 1:
+            result.matched.append((candidates[0], fields))
+        elif candidates:
+            result.ambiguous.append(line)
+        else:
+            result.unmatched.append(line)
+    return result
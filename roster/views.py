@@ -12,8 +12,9 @@ So e.g. "list students by most recent pset" goes under dashboard.
 
 import collections
 import datetime
+import itertools
 import logging
-from collections.abc import Sequence
+from collections.abc import Iterable, Iterator, Sequence
 from typing import Any
 
 from allauth.socialaccount.models import SocialAccount
@@ -26,25 +27,28 @@ from django.core.exceptions import (
     ObjectDoesNotExist,
     PermissionDenied,
 )
+from django.core.paginator import Paginator
 from django.db.models.expressions import F
 from django.db.models.fields import FloatField
 from django.db.models.functions.comparison import Cast
 from django.db.models.manager import Manager
 from django.db.models.query import QuerySet
-from django.db.models.query_utils import Q
 from django.db.transaction import atomic
 from django.forms import ValidationError
 from django.forms.models import BaseModelForm
 from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect
+from django.http.response import HttpResponseBase
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.text import slugify
 from django.views.decorators.http import require_POST
 from django.views.generic.edit import UpdateView
 from django.views.generic.list import ListView
 from django_discordo import SUCCESS_LOG_LEVEL
 from prettytable import PrettyTable
 
+from core.csv_stream import StreamingCsvResponse
 from core.models import EMAIL_PREFERENCE_FIELDS, Semester, Unit, UserProfile
 from dashboard.models import PSet
 from otisweb.decorators import admin_required, staff_required
@@ -56,12 +60,14 @@ from otisweb.mixins import (
 from otisweb.utils import AuthHttpRequest
 from roster.forms import LinkAssistantForm
 from roster.models import ApplyUUID, Assistant
+from roster.user_search import reindex_users, search_users
 from roster.utils import (
     can_edit,
     get_current_students,
     get_student_by_pk,
     infer_student,
 )
+from rpg.levelsys import refresh_meters
 
 from .forms import (
     AdvanceForm,
@@ -524,7 +530,7 @@ def register(request: AuthHttpRequest) -> HttpResponse:
                 "gender",
             ):
                 initial_data_dict[k] = getattr(most_recent_reg, k)
-        profile, _ = UserProfile.objects.get_or_create(user=request.user)
+        profile = request.profile
         for k in EMAIL_PREFERENCE_FIELDS:
             initial_data_dict[k] = getattr(profile, k)
         form = DecisionForm(initial=initial_data_dict)
@@ -609,13 +615,45 @@ def unlock_rest_of_mystery(request: HttpRequest, delta: int = 1) -> HttpResponse
     return HttpResponseRedirect("/")
 
 
-@admin_required
-def giga_chart(request: HttpRequest, format_as: str) -> HttpResponse:
+GIGA_CHART_HEADER = [
+    "pk",
+    "Username",
+    "Discord",
+    "Name",
+    "Enabled",
+    "Debt%",
+    "Last login (days)",
+    "Grade",
+    "Gender",
+    "Country",
+    "AoPS",
+    "Student email",
+    "Parent email",
+    "Owed",
+    # 'Preps',
+    # 'Hours',
+    "Adjustment",
+    "Credits",
+    "Extras",
+    "Total Paid",
+    "Forgive",
+]
+# Invoices read from the database per round trip by the CSV export
+GIGA_CHART_CHUNK_SIZE = 500
+GIGA_CHART_PAGE_SIZE = 200
+
+
+def _giga_chart_invoices(semester: Semester | None) -> QuerySet[Invoice]:
+    """The invoices of the legit students of `semester` (or of the active
+    semesters), in giga-chart order."""
     queryset = Invoice.objects.filter(student__legit=True)
-    queryset = queryset.filter(student__semester__active=True)
+    if semester is None:
+        queryset = queryset.filter(student__semester__active=True)
+    else:
+        queryset = queryset.filter(student__semester=semester)
     queryset = queryset.select_related(
         "student__user",
-        "student__reg",
+        "student__reg__container__semester",
         "student__semester",
         "student__user__profile",
     )
@@ -634,101 +672,99 @@ def giga_chart(request: HttpRequest, format_as: str) -> HttpResponse:
     queryset = queryset.annotate(
         debt=Cast(F("owed") / (F("owed") + F("total_paid") + 1e-8), FloatField())
     )
-
-    queryset = queryset.order_by(
+    return queryset.order_by(
         "student__enabled",
         "-forgive_date",
         "debt",
         "student__user__first_name",
+        "pk",
     )
-    timestamp = timezone.now().strftime("%Y-%m-%d-%H%M%S")
 
-    if settings.TESTING is True:
-        where = "test"
-    elif settings.DEBUG is True:
-        where = "debug"
-    else:
-        where = "prod"
-    rows = []
-    header_row = [
-        "pk",
-        "Username",
-        "Discord",
-        "Name",
-        "Enabled",
-        "Debt%",
-        "Last login (days)",
-        "Grade",
-        "Gender",
-        "Country",
-        "AoPS",
-        "Student email",
-        "Parent email",
-        "Owed",
-        # 'Preps',
-        # 'Hours',
-        "Adjustment",
-        "Credits",
-        "Extras",
-        "Total Paid",
-        "Forgive",
-    ]  # header row
-
-    for invoice in queryset:
+
+def _giga_chart_rows(invoices: Iterable[Invoice]) -> Iterator[list[Any]]:
+    now = timezone.now()
+    for invoice in invoices:
         student = invoice.student
         user = student.user
         if user is None:
             continue
         reg = student.reg
-        delta = timezone.now() - user.profile.last_seen
+        delta = now - user.profile.last_seen
         days_since_last_seen = round(delta.total_seconds() / (3600 * 24), ndigits=2)
-        socials: Manager[SocialAccount] = student.user.socialaccount_set  # type:ignore
-
-        rows.append(
-            [
-                student.pk,
-                user.username,
-                "; ".join(
-                    f"{d.extra_data['username']}#{d.extra_data['discriminator']}"
-                    for d in socials.filter(provider__iexact="Discord")
-                ),
-                student.name,
-                "Enabled" if student.enabled else "Disabled",
-                f"{invoice.debt:.2f}",  # type: ignore
-                days_since_last_seen,
-                reg.grade if reg is not None else "",
-                reg.get_gender_display() if reg is not None else "",
-                reg.country if reg is not None else "",
-                reg.aops_username if reg is not None else "",
-                user.email,
-                reg.parent_email if reg is not None else "",
-                round(invoice.total_owed),
-                # invoice.preps_taught,
-                # invoice.hours_taught,
-                round(invoice.adjustment),
-                round(invoice.credits),
-                round(invoice.extras),
-                round(invoice.total_paid),
-                invoice.forgive_date,
-            ]
-        )
+        # filtered here rather than in the database, so the prefetch is used
+        socials: Manager[SocialAccount] = user.socialaccount_set  # type:ignore
+
+        yield [
+            student.pk,
+            user.username,
+            "; ".join(
+                f"{d.extra_data['username']}#{d.extra_data['discriminator']}"
+                for d in socials.all()
+                if d.provider.lower() == "discord"
+            ),
+            student.name,
+            "Enabled" if student.enabled else "Disabled",
+            f"{invoice.debt:.2f}",  # type: ignore
+            days_since_last_seen,
+            reg.grade if reg is not None else "",
+            reg.get_gender_display() if reg is not None else "",
+            reg.country if reg is not None else "",
+            reg.aops_username if reg is not None else "",
+            user.email,
+            reg.parent_email if reg is not None else "",
+            round(invoice.total_owed),
+            # invoice.preps_taught,
+            # invoice.hours_taught,
+            round(invoice.adjustment),
+            round(invoice.credits),
+            round(invoice.extras),
+            round(invoice.total_paid),
+            invoice.forgive_date,
+        ]
+
+
+@admin_required
+def giga_chart(
+    request: HttpRequest, format_as: str, semester_pk: int | None = None
+) -> HttpResponseBase:
+    semester = None
+    if semester_pk is not None:
+        semester = get_object_or_404(Semester, pk=semester_pk)
+    queryset = _giga_chart_invoices(semester)
+    timestamp = timezone.now().strftime("%Y-%m-%d-%H%M%S")
 
-    pt = PrettyTable()
-    pt.field_names = header_row
+    if settings.TESTING is True:
+        where = "test"
+    elif settings.DEBUG is True:
+        where = "debug"
+    else:
+        where = "prod"
+    if semester is not None:
+        where += f"-{slugify(semester.name)}"
     title = f"OTIS Giga-Chart ({where}) generated {timestamp}"
-    for row in rows:
-        pt.add_row(row)
 
     format_as = format_as.lower()
     if format_as == "csv":
-        filename = f"otis-{where}-{timestamp}.csv"
-        return HttpResponse(
-            content=pt.get_csv_string(),
-            content_type="text/csv",
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        invoices = queryset.iterator(chunk_size=GIGA_CHART_CHUNK_SIZE)
+        return StreamingCsvResponse(
+            itertools.chain([GIGA_CHART_HEADER], _giga_chart_rows(invoices)),
+            filename=f"otis-{where}-{timestamp}.csv",
         )
     elif format_as == "html":
-        context = {"title": title, "table": pt.get_html_string()}
+        paginator = Paginator(queryset, GIGA_CHART_PAGE_SIZE)
+        page_obj = paginator.get_page(request.GET.get("page"))
+        pt = PrettyTable()
+        pt.field_names = GIGA_CHART_HEADER
+        for row in _giga_chart_rows(page_obj.object_list):
+            pt.add_row(row)
+        context = {
+            "title": title,
+            "table": pt.get_html_string(),
+            "page_obj": page_obj,
+            "format_as": format_as,
+            "semester": semester,
+            "semesters": Semester.objects.order_by("-end_year", "name"),
+        }
         return render(request, "roster/gigachart.html", context)
     else:
         raise NotImplementedError(f"Format {format_as} not implemented yet")
@@ -872,18 +908,10 @@ def user_lookup(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         form = UserLookupForm(request.POST)
         if form.is_valid():
-            query = form.cleaned_data["query"]
-            users = list(
-                User.objects.filter(
-                    Q(username__icontains=query)
-                    | Q(email__icontains=query)
-                    | Q(first_name__icontains=query)
-                    | Q(last_name__icontains=query)
-                    | Q(socialaccount__extra_data__icontains=query)
-                )
-                .distinct()
-                .prefetch_related("socialaccount_set", "groups")
-                .order_by("username")[:USER_LOOKUP_LIMIT]
+            users = search_users(
+                form.cleaned_data["query"],
+                USER_LOOKUP_LIMIT,
+                User.objects.prefetch_related("socialaccount_set", "groups"),
             )
             results = _user_summaries(users)
     else:
@@ -945,6 +973,8 @@ def user_merge(request: HttpRequest) -> HttpResponse:
         impostor.groups.clear()
         impostor.is_active = False
         impostor.save()
+        refresh_meters([impostor.pk, crewmate.pk])
+        reindex_users([impostor.pk, crewmate.pk])
     messages.success(
         request,
         f"Merged {impostor.username} ({impostor.pk}) into "
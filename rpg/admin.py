@@ -11,6 +11,7 @@ from .models import (
     BonusLevel,
     BonusLevelUnlock,
     Level,
+    MeterLedger,
     PalaceCarving,
     QuestComplete,
 )
@@ -163,6 +164,23 @@ class BonusLevelUnlockAdmin(admin.ModelAdmin):
     list_filter = ("student__semester__active",)
 
 
+@admin.register(MeterLedger)
+class MeterLedgerAdmin(admin.ModelAdmin):
+    readonly_fields = ("updated_at",)
+    list_display = (
+        "user",
+        "clubs_any",
+        "hearts",
+        "diamonds",
+        "spades_quizzes",
+        "spades_quests",
+        "spades_markets",
+        "updated_at",
+    )
+    autocomplete_fields = ("user",)
+    search_fields = ("user__username",)
+
+
 @admin.register(PalaceCarving)
 class PalaceCarvingAdmin(admin.ModelAdmin):
     readonly_fields = ("created_at",)
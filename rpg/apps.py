@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RpgConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "rpg"
+
+    def ready(self) -> None:
+        from . import signals  # noqa: F401
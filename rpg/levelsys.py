@@ -1,15 +1,22 @@
 # Functions to compute student levels and whatnot
+import bisect
 import datetime
 import logging
-from typing import Any, TypedDict
-
-from django.db.models.aggregates import Count, Max, Sum
-from django.db.models.expressions import OuterRef, Subquery
+import time
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import Any, NamedTuple, TypedDict
+from uuid import uuid4
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.aggregates import Aggregate, Count, Min, Sum
+from django.db.models.expressions import F
 from django.db.models.query import QuerySet
 from django.db.models.query_utils import Q
 from django.utils import timezone
 from django_discordo import VERBOSE_LOG_LEVEL
-from sql_util.aggregates import SubqueryCount, SubquerySum
+from sql_util.aggregates import SubqueryCount
 from sql_util.utils import Exists
 
 from core.models import UserProfile
@@ -25,7 +32,9 @@ from .models import (
     AchievementUnlock,
     BonusLevel,
     BonusLevelUnlock,
+    LeaderboardSnapshot,
     Level,
+    MeterLedger,
     QuestComplete,
 )
 
@@ -176,149 +185,401 @@ class LevelInfoDict(TypedDict):
     hanabi_replays: QuerySet[HanabiReplay]
 
 
-def get_level_info(student: Student) -> LevelInfoDict:
-    """Uses a bunch of expensive database queries to compute a student's levels and data,
-    returning the findings as a typed dictionary."""
+class LevelTable:
+    """The Level table sorted by threshold, for looking up level names.
 
-    level_data = LevelInfoDict()  # type: ignore
+    Levels hardly ever change, so each process keeps one of these around,
+    stamped with the version and the time it was read at;
+    see `get_level_table`."""
 
-    total_clubs, total_hearts = get_clubs_hearts_stats(student, level_data)
+    def __init__(self, version: str, levels: list[tuple[int, str]]):
+        self.version = version
+        self.read_at = time.monotonic()
+        self.thresholds = [threshold for threshold, _ in levels]
+        self.names = [name for _, name in levels]
 
-    total_diamonds = get_diamond_stats(student)
+    @property
+    def max_level(self) -> int:
+        return self.thresholds[-1] if self.thresholds else 0
+
+    def get_name(self, level_number: int) -> str:
+        i = bisect.bisect_right(self.thresholds, level_number)
+        return self.names[i - 1] if i > 0 else "No level"
+
+
+LEVEL_TABLE_VERSION_KEY = "rpg-level-table-version"
+# A process re-reads the table at least this often (in seconds), since with a
+# per-process cache it never sees the version bumped by another worker
+LEVEL_TABLE_TTL = 60
+_level_table: LevelTable | None = None
+
+
+def get_level_table() -> LevelTable:
+    """Returns the Level table, only reading it from the database
+    if it has changed since this process last did, or was last read
+    more than LEVEL_TABLE_TTL seconds ago."""
+    global _level_table
+    version = cache.get(LEVEL_TABLE_VERSION_KEY)
+    if version is None:
+        cache.add(LEVEL_TABLE_VERSION_KEY, uuid4().hex, timeout=None)
+        version = cache.get(LEVEL_TABLE_VERSION_KEY)
+    if (
+        _level_table is None
+        or _level_table.version != version
+        or time.monotonic() - _level_table.read_at > LEVEL_TABLE_TTL
+    ):
+        levels = Level.objects.order_by("threshold").values_list("threshold", "name")
+        _level_table = LevelTable(version, list(levels))
+    return _level_table
+
+
+def invalidate_level_table() -> None:
+    """Makes every process sharing the cache re-read the Level table on its
+    next lookup; the others do once their copy is LEVEL_TABLE_TTL old."""
+    cache.set(LEVEL_TABLE_VERSION_KEY, uuid4().hex, timeout=None)
+
+
+class MeterSource(NamedTuple):
+    """One of the tables feeding the meters.
+
+    `user_field` is the path from a row to the user it counts for, and
+    `aggregates` are taken over each user's rows; their names are the
+    MeterLedger columns they fill in."""
+
+    queryset: QuerySet[Any]
+    user_field: str
+    aggregates: dict[str, Aggregate]
+
+
+# The MeterLedger columns that feed into the meters
+METER_LEDGER_FIELDS = (
+    "clubs_any",
+    "clubs_D",
+    "clubs_Z",
+    "hearts",
+    "diamonds",
+    "spades_quizzes",
+    "spades_quests",
+    "spades_count_mocks",
+    "spades_markets",
+    "spades_suggestions",
+    "spades_jobs",
+    "spades_hanabi",
+)
 
-    total_spades = get_spade_stats(student, level_data)
 
-    try:
-        dynamic_progress = (UserProfile.objects.get(user=student.user)).dynamic_progress
-    except UserProfile.DoesNotExist:
-        dynamic_progress = False
+def get_meter_sources() -> dict[str, MeterSource]:
+    now = timezone.now()
+    return {
+        "psets": MeterSource(
+            PSet.objects.filter(status="A", eligible=True),
+            "student__user",
+            {
+                "clubs_any": Sum("clubs"),
+                "clubs_D": Sum("clubs", filter=Q(unit__code__startswith="D")),
+                "clubs_Z": Sum("clubs", filter=Q(unit__code__startswith="Z")),
+                "hearts": Sum("hours"),
+            },
+        ),
+        "achievements": MeterSource(
+            AchievementUnlock.objects.all(),
+            "user",
+            {"diamonds": Sum("achievement__diamonds")},
+        ),
+        "quizzes": MeterSource(
+            ExamAttempt.objects.all(),
+            "student__user",
+            {"spades_quizzes": Sum("score")},
+        ),
+        "quests": MeterSource(
+            QuestComplete.objects.all(),
+            "student__user",
+            {"spades_quests": Sum("spades")},
+        ),
+        "mocks": MeterSource(
+            MockCompleted.objects.all(),
+            "student__user",
+            {"spades_count_mocks": Count("pk")},
+        ),
+        # guesses only count once the market closes,
+        # so also record when the next one will
+        "markets": MeterSource(
+            Guess.objects.all(),
+            "user",
+            {
+                "spades_markets": Sum("score", filter=Q(market__end_date__lt=now)),
+                "stale_at": Min(
+                    "market__end_date",
+                    filter=Q(market__end_date__gte=now, score__isnull=False),
+                ),
+            },
+        ),
+        "suggestions": MeterSource(
+            ProblemSuggestion.objects.filter(
+                status__in=("SUGG_NOK", "SUGG_OK"), eligible=True
+            ),
+            "user",
+            {"spades_suggestions": Count("unit", distinct=True)},
+        ),
+        "jobs": MeterSource(
+            Job.objects.filter(progress="JOB_VFD"),
+            "assignee__user",
+            {"spades_jobs": Sum("spades_bounty")},
+        ),
+        "hanabi": MeterSource(
+            HanabiReplay.objects.filter(contest__processed=True),
+            "hanabiparticipation__player__user",
+            {"spades_hanabi": Sum("spades_score")},
+        ),
+    }
+
 
-    meters: FourMetersDict = {
-        "clubs": Meter.ClubMeter(int(total_clubs), dynamic_progress),
-        "hearts": Meter.HeartMeter(round(total_hearts, 2), dynamic_progress),
-        "diamonds": Meter.DiamondMeter(int(total_diamonds), dynamic_progress),
-        "spades": Meter.SpadeMeter(round(total_spades, 1), dynamic_progress),
+def empty_meter_totals(sources: Iterable[str] | None = None) -> dict[str, Any]:
+    """The MeterLedger columns of a user with no rows in any of the sources."""
+    all_sources = get_meter_sources()
+    return {
+        key: aggregate.empty_result_set_value
+        for name in (all_sources if sources is None else sources)
+        for key, aggregate in all_sources[name].aggregates.items()
     }
 
-    # Real component of level
-    level_number = sum(meter.level for meter in meters.values())  # type: ignore
-    level = (
-        Level.objects.filter(threshold__lte=level_number).order_by("-threshold").first()
-    )
-    level_name = level.name if level is not None else "No Level"
-    max_level = Level.objects.all().aggregate(max=Max("threshold"))["max"] or 0
-
-    # Imaginary component of level
-    im_level_number = sum(meter.im_level for meter in meters.values())  # type: ignore
-    if im_level_number == 0:
-        str_im_level = ""
-    elif im_level_number == 1:
-        str_im_level = "+ i"
-    else:
-        str_im_level = f"+ {im_level_number}i"
-
-    level_data["meters"] = meters
-    level_data["level_number"] = level_number
-    level_data["level_name"] = level_name
-    level_data["is_maxed"] = level_number >= max_level
-    level_data["bonus_levels"] = BonusLevel.objects.filter(level__lte=level_number)
-    level_data["str_im_level"] = str_im_level
-
-    return level_data
-
-
-def get_clubs_hearts_stats(
-    student: Student, leveldict: LevelInfoDict = None
-) -> tuple[float, int]:
-    psets = PSet.objects.filter(student__user=student.user, status="A", eligible=True)
-    psets = psets.order_by("upload__created_at")
-    pset_data = psets.aggregate(
-        clubs_any=Sum("clubs"),
-        clubs_D=Sum("clubs", filter=Q(unit__code__startswith="D")),
-        clubs_Z=Sum("clubs", filter=Q(unit__code__startswith="Z")),
-        hearts=Sum("hours"),
+
+def compute_meter_totals(
+    user_ids: Iterable[int] | None = None, sources: Iterable[str] | None = None
+) -> dict[int, dict[str, Any]]:
+    """Aggregates the meter sources from scratch, one GROUP BY query per source.
+
+    Returns the MeterLedger columns for each of `user_ids`, or, if that is None,
+    for every user with at least one row in some source."""
+    all_sources = get_meter_sources()
+    names = list(all_sources if sources is None else sources)
+    empty = empty_meter_totals(names)
+    totals: dict[int, dict[str, Any]] = {}
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return totals
+
+    for name in names:
+        source = all_sources[name]
+        queryset = source.queryset.order_by()
+        if user_ids is None:
+            queryset = queryset.filter(**{f"{source.user_field}__isnull": False})
+        else:
+            queryset = queryset.filter(**{f"{source.user_field}__in": user_ids})
+        for row in queryset.values(source.user_field).annotate(**source.aggregates):
+            totals.setdefault(row.pop(source.user_field), {}).update(row)
+
+    return {
+        user_id: empty | totals.get(user_id, {})
+        for user_id in (totals if user_ids is None else user_ids)
+    }
+
+
+def refresh_meters(users: Iterable[int] | QuerySet[Any], *sources: str) -> None:
+    """Recomputes the given sources (default: all) on the ledgers of `users`.
+
+    Users without a ledger yet are skipped, since theirs gets built in full
+    the first time it is read. This is what the receivers in `rpg.signals`
+    call, and what code doing bulk writes (which skip signals) should call."""
+    ledgers = list(MeterLedger.objects.filter(user__in=users))
+    if not ledgers:
+        return
+    totals = compute_meter_totals(
+        [ledger.user_id for ledger in ledgers],
+        sources or None,  # type: ignore[attr-defined]
     )
-    total_clubs: float = (
-        (pset_data["clubs_any"] or 0)
-        + (pset_data["clubs_D"] or 0) * BONUS_D_UNIT
-        + (pset_data["clubs_Z"] or 0) * BONUS_Z_UNIT
+    now = timezone.now()
+    fields: set[str] = {"updated_at"}
+    for ledger in ledgers:
+        for key, value in totals[ledger.user_id].items():  # type: ignore[attr-defined]
+            setattr(ledger, key, value)
+            fields.add(key)
+        ledger.updated_at = now
+    MeterLedger.objects.bulk_update(ledgers, fields=sorted(fields), batch_size=100)
+
+
+def ensure_meter_ledgers(users: Iterable[int] | QuerySet[Any]) -> None:
+    """Makes sure the ledgers of `users` exist and are current.
+
+    Missing ones are built from scratch, and ones which a closing market
+    has made stale get their market spades recomputed."""
+    rows = (
+        User.objects.filter(pk__in=users)
+        .filter(
+            Q(meter_ledger__isnull=True) | Q(meter_ledger__stale_at__lte=timezone.now())
+        )
+        .values_list("pk", "meter_ledger")
     )
-    total_hearts: int = pset_data["hearts"] or 0
+    missing: list[int] = []
+    stale: list[int] = []
+    for user_id, ledger_id in rows:
+        (missing if ledger_id is None else stale).append(user_id)
+    if stale:
+        refresh_meters(stale, "markets")
+    if missing:
+        totals = compute_meter_totals(missing)
+        MeterLedger.objects.bulk_create(
+            [MeterLedger(user_id=user_id, **totals[user_id]) for user_id in missing],
+            batch_size=100,
+            ignore_conflicts=True,
+        )
+
+
+def get_meter_values(totals: Any) -> dict[str, float]:
+    """Turns the MeterLedger columns on `totals` into the four meter values.
+
+    `totals` can be a ledger, or a student coming out of
+    `annotate_student_queryset_with_scores`, which has the same attributes."""
+
+    def get(name: str) -> float:
+        return getattr(totals, name, 0) or 0
+
+    return {
+        "clubs": get("clubs_any")
+        + BONUS_D_UNIT * get("clubs_D")
+        + BONUS_Z_UNIT * get("clubs_Z"),
+        "hearts": get("hearts"),
+        "spades": 2 * get("spades_quizzes")
+        + get("spades_quests")
+        + 3 * get("spades_count_mocks")
+        + get("spades_suggestions")
+        + get("spades_markets")
+        + get("spades_jobs")
+        + get("spades_hanabi"),
+        "diamonds": get("diamonds"),
+    }
 
-    if leveldict is not None:
-        leveldict["psets"] = psets
-        leveldict["pset_data"] = pset_data
 
-    return total_clubs, total_hearts
+def get_level_info(
+    student: Student, profile: UserProfile | None = None
+) -> LevelInfoDict:
+    """Computes a student's levels and data from their meter ledger,
+    returning the findings as a typed dictionary.
+    Pass the student's `profile` if it's already loaded to save a query."""
+    profiles = [profile] if profile is not None else []
+    return get_level_info_bulk([student], profiles)[student.pk]
 
 
-def get_diamond_stats(student: Student) -> int:
-    diamond_qset = AchievementUnlock.objects.filter(user=student.user)
-    total_diamonds = diamond_qset.aggregate(s=Sum("achievement__diamonds"))["s"] or 0
+def get_level_info_bulk(
+    students: Iterable[Student], profiles: Iterable[UserProfile] = ()
+) -> dict[int, LevelInfoDict]:
+    """Computes `get_level_info` for many students at once, keyed by student pk.
+    Profiles of their users that are already loaded can be passed in `profiles`.
 
-    return total_diamonds
+    The number of queries doesn't depend on how many students there are."""
+    students = list(students)
+    user_ids = {student.user_id for student in students}  # type: ignore[attr-defined]
+    ensure_meter_ledgers(user_ids)
 
+    ledgers = {
+        ledger.user_id: ledger  # type: ignore[attr-defined]
+        for ledger in MeterLedger.objects.filter(user__in=user_ids)
+    }
+    dynamic_progress: dict[int, bool] = {
+        profile.user_id: profile.dynamic_progress  # type: ignore[attr-defined]
+        for profile in profiles
+    }
+    if missing := user_ids - dynamic_progress.keys():
+        dynamic_progress |= dict(
+            UserProfile.objects.filter(user__in=missing).values_list(
+                "user", "dynamic_progress"
+            )
+        )
+    suggest_unit_sets: dict[int, SuggestUnitSet] = defaultdict(set)
+    for user_id, *unit in ProblemSuggestion.objects.filter(
+        user__in=user_ids,
+        status__in=("SUGG_NOK", "SUGG_OK"),
+        eligible=True,
+    ).values_list("user", "unit__pk", "unit__group__name", "unit__code"):
+        suggest_unit_sets[user_id].add(tuple(unit))  # type: ignore[arg-type]
+
+    level_table = get_level_table()
+
+    result: dict[int, LevelInfoDict] = {}
+    for student in students:
+        user_id: int = student.user_id  # type: ignore[attr-defined]
+        ledger = ledgers[user_id]
+        values = get_meter_values(ledger)
+        progress = dynamic_progress.get(user_id, False)
+        meters: FourMetersDict = {
+            "clubs": Meter.ClubMeter(int(values["clubs"]), progress),
+            "hearts": Meter.HeartMeter(round(values["hearts"], 2), progress),
+            "diamonds": Meter.DiamondMeter(int(values["diamonds"]), progress),
+            "spades": Meter.SpadeMeter(round(values["spades"], 1), progress),
+        }
+
+        # Real component of level
+        level_number = sum(meter.level for meter in meters.values())  # type: ignore
+        level_name = level_table.get_name(level_number)
 
-def get_spade_stats(student: Student, leveldict: LevelInfoDict = None) -> int:
-    total_spades = 0
+        # Imaginary component of level
+        im_level_number = sum(meter.im_level for meter in meters.values())  # type: ignore
+        if im_level_number == 0:
+            str_im_level = ""
+        elif im_level_number == 1:
+            str_im_level = "+ i"
+        else:
+            str_im_level = f"+ {im_level_number}i"
+
+        level_data = LevelInfoDict()  # type: ignore
+        get_meter_details(student, ledger, level_data)
+        level_data["suggest_unit_set"] = suggest_unit_sets[user_id]
+        level_data["meters"] = meters
+        level_data["level_number"] = level_number
+        level_data["level_name"] = level_name
+        level_data["is_maxed"] = level_number >= level_table.max_level
+        level_data["bonus_levels"] = BonusLevel.objects.filter(level__lte=level_number)
+        level_data["str_im_level"] = str_im_level
+        result[student.pk] = level_data
+
+    return result
+
+
+def get_meter_details(
+    student: Student, ledger: MeterLedger, leveldict: LevelInfoDict
+) -> None:
+    """Fills in the rows itemizing each meter, as shown on the stats page.
+    The querysets are lazy, so this costs nothing unless they get displayed."""
+    user_id = student.user_id  # type: ignore[attr-defined]
+
+    psets = PSet.objects.filter(student__user=user_id, status="A", eligible=True)
+    psets = psets.select_related("unit__group", "upload")
+    leveldict["psets"] = psets.order_by("upload__created_at")
+    leveldict["pset_data"] = {
+        key: getattr(ledger, key)
+        for key in ("clubs_any", "clubs_D", "clubs_Z", "hearts")
+    }
 
-    # a billion unrelated spades items lol
-    quiz_attempts = ExamAttempt.objects.filter(student__user=student.user)
-    quiz_attempts = quiz_attempts.order_by("quiz__family", "quiz__number")
-    total_spades = (quiz_attempts.aggregate(total=Sum("score"))["total"] or 0) * 2
+    quiz_attempts = ExamAttempt.objects.filter(student__user=user_id)
+    leveldict["quiz_attempts"] = quiz_attempts.order_by("quiz__family", "quiz__number")
 
-    quest_completes = QuestComplete.objects.filter(student__user=student.user)
-    quest_completes = quest_completes.order_by("-timestamp")
-    total_spades += quest_completes.aggregate(total=Sum("spades"))["total"] or 0
+    quest_completes = QuestComplete.objects.filter(student__user=user_id)
+    leveldict["quest_completes"] = quest_completes.order_by("-timestamp")
 
-    mock_completes = MockCompleted.objects.filter(student__user=student.user)
+    mock_completes = MockCompleted.objects.filter(student__user=user_id)
     mock_completes = mock_completes.select_related("exam")
-    mock_completes = mock_completes.order_by("exam__family", "exam__number")
-    total_spades += mock_completes.count() * 3
+    leveldict["mock_completes"] = mock_completes.order_by(
+        "exam__family", "exam__number"
+    )
 
-    market_guesses = (
+    leveldict["market_guesses"] = (
         Guess.objects.filter(
-            user=student.user,
+            user=user_id,
             market__end_date__lt=timezone.now(),
         )
         .order_by("-market__end_date")
         .select_related("market")
     )
-    total_spades += market_guesses.aggregate(total=Sum("score"))["total"] or 0
-
-    suggested_units_queryset = ProblemSuggestion.objects.filter(
-        user=student.user,
-        status__in=("SUGG_NOK", "SUGG_OK"),
-        eligible=True,
-    ).values_list(
-        "unit__pk",
-        "unit__group__name",
-        "unit__code",
-    )
-    suggest_units_set: SuggestUnitSet = set(suggested_units_queryset)
-    total_spades += len(suggest_units_set)
 
-    completed_jobs = Job.objects.filter(
-        assignee__user=student.user, progress="JOB_VFD"
+    leveldict["completed_jobs"] = Job.objects.filter(
+        assignee__user=user_id, progress="JOB_VFD"
     ).select_related("folder")
-    total_spades += completed_jobs.aggregate(total=Sum("spades_bounty"))["total"] or 0
 
-    hanabi_replays = HanabiReplay.objects.filter(
+    leveldict["hanabi_replays"] = HanabiReplay.objects.filter(
         contest__processed=True,
-        hanabiparticipation__player__user=student.user,
+        hanabiparticipation__player__user=user_id,
     )
-    total_spades += hanabi_replays.aggregate(total=Sum("spades_score"))["total"] or 0
-
-    if leveldict is not None:
-        leveldict["quiz_attempts"] = quiz_attempts
-        leveldict["quest_completes"] = quest_completes
-        leveldict["market_guesses"] = market_guesses
-        leveldict["mock_completes"] = mock_completes
-        leveldict["suggest_unit_set"] = suggest_units_set
-        leveldict["completed_jobs"] = completed_jobs
-        leveldict["hanabi_replays"] = hanabi_replays
-
-    return total_spades
 
 
 def annotate_student_queryset_with_scores(
@@ -326,37 +587,12 @@ def annotate_student_queryset_with_scores(
 ) -> QuerySet[Student]:
     """Helper function for constructing large lists of students
     Selects all important information to prevent a bunch of SQL queries"""
-    guess_subquery = (
-        Guess.objects.filter(
-            user=OuterRef("user"),
-            market__end_date__lt=timezone.now(),
-        )
-        .order_by()
-        .values("user")
-        .annotate(total=Sum("score"))
-        .values("total")
-    )
+    ensure_meter_ledgers(queryset.values("user"))
 
     return queryset.select_related(
         "user", "user__profile", "assistant", "semester"
     ).annotate(
         num_psets=SubqueryCount("pset", filter=Q(status="A", eligible=True)),
-        clubs_any=SubquerySum(
-            "user__student__pset__clubs", filter=Q(status="A", eligible=True)
-        ),
-        clubs_D=SubquerySum(
-            "user__student__pset__clubs",
-            filter=Q(status="A", eligible=True, unit__code__startswith="D"),
-        ),
-        clubs_Z=SubquerySum(
-            "user__student__pset__clubs",
-            filter=Q(status="A", eligible=True, unit__code__startswith="Z"),
-        ),
-        hearts=SubquerySum(
-            "user__student__pset__hours",
-            filter=Q(status="A", eligible=True),
-        ),
-        diamonds=SubquerySum("user__achievementunlock__achievement__diamonds"),
         pset_B_count=SubqueryCount(
             "pset__pk",
             filter=Q(eligible=True, unit__code__startswith="B"),
@@ -370,22 +606,7 @@ def annotate_student_queryset_with_scores(
             filter=Q(eligible=True, unit__code__startswith="Z"),
         ),
         num_semesters=SubqueryCount("user__student"),
-        spades_quizzes=SubquerySum("user__student__examattempt__score"),
-        spades_quests=SubquerySum("user__student__questcomplete__spades"),
-        spades_markets=Subquery(guess_subquery),  # type: ignore
-        spades_count_mocks=SubqueryCount("user__student__mockcompleted"),
-        spades_suggestions=SubqueryCount(
-            "user__problemsuggestion__unit__pk",
-            filter=Q(status__in=("SUGG_NOK", "SUGG_OK"), eligible=True),
-        ),
-        spades_jobs=SubquerySum(
-            "user__workers__job__spades_bounty",
-            filter=Q(progress="JOB_VFD"),
-        ),
-        spades_hanabi=SubquerySum(
-            "user__hanabiplayer__hanabiparticipation__replay__spades_score",
-            filter=Q(contest__processed=True),
-        ),
+        **{name: F(f"user__meter_ledger__{name}") for name in METER_LEDGER_FIELDS},
     )
 
 
@@ -396,33 +617,14 @@ def compute_insanity_rating(b: int, d: int, z: int) -> float:
 
 def get_student_rows(queryset: QuerySet[Student]) -> list[dict[str, Any]]:
     rows: list[dict[str, Any]] = []
-    levels: dict[int, str] = {
-        level.threshold: level.name for level in Level.objects.all()
-    }
-    if not levels:
-        levels[0] = "No level"
-    max_level = max(levels.keys())
-
-    for student in annotate_student_queryset_with_scores(queryset):
-        row: dict[str, Any] = {
-            "student": student,
-            "spades": (getattr(student, "spades_quizzes", 0) or 0) * 2,
-        }
-        row["spades"] += getattr(student, "spades_quests", 0) or 0
-        row["spades"] += (getattr(student, "spades_count_mocks", 0) or 0) * 3
-        row["spades"] += getattr(student, "spades_suggestions", 0) or 0
-        row["spades"] += getattr(student, "spades_markets", 0) or 0
-        row["spades"] += getattr(student, "spades_jobs", 0) or 0
-        row["spades"] += getattr(student, "spades_hanabi", 0) or 0
-        row["hearts"] = getattr(student, "hearts", 0) or 0
-        row["clubs"] = getattr(student, "clubs_any", 0) or 0
-        row["clubs"] += BONUS_D_UNIT * (getattr(student, "clubs_D", 0) or 0)
-        row["clubs"] += BONUS_Z_UNIT * (getattr(student, "clubs_Z", 0) or 0)
-        row["diamonds"] = getattr(student, "diamonds", 0) or 0
-        row["level"] = sum(
-            int(max(row[k], 0) ** 0.5)
-            for k in ("spades", "hearts", "clubs", "diamonds")
-        )
+    students = list(annotate_student_queryset_with_scores(queryset))
+    level_info = get_level_info_bulk(students)
+
+    for student in students:
+        row: dict[str, Any] = {"student": student}
+        row |= get_meter_values(student)
+        row["level"] = level_info[student.pk]["level_number"]
+        row["level_name"] = level_info[student.pk]["level_name"]
         try:
             row["last_seen"] = student.user.profile.last_seen
         except UserProfile.DoesNotExist:
@@ -432,10 +634,6 @@ def get_student_rows(queryset: QuerySet[Student]) -> list[dict[str, Any]]:
             student.pset_D_count,  # type: ignore
             student.pset_Z_count,  # type: ignore
         )
-        if row["level"] > max_level:
-            row["level_name"] = levels[max_level]
-        else:
-            row["level_name"] = levels.get(row["level"], "No level")
         rows.append(row)
     rows.sort(
         key=lambda row: (
@@ -448,6 +646,72 @@ def get_student_rows(queryset: QuerySet[Student]) -> list[dict[str, Any]]:
     return rows
 
 
+# The leaderboard page recomputes a snapshot older than this when it's viewed
+LEADERBOARD_SNAPSHOT_MAX_AGE = datetime.timedelta(minutes=15)
+# Held by the view recomputing a stale snapshot, so others serve the old one;
+# it lapses on its own if that request dies halfway
+LEADERBOARD_REFRESH_LOCK_KEY = "rpg-leaderboard-refresh"
+LEADERBOARD_REFRESH_LOCK_SECONDS = 5 * 60
+
+
+def take_leaderboard_snapshot() -> LeaderboardSnapshot:
+    """Ranks the active students for the leaderboard and saves the rows,
+    deleting any older snapshots (but not newer ones, taken concurrently)."""
+    students = Student.objects.filter(semester__active=True, enabled=True, legit=True)
+    rows = get_student_rows(students)
+    rows.sort(
+        key=lambda row: (
+            -row["level"],
+            -row["clubs"],
+            -row["hearts"],
+            -row["spades"],
+            -row["diamonds"],
+            row["student"].name.upper(),
+        )
+    )
+    snapshot = LeaderboardSnapshot.objects.create(
+        rows=[
+            {
+                "student": {
+                    "pk": row["student"].pk,
+                    "name": row["student"].name,
+                    "num_semesters": row["student"].num_semesters,
+                },
+                "level": row["level"],
+                "level_name": row["level_name"],
+                "clubs": row["clubs"],
+                "hearts": row["hearts"],
+                "spades": row["spades"],
+                "diamonds": row["diamonds"],
+                "insanity": row["insanity"],
+                "last_seen": row["last_seen"].isoformat(),
+            }
+            for row in rows
+        ]
+    )
+    LeaderboardSnapshot.objects.filter(created_at__lt=snapshot.created_at).delete()
+    return snapshot
+
+
+def get_leaderboard_snapshot() -> LeaderboardSnapshot:
+    """Returns the latest leaderboard snapshot, taking a new one first
+    if there is none or it is older than LEADERBOARD_SNAPSHOT_MAX_AGE.
+
+    Only one caller at a time refreshes a stale snapshot; the others get
+    the stale one meanwhile."""
+    snapshot = LeaderboardSnapshot.objects.order_by("-created_at").first()
+    if snapshot is None:
+        return take_leaderboard_snapshot()
+    if timezone.now() - snapshot.created_at > LEADERBOARD_SNAPSHOT_MAX_AGE and (
+        cache.add(LEADERBOARD_REFRESH_LOCK_KEY, 1, LEADERBOARD_REFRESH_LOCK_SECONDS)
+    ):
+        try:
+            snapshot = take_leaderboard_snapshot()
+        finally:
+            cache.delete(LEADERBOARD_REFRESH_LOCK_KEY)
+    return snapshot
+
+
 def check_level_up(student: Student, level_info: LevelInfoDict) -> bool:
     if not student.semester.active:
         return False
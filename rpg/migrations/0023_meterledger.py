@@ -0,0 +1,130 @@
+# Generated by Django 6.0.9 on 2026-10-18 03:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rpg", "0022_set_new_unlocks"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MeterLedger",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "clubs_any",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="Clubs from all eligible accepted psets",
+                        null=True,
+                    ),
+                ),
+                (
+                    "clubs_D",
+                    models.IntegerField(
+                        blank=True, help_text="Clubs from psets on D units", null=True
+                    ),
+                ),
+                (
+                    "clubs_Z",
+                    models.IntegerField(
+                        blank=True, help_text="Clubs from psets on Z units", null=True
+                    ),
+                ),
+                (
+                    "hearts",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Hours from all eligible accepted psets",
+                        null=True,
+                    ),
+                ),
+                (
+                    "diamonds",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="Diamonds from unlocked achievements",
+                        null=True,
+                    ),
+                ),
+                (
+                    "spades_quizzes",
+                    models.IntegerField(
+                        blank=True, help_text="Total score on quizzes", null=True
+                    ),
+                ),
+                (
+                    "spades_quests",
+                    models.IntegerField(
+                        blank=True, help_text="Spades from completed quests", null=True
+                    ),
+                ),
+                (
+                    "spades_count_mocks",
+                    models.IntegerField(
+                        default=0, help_text="Number of mock exams completed"
+                    ),
+                ),
+                (
+                    "spades_markets",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Score on markets that have closed",
+                        null=True,
+                    ),
+                ),
+                (
+                    "spades_suggestions",
+                    models.IntegerField(
+                        default=0,
+                        help_text="Number of distinct units with a suggestion",
+                    ),
+                ),
+                (
+                    "spades_jobs",
+                    models.IntegerField(
+                        blank=True, help_text="Spades from verified jobs", null=True
+                    ),
+                ),
+                (
+                    "spades_hanabi",
+                    models.FloatField(
+                        blank=True,
+                        help_text="Spades from processed Hanabi contests",
+                        null=True,
+                    ),
+                ),
+                (
+                    "stale_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When the totals next change on their own (a market closing); blank if never",
+                        null=True,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        help_text="The user whose meters these are",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="meter_ledger",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0.9 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rpg", "0023_meterledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, help_text="When the rows were computed"
+                    ),
+                ),
+                (
+                    "rows",
+                    models.JSONField(help_text="The leaderboard rows, in rank order"),
+                ),
+            ],
+            options={
+                "get_latest_by": "created_at",
+            },
+        ),
+    ]
@@ -268,6 +268,94 @@ class QuestComplete(models.Model):
         return f"{self.title} " + self.timestamp.strftime("%c")
 
 
+class MeterLedger(models.Model):
+    """Running totals behind a user's four meters, one column per source.
+
+    The columns hold the raw aggregates (e.g. the summed quiz scores, not yet
+    doubled into spades); `rpg.levelsys.get_meter_values` turns them into
+    meter values. They are kept up to date by the receivers in `rpg.signals`,
+    and `manage.py rebuild_meters` recomputes everything from scratch.
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name="meter_ledger",
+        help_text="The user whose meters these are",
+    )
+    clubs_any = models.IntegerField(
+        null=True, blank=True, help_text="Clubs from all eligible accepted psets"
+    )
+    clubs_D = models.IntegerField(
+        null=True, blank=True, help_text="Clubs from psets on D units"
+    )
+    clubs_Z = models.IntegerField(
+        null=True, blank=True, help_text="Clubs from psets on Z units"
+    )
+    hearts = models.FloatField(
+        null=True, blank=True, help_text="Hours from all eligible accepted psets"
+    )
+    diamonds = models.IntegerField(
+        null=True, blank=True, help_text="Diamonds from unlocked achievements"
+    )
+    spades_quizzes = models.IntegerField(
+        null=True, blank=True, help_text="Total score on quizzes"
+    )
+    spades_quests = models.IntegerField(
+        null=True, blank=True, help_text="Spades from completed quests"
+    )
+    spades_count_mocks = models.IntegerField(
+        default=0, help_text="Number of mock exams completed"
+    )
+    spades_markets = models.FloatField(
+        null=True, blank=True, help_text="Score on markets that have closed"
+    )
+    spades_suggestions = models.IntegerField(
+        default=0, help_text="Number of distinct units with a suggestion"
+    )
+    spades_jobs = models.IntegerField(
+        null=True, blank=True, help_text="Spades from verified jobs"
+    )
+    spades_hanabi = models.FloatField(
+        null=True, blank=True, help_text="Spades from processed Hanabi contests"
+    )
+    stale_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the totals next change on their own (a market closing); "
+        "blank if never",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Meters for {self.user.username}"
+
+    @property
+    def is_stale(self) -> bool:
+        return self.stale_at is not None and self.stale_at <= timezone.now()
+
+
+class LeaderboardSnapshot(models.Model):
+    """The ranked leaderboard as of some point in time.
+
+    Computing the leaderboard means computing the levels of every active
+    student, so the page shows the latest snapshot instead. Viewing the page
+    refreshes it once it is older than LEADERBOARD_SNAPSHOT_MAX_AGE (see
+    `rpg.levelsys`); staff and `manage.py snapshot_leaderboard` can refresh
+    it sooner."""
+
+    created_at = models.DateTimeField(
+        auto_now_add=True, help_text="When the rows were computed"
+    )
+    rows = models.JSONField(help_text="The leaderboard rows, in rank order")
+
+    class Meta:
+        get_latest_by = "created_at"
+
+    def __str__(self) -> str:
+        return f"Leaderboard as of {self.created_at}"
+
+
 class BonusLevel(models.Model):
     group = models.OneToOneField(UnitGroup, on_delete=models.CASCADE)
     level = models.PositiveSmallIntegerField(help_text="Level to spawn at")
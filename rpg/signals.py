@@ -0,0 +1,152 @@
+# Keeps the MeterLedger rows in step with the tables feeding the meters,
+# and the cached level table in step with the Level table.
+# Writes made with QuerySet.update() or bulk_create() bypass these receivers,
+# so code doing those calls refresh_meters itself; rebuild_meters fixes anything else.
+
+from typing import Any
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.models import Unit
+from dashboard.models import PSet
+from exams.models import ExamAttempt, MockCompleted
+from hanabi.models import (
+    HanabiContest,
+    HanabiParticipation,
+    HanabiPlayer,
+    HanabiReplay,
+)
+from markets.models import Guess, Market
+from payments.models import Job, Worker
+from roster.models import Student
+from suggestions.models import ProblemSuggestion
+
+from .levelsys import invalidate_level_table, refresh_meters
+from .models import Achievement, AchievementUnlock, Level, QuestComplete
+
+
+def student_user(student_id: int) -> Any:
+    return Student.objects.filter(pk=student_id).values("user")
+
+
+@receiver((post_save, post_delete), sender=PSet)
+def pset_changed(sender: type[PSet], instance: PSet, **kwargs: Any) -> None:
+    refresh_meters(student_user(instance.student_id), "psets")  # type: ignore[attr-defined]
+
+
+@receiver(post_save, sender=Unit)
+def unit_changed(sender: type[Unit], instance: Unit, **kwargs: Any) -> None:
+    # the clubs bonus depends on the unit code
+    users = PSet.objects.filter(unit=instance).values("student__user")
+    refresh_meters(users, "psets")
+
+
+@receiver((post_save, post_delete), sender=AchievementUnlock)
+def unlock_changed(
+    sender: type[AchievementUnlock], instance: AchievementUnlock, **kwargs: Any
+) -> None:
+    refresh_meters([instance.user_id], "achievements")  # type: ignore[attr-defined]
+
+
+@receiver(post_save, sender=Achievement)
+def achievement_changed(
+    sender: type[Achievement], instance: Achievement, **kwargs: Any
+) -> None:
+    users = AchievementUnlock.objects.filter(achievement=instance).values("user")
+    refresh_meters(users, "achievements")
+
+
+@receiver((post_save, post_delete), sender=ExamAttempt)
+def attempt_changed(
+    sender: type[ExamAttempt], instance: ExamAttempt, **kwargs: Any
+) -> None:
+    refresh_meters(student_user(instance.student_id), "quizzes")  # type: ignore[attr-defined]
+
+
+@receiver((post_save, post_delete), sender=QuestComplete)
+def quest_changed(
+    sender: type[QuestComplete], instance: QuestComplete, **kwargs: Any
+) -> None:
+    refresh_meters(student_user(instance.student_id), "quests")  # type: ignore[attr-defined]
+
+
+@receiver((post_save, post_delete), sender=MockCompleted)
+def mock_changed(
+    sender: type[MockCompleted], instance: MockCompleted, **kwargs: Any
+) -> None:
+    refresh_meters(student_user(instance.student_id), "mocks")  # type: ignore[attr-defined]
+
+
+@receiver((post_save, post_delete), sender=Guess)
+def guess_changed(sender: type[Guess], instance: Guess, **kwargs: Any) -> None:
+    refresh_meters([instance.user_id], "markets")  # type: ignore[attr-defined]
+
+
+@receiver(post_save, sender=Market)
+def market_changed(sender: type[Market], instance: Market, **kwargs: Any) -> None:
+    # moving the end date can open or close the market
+    refresh_meters(Guess.objects.filter(market=instance).values("user"), "markets")
+
+
+@receiver((post_save, post_delete), sender=ProblemSuggestion)
+def suggestion_changed(
+    sender: type[ProblemSuggestion], instance: ProblemSuggestion, **kwargs: Any
+) -> None:
+    refresh_meters([instance.user_id], "suggestions")  # type: ignore[attr-defined]
+
+
+@receiver((post_save, post_delete), sender=Job)
+def job_changed(sender: type[Job], instance: Job, **kwargs: Any) -> None:
+    if instance.assignee_id is not None:  # type: ignore[attr-defined]
+        users = Worker.objects.filter(pk=instance.assignee_id).values("user")  # type: ignore[attr-defined]
+        refresh_meters(users, "jobs")
+
+
+@receiver(post_save, sender=HanabiReplay)
+def replay_changed(
+    sender: type[HanabiReplay], instance: HanabiReplay, **kwargs: Any
+) -> None:
+    users = HanabiParticipation.objects.filter(replay=instance)
+    refresh_meters(users.values("player__user"), "hanabi")
+
+
+@receiver(pre_delete, sender=HanabiReplay)
+def replay_deleting(
+    sender: type[HanabiReplay], instance: HanabiReplay, **kwargs: Any
+) -> None:
+    # the participations are gone by the time post_delete fires
+    users = HanabiParticipation.objects.filter(replay=instance)
+    instance._meter_users = list(users.values_list("player__user", flat=True))  # type: ignore[attr-defined]
+
+
+@receiver(post_delete, sender=HanabiReplay)
+def replay_deleted(
+    sender: type[HanabiReplay], instance: HanabiReplay, **kwargs: Any
+) -> None:
+    refresh_meters(getattr(instance, "_meter_users", []), "hanabi")
+
+
+@receiver((post_save, post_delete), sender=HanabiParticipation)
+def participation_changed(
+    sender: type[HanabiParticipation], instance: HanabiParticipation, **kwargs: Any
+) -> None:
+    users = HanabiPlayer.objects.filter(pk=instance.player_id).values("user")  # type: ignore[attr-defined]
+    refresh_meters(users, "hanabi")
+
+
+@receiver(post_save, sender=HanabiContest)
+def contest_changed(
+    sender: type[HanabiContest], instance: HanabiContest, **kwargs: Any
+) -> None:
+    users = HanabiParticipation.objects.filter(replay__contest=instance)
+    refresh_meters(users.values("player__user"), "hanabi")
+
+
+@receiver((post_save, post_delete), sender=Level)
+def level_changed(sender: type[Level], instance: Level, **kwargs: Any) -> None:
+    # once now for this process, and again in case another process
+    # re-reads the table before the transaction commits
+    invalidate_level_table()
+    transaction.on_commit(invalidate_level_table)
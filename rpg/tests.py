@@ -3,11 +3,17 @@ import datetime
 import pytest
 from django.contrib.auth.models import Group, User
 from django.contrib.messages import constants as message_levels
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from freezegun.api import freeze_time
 
 from core.factories import GroupFactory, UnitFactory, UserFactory
 from dashboard.factories import PSetFactory
 from exams.factories import ExamAttemptFactory, PracticeExamFactory
+from markets.factories import GuessFactory
 from payments.factories import JobFactory, WorkerFactory
 from roster.factories import StudentFactory
 from roster.models import Student
@@ -21,9 +27,15 @@ from rpg.factories import (
     VulnerabilityRecordFactory,
 )
 from rpg.levelsys import (
+    LEADERBOARD_REFRESH_LOCK_KEY,
+    LEADERBOARD_SNAPSHOT_MAX_AGE,
+    LEVEL_TABLE_TTL,
     annotate_student_queryset_with_scores,
     get_level_info,
+    get_level_info_bulk,
+    get_level_table,
     get_student_rows,
+    take_leaderboard_snapshot,
 )
 from rpg.models import (
     GUESS_CODE_MAX_LENGTH,
@@ -32,6 +44,9 @@ from rpg.models import (
     Achievement,
     AchievementCodeGuess,
     AchievementUnlock,
+    LeaderboardSnapshot,
+    Level,
+    MeterLedger,
 )
 
 UTC = datetime.UTC
@@ -302,6 +317,172 @@ def test_multi_student_annotate(otis, alice_with_data):
     otis.get_20x("leaderboard")
 
 
+@pytest.mark.django_db
+def test_leaderboard_snapshot(otis, alice_with_data):
+    alice = get_alice()
+    admin = UserFactory.create(is_staff=True, is_superuser=True)
+    otis.login(admin)
+
+    resp = otis.get_20x("leaderboard")
+    rows = resp.context["rows"]
+    assert len(rows) == 1
+    assert rows[0]["student"]["pk"] == alice.pk
+    assert rows[0]["level"] == 38
+    snapshot = resp.context["snapshot"]
+
+    # later page views serve the same snapshot, even once it is out of date
+    bob = StudentFactory.create()
+    PSetFactory.create(student=bob, clubs=1000, hours=100, status="A")
+    resp = otis.get_20x("leaderboard")
+    assert resp.context["snapshot"] == snapshot
+    assert len(resp.context["rows"]) == 1
+
+    otis.post_30x("leaderboard")
+    resp = otis.get_20x("leaderboard")
+    rows = resp.context["rows"]
+    assert [row["student"]["pk"] for row in rows] == [bob.pk, alice.pk]
+    assert LeaderboardSnapshot.objects.count() == 1
+
+    # once the snapshot is old enough, viewing the page recomputes it,
+    # unless another view is already doing so
+    carol = StudentFactory.create()
+    later = (
+        timezone.now() + LEADERBOARD_SNAPSHOT_MAX_AGE + datetime.timedelta(minutes=1)
+    )
+    with freeze_time(later):
+        cache.add(LEADERBOARD_REFRESH_LOCK_KEY, 1)
+        resp = otis.get_20x("leaderboard")
+        assert carol.pk not in {row["student"]["pk"] for row in resp.context["rows"]}
+        cache.delete(LEADERBOARD_REFRESH_LOCK_KEY)
+        resp = otis.get_20x("leaderboard")
+    assert carol.pk in {row["student"]["pk"] for row in resp.context["rows"]}
+    assert LeaderboardSnapshot.objects.count() == 1
+
+    # a snapshot that finishes after a newer one was taken leaves it alone
+    newer = LeaderboardSnapshot.objects.get()
+    with freeze_time(newer.created_at - datetime.timedelta(seconds=1)):
+        take_leaderboard_snapshot()
+    assert LeaderboardSnapshot.objects.filter(pk=newer.pk).exists()
+
+
+@pytest.mark.django_db
+def test_meter_ledger_follows_writes(alice_with_data):
+    alice = get_alice()
+    get_level_info(alice)
+    ledger = MeterLedger.objects.get(user=alice.user)
+    assert ledger.clubs_any == 400
+    assert ledger.spades_quizzes == 7
+
+    pset = PSetFactory.create(
+        student=alice, clubs=10, hours=1, status="A", unit__code="DAX"
+    )
+    QuestCompleteFactory.create(student=alice, spades=3)
+    ledger.refresh_from_db()
+    assert ledger.clubs_any == 410
+    assert ledger.clubs_D == 110
+    assert ledger.spades_quests == 8
+
+    pset.delete()
+    ledger.refresh_from_db()
+    assert ledger.clubs_any == 400
+    assert get_level_info(alice)["meters"]["spades"].value == 22
+
+
+@pytest.mark.django_db
+def test_meter_ledger_market_closes(alice_with_data):
+    alice = get_alice()
+    end = timezone.now() + datetime.timedelta(days=3)
+    GuessFactory.create(user=alice.user, market__end_date=end, score=2.5)
+    assert get_level_info(alice)["meters"]["spades"].value == 19
+    assert MeterLedger.objects.get(user=alice.user).stale_at == end
+
+    with freeze_time(end + datetime.timedelta(days=1)):
+        assert get_level_info(alice)["meters"]["spades"].value == 21.5
+        ledger = MeterLedger.objects.get(user=alice.user)
+        assert ledger.spades_markets == 2.5
+        assert ledger.stale_at is None
+
+
+@pytest.mark.django_db
+def test_rebuild_meters(alice_with_data):
+    alice = get_alice()
+    get_level_info(alice)
+    MeterLedger.objects.filter(user=alice.user).update(hearts=1, diamonds=None)
+    bob = StudentFactory.create()
+    PSetFactory.create(student=bob, clubs=7, hours=2, status="A")
+
+    call_command("rebuild_meters")
+    ledger = MeterLedger.objects.get(user=alice.user)
+    assert ledger.hearts == 84
+    assert ledger.diamonds == 11
+    assert MeterLedger.objects.get(user=bob.user).clubs_any == 7
+
+
+@pytest.mark.django_db
+def test_level_info_bulk(alice_with_data):
+    alice = get_alice()
+    students = [alice] + StudentFactory.create_batch(3)
+    for student in students[1:]:
+        PSetFactory.create(student=student, clubs=16, hours=4, status="A")
+
+    def count_queries(students: list[Student]) -> int:
+        students = list(Student.objects.filter(pk__in=[s.pk for s in students]))
+        with CaptureQueriesContext(connection) as ctx:
+            get_level_info_bulk(students)
+        return len(ctx.captured_queries)
+
+    info = get_level_info_bulk(students)
+    assert info[alice.pk]["level_number"] == 38
+    assert info[alice.pk]["level_name"] == "Level 38"
+    assert (
+        info[alice.pk]["meters"]["clubs"].value
+        == get_level_info(alice)["meters"]["clubs"].value
+    )
+    for student in students[1:]:
+        assert info[student.pk]["meters"]["hearts"].value == 4
+        assert info[student.pk]["level_number"] == 6
+
+    StudentFactory.create_batch(6)
+    get_level_info_bulk(Student.objects.all())  # builds the missing ledgers
+    assert count_queries(students[:1]) == count_queries(list(Student.objects.all()))
+
+
+@pytest.mark.django_db
+def test_level_table_cache(alice_with_data):
+    table = get_level_table()
+    assert table.max_level == 50
+    assert table.get_name(0) == "No level"
+    assert table.get_name(38) == "Level 38"
+    assert table.get_name(999) == "Level 50"
+
+    with CaptureQueriesContext(connection) as ctx:
+        assert get_level_table() is table
+    assert len(ctx.captured_queries) == 0
+
+    LevelFactory.create(threshold=60, name="Sixty")
+    table = get_level_table()
+    assert table.max_level == 60
+    assert table.get_name(61) == "Sixty"
+
+    Level.objects.get(threshold=60).delete()
+    assert get_level_table().max_level == 50
+
+
+@pytest.mark.django_db
+def test_level_table_expires(alice_with_data, monkeypatch):
+    table = get_level_table()
+    # a change made by another worker, whose version bump this process'
+    # cache never sees
+    Level.objects.filter(threshold=50).update(name="Fifty")
+    assert get_level_table() is table
+
+    read_at = table.read_at
+    monkeypatch.setattr(
+        "rpg.levelsys.time.monotonic", lambda: read_at + LEVEL_TABLE_TTL + 1
+    )
+    assert get_level_table().get_name(50) == "Fifty"
+
+
 @pytest.mark.django_db
 def test_submit_diamond_and_read_solution(otis, alice_with_data):
     alice = get_alice()
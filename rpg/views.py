@@ -1,5 +1,6 @@
 import logging
 import random
+from datetime import timedelta
 from typing import Any
 
 from braces.views import LoginRequiredMixin
@@ -12,9 +13,10 @@ from django.core.exceptions import PermissionDenied
 from django.db.models import F, OuterRef
 from django.db.models.query import QuerySet
 from django.forms.models import BaseModelForm
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from django.views.generic import ListView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import UpdateView
@@ -29,7 +31,13 @@ from roster.utils import get_student_by_pk, infer_student
 from rpg.models import VulnerabilityRecord
 
 from .forms import DiamondsForm
-from .levelsys import LevelInfoDict, get_level_info, get_student_rows
+from .levelsys import (
+    LEADERBOARD_SNAPSHOT_MAX_AGE,
+    LevelInfoDict,
+    get_leaderboard_snapshot,
+    get_level_info,
+    take_leaderboard_snapshot,
+)
 from .models import (
     GUESS_CODE_MAX_LENGTH,
     WRONG_GUESS_LIMIT,
@@ -252,21 +260,20 @@ class FoundList(LoginRequiredMixin, StaffRequiredMixin, ListView[AchievementUnlo
 
 @staff_required
 def leaderboard(request: AuthHttpRequest) -> HttpResponse:
-    students = Student.objects.filter(semester__active=True, enabled=True, legit=True)
-    rows = get_student_rows(students)
-    rows.sort(
-        key=lambda row: (
-            -row["level"],
-            -row["clubs"],
-            -row["hearts"],
-            -row["spades"],
-            -row["diamonds"],
-            row["student"].name.upper(),
-        )
-    )
+    if request.method == "POST":
+        take_leaderboard_snapshot()
+        messages.success(request, "Recomputed the leaderboard.")
+        return HttpResponseRedirect(reverse("leaderboard"))
+
+    snapshot = get_leaderboard_snapshot()
+    rows = snapshot.rows
     for row in rows:
-        row["days_since_last_seen"] = get_days_since(row["last_seen"])
-    context: dict[str, Any] = {"rows": rows}
+        row["days_since_last_seen"] = get_days_since(parse_datetime(row["last_seen"]))
+    context: dict[str, Any] = {
+        "rows": rows,
+        "snapshot": snapshot,
+        "max_age_minutes": LEADERBOARD_SNAPSHOT_MAX_AGE // timedelta(minutes=1),
+    }
     return render(request, "rpg/leaderboard.html", context)
 
 
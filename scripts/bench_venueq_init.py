@@ -0,0 +1,138 @@
+"""Compares JsonResponse and StreamingJsonResponse on a large VenueQ init.
+
+Run from the repository root against a local database, e.g.
+`python scripts/bench_venueq_init.py --rows 50000`. The queue it builds is
+created in a transaction that is rolled back at the end, and it refuses to
+run with IS_PRODUCTION set.
+"""
+
+# Django models can't be imported before the app registry is ready,
+# hence the imports sitting below the django.setup() call.
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+import django
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "otisweb.settings")
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.query import QuerySet
+from django.http.response import JsonResponse
+from django.utils import timezone
+
+from aincrad.views import venueq_sync
+from core.json_stream import StreamingJsonResponse
+from core.models import Semester, Unit, UnitGroup
+from dashboard.models import PSet
+from roster.models import Student
+
+UNITS = 50
+
+
+def fill_queue(rows: int) -> None:
+    """Create `rows` pending problem sets in a fresh active semester."""
+    semester = Semester.objects.create(
+        name="Benchmark semester", active=True, end_year=timezone.now().year + 1
+    )
+    units = [
+        Unit.objects.create(
+            group=UnitGroup.objects.create(
+                name=f"Benchmark group {i}", slug=f"benchmark-group-{i}"
+            ),
+            code="BBM",
+        )
+        for i in range(UNITS)
+    ]
+    users = User.objects.bulk_create(
+        User(username=f"benchmark{i}", first_name="Bench", last_name=f"Mark {i}")
+        for i in range((rows + UNITS - 1) // UNITS)
+    )
+    students = Student.objects.bulk_create(
+        Student(user=user, semester=semester) for user in users
+    )
+    PSet.objects.bulk_create(
+        (
+            PSet(
+                student=students[i // UNITS],
+                unit=units[i % UNITS],
+                status="P",
+                hours=3,
+                clubs=10,
+                feedback="Some feedback " * 10,
+            )
+            for i in range(rows)
+        ),
+        batch_size=2000,
+    )
+
+
+def evaluate(data: Any) -> Any:
+    """Replace the querysets in `data` with lists of their rows."""
+    if isinstance(data, dict):
+        return {key: evaluate(value) for key, value in data.items()}
+    if isinstance(data, list | QuerySet):
+        return [evaluate(row) for row in data]
+    return data
+
+
+def measure(build: Any) -> tuple[float, float, int]:
+    """Time building and reading a response, then separately its peak memory."""
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in build())
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    for _ in build():  # as the WSGI server would, one chunk at a time
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compares JsonResponse and StreamingJsonResponse "
+        "on a large VenueQ init."
+    )
+    parser.add_argument(
+        "--rows", type=int, default=50_000, help="pending psets in the queue"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if settings.PRODUCTION:
+        sys.exit("This fills the database with fake students; not in production.")
+    # everything is created in a transaction that is rolled back at the end
+    with transaction.atomic():
+        fill_queue(args.rows)
+
+        def buffered() -> JsonResponse:
+            # what the init action sent before it streamed
+            return JsonResponse(evaluate(venueq_sync(None)))
+
+        for name, build in (
+            ("JsonResponse", buffered),
+            ("Streaming", lambda: StreamingJsonResponse(venueq_sync(None))),
+        ):
+            elapsed, peak, size = measure(build)
+            print(
+                f"{name:>12}: {elapsed:.2f}s, "
+                f"output {size / 2**20:.1f} MiB, "
+                f"peak memory {peak / 2**20:.1f} MiB"
+            )
+        transaction.set_rollback(True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Times each watermark engine on a large PDF.
+
+Run from the repository root, e.g. `python scripts/bench_watermark.py --pages
+400`. It only reads settings and never touches the database.
+"""
+
+# Django models can't be imported before the app registry is ready,
+# hence the imports sitting below the django.setup() call.
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import django
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "otisweb.settings")
+django.setup()
+
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from reportlab.pdfgen.canvas import Canvas
+
+from core.watermark import watermark_pdf
+
+ENGINES = ("rewrite", "incremental")
+
+
+def make_pdf(pages: int) -> bytes:
+    """Return a compressed PDF with `pages` pages of dense text."""
+    buffer = io.BytesIO()
+    canvas = Canvas(buffer, pagesize=(612, 792), pageCompression=1)
+    for page in range(pages):
+        for line in range(60):
+            canvas.drawString(
+                72, 740 - 11 * line, f"Page {page + 1} line {line + 1}: " + "x" * 70
+            )
+        canvas.showPage()
+    canvas.save()
+    return buffer.getvalue()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Times each watermark engine on a large PDF."
+    )
+    parser.add_argument(
+        "--pages", type=int, default=400, help="pages in the generated PDF"
+    )
+    parser.add_argument("--runs", type=int, default=3, help="runs per engine")
+    parser.add_argument(
+        "--file", type=Path, help="benchmark this PDF instead of a generated one"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.file is not None:
+        content = args.file.read_bytes()
+    else:
+        content = make_pdf(args.pages)
+    print(f"Input is {len(content) / 2**20:.1f} MiB")
+
+    user = User(pk=1, username="benchmark", email="benchmark@example.com")
+    for engine in ENGINES:
+        with override_settings(WATERMARK_ENGINE=engine):
+            timings: list[float] = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                out = watermark_pdf(content, user)
+                timings.append(time.perf_counter() - start)
+            # tracing slows everything down, so memory gets a run of its own
+            tracemalloc.start()
+            watermark_pdf(content, user)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        print(
+            f"{engine:>12}: {statistics.median(timings):.2f}s median, "
+            f"output {len(out) / 2**20:.1f} MiB, "
+            f"peak memory {peak / 2**20:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
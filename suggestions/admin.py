@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.db.models import QuerySet
 from django.http import HttpRequest
+from django.utils import timezone
+
+from rpg.levelsys import refresh_meters
 
 from .models import ProblemSuggestion
 
@@ -50,12 +53,14 @@ class ProblemSuggestionAdmin(admin.ModelAdmin):
     def mark_eligible(
         self, request: HttpRequest, queryset: QuerySet[ProblemSuggestion]
     ):
-        queryset.update(eligible=True)
+        queryset.update(eligible=True, updated_at=timezone.now())
+        refresh_meters(queryset.values("user"), "suggestions")
 
     def mark_uneligible(
         self, request: HttpRequest, queryset: QuerySet[ProblemSuggestion]
     ):
-        queryset.update(eligible=False)
+        queryset.update(eligible=False, updated_at=timezone.now())
+        refresh_meters(queryset.values("user"), "suggestions")
 
     actions = (
         "mark_eligible",